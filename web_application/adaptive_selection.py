@@ -0,0 +1,321 @@
+# adaptive_selection.py - Adaptive question selection for start_quiz
+#
+# Questions of every subject/grade bucket are split by difficulty band and
+# topic (source file), and each split gets an alias table over per-question
+# weights, so drawing a question costs O(1) however large the bank is.
+# A learner's recent accuracy sets the easy/medium/hard mix, topics are
+# balanced by sampling the less used of two random topics, and recently
+# seen questions and near-duplicates of questions already picked are
+# skipped by rejection.
+#
+# Learner history is cached per process and loaded from question_attempts
+# with one indexed query the first time a learner asks for an adaptive
+# quiz, and again once the cached copy is LEARNER_TTL seconds old so that
+# quizzes finished on other workers are picked up.
+
+import random
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+
+BANDS = ('easy', 'medium', 'hard')
+
+# Recent answers used for a learner's accuracy and the seen-question filter
+RECENT_QUESTIONS = 200
+
+# Prior of 3 correct out of 5 for learners with little or no history
+PRIOR_CORRECT = 3
+PRIOR_ANSWERED = 5
+
+# Draws from a band before giving up on unseen/unpicked questions
+MAX_TRIES = 8
+
+# Seconds a cached learner history is used before it is read again
+LEARNER_TTL = 30
+
+# Names that do not identify a learner, so get no history
+ANONYMOUS_NAMES = ('', 'anonymous')
+
+LEARNER_HISTORY_SQL = '''
+    SELECT a.question_id, a.is_correct
+    FROM quiz_sessions s JOIN question_attempts a ON a.session_id = s.id
+    WHERE s.user_name = ?
+    ORDER BY s.created_at DESC, s.id DESC, a.id DESC
+    LIMIT ?
+'''
+
+
+def band_of(difficulty):
+    """Band of an effective difficulty; unknown labels count as medium"""
+    return difficulty if difficulty in BANDS else 'medium'
+
+
+def band_mix(accuracy):
+    """Relative share of easy/medium/hard questions for a learner's accuracy"""
+    # Stronger learners see more hard questions and weaker ones more easy
+    # ones, keeping their expected accuracy near the middle of the range
+    skill = min(max(accuracy, 0.0), 1.0)
+    return {'easy': (1 - skill) ** 2 + 0.05, 'medium': 0.5, 'hard': skill ** 2 + 0.05}
+
+
+def question_weight(discrimination):
+    """Sampling weight from a question's discrimination (None when unmeasured)"""
+    if discrimination is None:
+        return 1.0
+    # Favour questions that separate strong from weak learners; questions
+    # that do the opposite are kept but rarely drawn
+    return min(1.5, max(0.2, 0.5 + discrimination))
+
+
+class AliasTable:
+    """Vose alias table for O(1) weighted sampling of indexes"""
+
+    __slots__ = ('prob', 'alias')
+
+    def __init__(self, weights):
+        count = len(weights)
+        total = sum(weights)
+        scaled = [weight * count / total for weight in weights] if total > 0 else [1.0] * count
+        self.prob = array('d', [1.0] * count)
+        self.alias = array('I', range(count))
+
+        small = [i for i, value in enumerate(scaled) if value < 1.0]
+        large = [i for i, value in enumerate(scaled) if value >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            (small if scaled[more] < 1.0 else large).append(more)
+
+    def sample(self):
+        slot = int(random.random() * len(self.prob))
+        return slot if random.random() < self.prob[slot] else self.alias[slot]
+
+
+class TopicGroup:
+    """Positions of one topic within a bucket and band, with their alias table"""
+
+    __slots__ = ('positions', 'table')
+
+    def __init__(self, positions, weights):
+        self.positions = positions
+        self.table = AliasTable(weights)
+
+    def sample(self):
+        return self.positions[self.table.sample()]
+
+
+class AdaptiveSelector:
+    """Per-bucket sampling structures for adaptive quizzes over a QuestionIndex
+
+    Built lazily per (subject, grade, band) on first use; create a new
+    selector when the index's difficulties change.
+    """
+
+    def __init__(self, index, discriminations=None):
+        self.index = index
+        self.discriminations = discriminations or {}
+        self.difficulties = set(index.difficulty_names) | set(index.difficulty_overrides.values())
+        self._groups = {}
+        self._plans = {}
+
+    def _topic_groups(self, pair, band):
+        """TopicGroups of one subject/grade bucket and band"""
+        groups = self._groups.get(pair + (band,))
+        if groups is not None:
+            return groups
+
+        questions = self.index.questions
+        by_topic = {}
+        for difficulty in self.difficulties:
+            if band_of(difficulty) != band:
+                continue
+            for position in self.index.difficulty_buckets.get(pair + (difficulty,), ()):
+                question = questions[position]
+                topic = by_topic.setdefault(question.source_file or question.subject, ([], []))
+                topic[0].append(position)
+                topic[1].append(question_weight(self.discriminations.get(question.id)))
+
+        groups = [TopicGroup(array('I', positions), weights)
+                  for positions, weights in by_topic.values()]
+        self._groups[pair + (band,)] = groups
+        return groups
+
+    def _plan(self, subject_key, grade_key):
+        """{band: [TopicGroup]} for a normalized subject/grade filter"""
+        plan = self._plans.get((subject_key, grade_key))
+        if plan is not None:
+            return plan
+
+        pairs = self.index.matching_pairs(subject_key, grade_key)
+        plan = {band: [group for pair in pairs for group in self._topic_groups(pair, band)]
+                for band in BANDS}
+        if len(self._plans) < self.index.MAX_RESOLVED:
+            self._plans[(subject_key, grade_key)] = plan
+        return plan
+
+    def select(self, subject=None, grade=None, limit=10, accuracy=None, seen=(), difficulty=None):
+        """Pick up to `limit` questions for a learner, avoiding `seen` question ids"""
+        subject_key, grade_key, difficulty_key = self.index.filter_keys(subject, grade, difficulty)
+        plan = self._plan(subject_key, grade_key)
+
+        if difficulty_key is not None:
+            mix = {difficulty_key: 1.0}
+        else:
+            mix = band_mix(PRIOR_CORRECT / PRIOR_ANSWERED if accuracy is None else accuracy)
+        remaining = {band: sum(len(group.positions) for group in plan[band])
+                     for band in mix if plan.get(band)}
+
+        questions = self.index.questions
+        positions_by_id = self.index.positions_by_id
+        duplicate_groups = self.index.duplicate_groups
+        avoid = {positions_by_id[question_id] for question_id in seen if question_id in positions_by_id}
+        picks = {band: [0] * len(plan[band]) for band in remaining}
+        # Resumable scans of each band, for when random draws keep failing
+        unseen_scans = {}
+        any_scans = {}
+        picked = []
+        # Picked positions plus the near-duplicates of picked questions
+        picked_set = set()
+
+        while len(picked) < limit and remaining:
+            bands = list(remaining)
+            band = random.choices(bands, [mix[name] for name in bands])[0]
+            position = self._draw(plan[band], picks[band], picked_set, avoid)
+            if position is None:
+                # Unseen questions first; seen ones only once none are left
+                scan = unseen_scans.setdefault(band, self._scan(plan[band], picked_set, avoid))
+                position = next(scan, None)
+            if position is None:
+                position = self._draw(plan[band], picks[band], picked_set, ())
+            if position is None:
+                scan = any_scans.setdefault(band, self._scan(plan[band], picked_set, ()))
+                position = next(scan, None)
+            if position is None:
+                # Only duplicates of picked questions are left in this band
+                del remaining[band]
+                continue
+            remaining[band] -= 1
+            if not remaining[band]:
+                del remaining[band]
+            picked.append(position)
+            picked_set.add(position)
+            for question_id in duplicate_groups.get(questions[position].id, ()):
+                if question_id in positions_by_id:
+                    picked_set.add(positions_by_id[question_id])
+
+        return [questions[position] for position in picked]
+
+    @staticmethod
+    def _draw(groups, picks, picked, avoid):
+        """Random position from the less used of two random topics, or None"""
+        for _ in range(MAX_TRIES):
+            first = int(random.random() * len(groups))
+            second = int(random.random() * len(groups))
+            group_num = first if picks[first] <= picks[second] else second
+            position = groups[group_num].sample()
+            if position not in picked and position not in avoid:
+                picks[group_num] += 1
+                return position
+        return None
+
+    @staticmethod
+    def _scan(groups, picked, avoid):
+        """Generate the unpicked positions not in `avoid` of a band, from a random start"""
+        # A position skipped here stays picked or avoided, so one generator is
+        # resumed for the whole quiz; all its calls together step over at most
+        # len(picked) + len(avoid) positions besides the ones they yield
+        start = int(random.random() * len(groups))
+        for group in groups[start:] + groups[:start]:
+            positions = group.positions
+            offset = int(random.random() * len(positions))
+            for index in range(offset - len(positions), offset):
+                position = positions[index]
+                if position not in picked and position not in avoid:
+                    yield position
+
+
+class Learner:
+    """A learner's recently seen questions and recent answer results"""
+
+    __slots__ = ('seen', 'results', 'loaded_at')
+
+    def __init__(self):
+        self.seen = deque(maxlen=RECENT_QUESTIONS)
+        self.results = deque(maxlen=RECENT_QUESTIONS)
+        self.loaded_at = time.monotonic()
+
+    @property
+    def accuracy(self):
+        return (sum(self.results) + PRIOR_CORRECT) / (len(self.results) + PRIOR_ANSWERED)
+
+
+class LearnerHistory:
+    """LRU of Learners, each loaded from question_attempts on first use and reloaded after `ttl` seconds"""
+
+    def __init__(self, db, max_learners=10000, ttl=LEARNER_TTL):
+        self.db = db
+        self.max_learners = max_learners
+        self.ttl = ttl
+        self._learners = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_anonymous(user_name):
+        return (user_name or '').strip().lower() in ANONYMOUS_NAMES
+
+    def get(self, user_name):
+        """Learner for a user name, or None for anonymous users"""
+        if self.is_anonymous(user_name):
+            return None
+        with self._lock:
+            learner = self._learners.get(user_name)
+            if learner is not None and time.monotonic() - learner.loaded_at < self.ttl:
+                self._learners.move_to_end(user_name)
+                return learner
+
+        learner = Learner()
+        rows = self.db.connection().execute(LEARNER_HISTORY_SQL, (user_name, RECENT_QUESTIONS)).fetchall()
+        for question_id, is_correct in reversed(rows):
+            learner.seen.append(question_id)
+            learner.results.append(bool(is_correct))
+
+        with self._lock:
+            cached = self._learners.get(user_name)
+            if cached is None or cached.loaded_at < learner.loaded_at:
+                self._learners[user_name] = learner
+                self._learners.move_to_end(user_name)
+            else:
+                learner = cached
+            if len(self._learners) > self.max_learners:
+                self._learners.popitem(last=False)
+        return learner
+
+    def snapshot(self, user_name):
+        """(accuracy, set of recently seen question ids) for a user name, or None for anonymous users
+
+        Copied under the lock, as requests for the same learner append to
+        the deques concurrently.
+        """
+        learner = self.get(user_name)
+        if learner is None:
+            return None
+        with self._lock:
+            return learner.accuracy, set(learner.seen)
+
+    def mark_seen(self, user_name, question_ids):
+        """Record questions served to a learner already in the cache"""
+        with self._lock:
+            learner = self._learners.get(user_name)
+            if learner is not None:
+                learner.seen.extend(question_ids)
+
+    def record(self, user_name, answers):
+        """Record finished answers of a learner already in the cache"""
+        results = [bool(answer['is_correct']) for answer in answers]
+        with self._lock:
+            learner = self._learners.get(user_name)
+            if learner is not None:
+                learner.results.extend(results)
@@ -0,0 +1,248 @@
+# analytics.py - Per-question difficulty analytics from question_attempts
+#
+# Per-question aggregates are kept as additive sums in question_stats, so
+# each refresh only reads attempts added since the last one (tracked by a
+# watermark on question_attempts.id) and folds them in with vectorized
+# pandas/NumPy group-bys.
+#
+# Discrimination is the point-biserial correlation between answering the
+# question correctly and the score of the session it was answered in,
+# which can be computed exactly from running sums. Median time comes from
+# a fixed-width time histogram per question.
+
+import sqlite3
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Time histogram: BIN_SECONDS wide bins, the last one collecting everything slower
+BIN_SECONDS = 5
+TIME_BINS = 61
+
+# Attempts needed before an empirical difficulty replaces the bank's label
+MIN_ATTEMPTS = 10
+EASY_ACCURACY = 0.7
+HARD_ACCURACY = 0.4
+
+# Attempts read from the database per chunk
+CHUNK_ROWS = 500000
+
+SUM_COLUMNS = ['attempts', 'correct', 'sum_score', 'sum_score_sq', 'sum_correct_score']
+
+
+def create_analytics_tables(conn):
+    """Create the per-question stats and watermark tables"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS question_stats (
+            question_id INTEGER PRIMARY KEY,
+            attempts INTEGER NOT NULL,
+            correct INTEGER NOT NULL,
+            sum_score REAL NOT NULL,
+            sum_score_sq REAL NOT NULL,
+            sum_correct_score REAL NOT NULL,
+            time_histogram BLOB NOT NULL,
+            accuracy REAL,
+            median_time REAL,
+            discrimination REAL,
+            difficulty TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_state (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    ''')
+
+
+def read_new_attempts(conn, after_id):
+    """Yield DataFrames of attempts with id > after_id, joined to their session score"""
+    query = '''
+        SELECT a.id, a.question_id, a.is_correct, a.time_spent, s.score_percentage
+        FROM question_attempts a JOIN quiz_sessions s ON s.id = a.session_id
+        WHERE a.id > ?
+        ORDER BY a.id
+    '''
+    yield from pd.read_sql_query(query, conn, params=(after_id,), chunksize=CHUNK_ROWS)
+
+
+def aggregate_attempts(attempts):
+    """Additive per-question sums and time histograms for a chunk of attempts"""
+    correct = attempts['is_correct'].fillna(0).astype(np.int64).to_numpy()
+    score = attempts['score_percentage'].fillna(0).to_numpy(dtype=np.float64)
+    time_spent = attempts['time_spent'].fillna(0).to_numpy(dtype=np.float64)
+
+    codes, question_ids = pd.factorize(attempts['question_id'], sort=True)
+    count = len(question_ids)
+    sums = pd.DataFrame({
+        'attempts': np.bincount(codes, minlength=count),
+        'correct': np.bincount(codes, weights=correct, minlength=count),
+        'sum_score': np.bincount(codes, weights=score, minlength=count),
+        'sum_score_sq': np.bincount(codes, weights=score * score, minlength=count),
+        'sum_correct_score': np.bincount(codes, weights=correct * score, minlength=count),
+    }, index=pd.Index(question_ids, name='question_id'))
+
+    bins = np.clip(time_spent // BIN_SECONDS, 0, TIME_BINS - 1).astype(np.int64)
+    histograms = np.bincount(codes * TIME_BINS + bins, minlength=count * TIME_BINS)
+    return sums, histograms.reshape(count, TIME_BINS)
+
+
+def derive_metrics(sums, histograms):
+    """Accuracy, median time, discrimination and difficulty from the running sums"""
+    n = sums['attempts'].to_numpy(dtype=np.float64)
+    x = sums['correct'].to_numpy(dtype=np.float64)
+    y = sums['sum_score'].to_numpy()
+    yy = sums['sum_score_sq'].to_numpy()
+    xy = sums['sum_correct_score'].to_numpy()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        accuracy = np.where(n > 0, x / n, np.nan)
+        # Pearson correlation with a binary x (sum x^2 == sum x)
+        denominator = np.sqrt((n * x - x * x) * (n * yy - y * y))
+        discrimination = np.where(denominator > 0, (n * xy - x * y) / denominator, np.nan)
+
+    cumulative = histograms.cumsum(axis=1)
+    median_bin = (cumulative < (cumulative[:, -1:] / 2)).sum(axis=1)
+    median_time = np.where(n > 0, (median_bin + 0.5) * BIN_SECONDS, np.nan)
+
+    difficulty = np.where(accuracy >= EASY_ACCURACY, 'easy',
+                          np.where(accuracy < HARD_ACCURACY, 'hard', 'medium')).astype(object)
+    difficulty[n < MIN_ATTEMPTS] = None
+
+    return pd.DataFrame({
+        'accuracy': accuracy,
+        'median_time': median_time,
+        'discrimination': discrimination,
+        'difficulty': difficulty,
+    }, index=sums.index)
+
+
+def load_existing(conn, question_ids):
+    """Current sums and histograms for the given questions"""
+    placeholders = ','.join('?' * len(question_ids))
+    rows = conn.execute(
+        f'SELECT question_id, {", ".join(SUM_COLUMNS)}, time_histogram FROM question_stats '
+        f'WHERE question_id IN ({placeholders})', question_ids
+    ).fetchall()
+    sums = pd.DataFrame([row[:-1] for row in rows], columns=['question_id'] + SUM_COLUMNS).set_index('question_id')
+    histograms = {row[0]: np.frombuffer(row[-1], dtype=np.int64) for row in rows}
+    return sums, histograms
+
+
+def refresh_question_stats(conn):
+    """Fold attempts added since the last refresh into question_stats; returns rows read"""
+    create_analytics_tables(conn)
+    start_watermark = watermark = read_watermark(conn)
+
+    total_sums = None
+    total_histograms = None
+    rows_read = 0
+    for chunk in read_new_attempts(conn, watermark):
+        if chunk.empty:
+            continue
+        rows_read += len(chunk)
+        watermark = int(chunk['id'].iloc[-1])
+        sums, histograms = aggregate_attempts(chunk)
+        histograms = pd.DataFrame(histograms, index=sums.index)
+        if total_sums is None:
+            total_sums, total_histograms = sums, histograms
+        else:
+            total_sums = total_sums.add(sums, fill_value=0)
+            total_histograms = total_histograms.add(histograms, fill_value=0)
+
+    if total_sums is None:
+        return 0
+
+    # Fold in what earlier refreshes accumulated for the same questions
+    question_ids = [int(question_id) for question_id in total_sums.index]
+    existing_sums, existing_histograms = [], {}
+    for start in range(0, len(question_ids), 900):
+        part_sums, part_histograms = load_existing(conn, question_ids[start:start + 900])
+        existing_sums.append(part_sums)
+        existing_histograms.update(part_histograms)
+    existing = pd.concat(existing_sums)
+    if not existing.empty:
+        total_sums = total_sums.add(existing, fill_value=0)
+        previous = pd.DataFrame.from_dict(existing_histograms, orient='index')
+        total_histograms = total_histograms.add(previous, fill_value=0)
+
+    histograms = total_histograms.reindex(total_sums.index).fillna(0).to_numpy(dtype=np.int64)
+    metrics = derive_metrics(total_sums, histograms)
+
+    rows = list(zip(
+        total_sums.index.astype(np.int64).tolist(),
+        total_sums['attempts'].astype(np.int64).tolist(),
+        total_sums['correct'].astype(np.int64).tolist(),
+        total_sums['sum_score'].tolist(),
+        total_sums['sum_score_sq'].tolist(),
+        total_sums['sum_correct_score'].tolist(),
+        [histogram.tobytes() for histogram in histograms],
+        _nullable(metrics['accuracy']),
+        _nullable(metrics['median_time']),
+        _nullable(metrics['discrimination']),
+        metrics['difficulty'].tolist(),
+    ))
+
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        if read_watermark(conn) != start_watermark:
+            # Another refresh folded in the same attempts first; drop this one
+            return 0
+        conn.executemany('''
+            INSERT OR REPLACE INTO question_stats
+            (question_id, attempts, correct, sum_score, sum_score_sq, sum_correct_score,
+             time_histogram, accuracy, median_time, discrimination, difficulty)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        conn.execute("INSERT OR REPLACE INTO analytics_state (name, value) VALUES ('last_attempt_id', ?)",
+                     (watermark,))
+    return rows_read
+
+
+def read_watermark(conn):
+    """Id of the last attempt folded into question_stats"""
+    row = conn.execute("SELECT value FROM analytics_state WHERE name = 'last_attempt_id'").fetchone()
+    return row[0] if row else 0
+
+
+def _nullable(series):
+    """Series as a list of floats with NaN mapped to None"""
+    return [None if pd.isna(value) else value for value in series.tolist()]
+
+
+def load_difficulties(conn):
+    """Empirical difficulties as {question_id: difficulty}"""
+    create_analytics_tables(conn)
+    return dict(conn.execute('SELECT question_id, difficulty FROM question_stats WHERE difficulty IS NOT NULL'))
+
+
+def load_discriminations(conn):
+    """Discrimination of questions with enough attempts as {question_id: discrimination}"""
+    create_analytics_tables(conn)
+    return dict(conn.execute('SELECT question_id, discrimination FROM question_stats '
+                             'WHERE attempts >= ? AND discrimination IS NOT NULL', (MIN_ATTEMPTS,)))
+
+
+def read_question_stats(conn, question_id=None, order_by='discrimination', limit=100):
+    """Derived per-question metrics, for one question or the top `limit` by a metric"""
+    create_analytics_tables(conn)
+    columns = ['question_id', 'attempts', 'accuracy', 'median_time', 'discrimination', 'difficulty']
+    if question_id is not None:
+        rows = conn.execute(f'SELECT {", ".join(columns)} FROM question_stats WHERE question_id = ?',
+                            (question_id,)).fetchall()
+    else:
+        if order_by not in columns:
+            raise ValueError(f"Cannot order by {order_by}")
+        rows = conn.execute(f'SELECT {", ".join(columns)} FROM question_stats '
+                            f'ORDER BY {order_by} IS NULL, {order_by} DESC LIMIT ?', (limit,)).fetchall()
+    return [dict(zip(columns, row)) for row in rows]
+
+
+if __name__ == '__main__':
+    # Incremental refresh from the command line: python analytics.py [quiz_results.db]
+    from data_paths import data_path
+
+    default_db = data_path('quiz_results.db')
+    conn = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else default_db)
+    print(f"Processed {refresh_question_stats(conn)} new attempts")
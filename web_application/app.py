@@ -1,12 +1,35 @@
 # app.py - Main Flask Application for BEnQA Quiz Platform
 
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, Response, g, render_template, request, jsonify, session, redirect, url_for
 from flask_cors import CORS
-import json
-import random
+import gzip
+import hmac
+from functools import partial
+import logging
 import os
+import time
 from datetime import datetime
-import sqlite3
+
+from adaptive_selection import AdaptiveSelector, LearnerHistory
+from bank_cache import (CachedBank, LiveBank, archive_bank_cache, load_archived_bank, load_packed_bank,
+                        load_question_bank)
+from bank_snapshot import (BankReloader, BankSnapshot, SnapshotRegistry, bank_version, parse_snapshot_version,
+                           snapshot_version, source_stat)
+from data_paths import data_dir
+from database import Database
+from math_format import format_math_expressions
+import math_render
+from metrics import Metrics
+from paper_generator import PaperSpecError, generate_papers
+from payload_cache import MIN_COMPRESS_BYTES, PayloadCache, accepts_gzip, combined_etag, join_payloads
+from question_index import QuestionIndex
+from question_ingest import QuestionIngestor
+from question_search import QuestionSearch
+from result_export import FORMATS as EXPORT_FORMATS, export_chunks
+from result_history import create_history_tables, read_history, read_leaderboard, update_leaderboard
+from result_writer import ResultWriter
+from session_store import create_session_store
+from stats_rollup import average, create_rollup_tables, read_stats, update_rollups
 
 app = Flask(__name__)
 app.secret_key = 'benqa_quiz_secret_key_2024'
@@ -14,81 +37,180 @@ CORS(app)
 
 # Configuration
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_FILE = os.path.join(BASE_DIR, 'data', 'questions.json')
-DB_FILE = os.path.join(BASE_DIR, 'data', 'quiz_results.db')
+# Question bank, databases and caches: QUIZ_DATA_DIR, shared with the command-line
+# tools (benchmark.py points this at a scratch copy)
+DATA_DIR = data_dir()
+DATA_FILE = os.path.join(DATA_DIR, 'questions.json')
+BANK_CACHE_FILE = os.path.join(DATA_DIR, 'questions.bank')
+DB_FILE = os.path.join(DATA_DIR, 'quiz_results.db')
+SESSION_DB_FILE = os.path.join(DATA_DIR, 'quiz_state.db')
+SEARCH_DB_FILE = os.path.join(DATA_DIR, 'question_search.db')
+
+# Near-duplicate question groups written by duplicate_detection.py
+DUPLICATE_GROUPS_FILE = os.path.join(DATA_DIR, 'duplicate_groups.json')
+
+# Questions ingested at runtime and the source files they came from
+OVERLAY_FILE = os.path.join(DATA_DIR, 'questions_overlay.jsonl')
+INGEST_MANIFEST_FILE = os.path.join(DATA_DIR, 'ingest_manifest.json')
+
+# Seconds between checks of questions.json for changes (0 disables the watcher)
+BANK_RELOAD_INTERVAL = float(os.environ.get('QUIZ_BANK_RELOAD_INTERVAL', 5))
+
+# Token required by /api/admin endpoints; they are disabled when unset
+ADMIN_TOKEN = os.environ.get('QUIZ_ADMIN_TOKEN', '')
+
+# Server-side quiz state: 'memory' (single process) or 'sqlite' (shared by workers)
+QUIZ_SESSION_BACKEND = os.environ.get('QUIZ_SESSION_BACKEND', 'memory')
+QUIZ_SESSION_TTL = int(os.environ.get('QUIZ_SESSION_TTL', 3 * 60 * 60))
+
+# Pre-render question math to SVG on the server (needs matplotlib)
+PRERENDER_MATH = os.environ.get('QUIZ_PRERENDER_MATH', '0') == '1'
+MATH_FRAGMENT_DIR = os.path.join(DATA_DIR, 'math_fragments')
+
+# Answers accepted by one /submit_answers request, and idempotency keys
+# remembered per quiz so retried submissions are not applied twice
+MAX_BATCH_ANSWERS = 500
+MAX_ANSWER_KEYS = 1000
+
+# Times a request re-applies its change to a quiz that a concurrent request
+# for the same quiz wrote first
+QUIZ_UPDATE_ATTEMPTS = 5
+
+# Paper variants generated by one /api/papers request
+MAX_PAPER_VARIANTS = 500
+
+# Log level (DEBUG logs every quiz request's parameters)
+LOG_LEVEL = os.environ.get('QUIZ_LOG_LEVEL', 'INFO').upper()
+
+# Serve /metrics with request latency histograms and counters
+METRICS_ENABLED = os.environ.get('QUIZ_METRICS', '0') == '1'
+METRICS_DIR = os.path.join(DATA_DIR, 'metrics')
+
+# Write finished quizzes from a background thread in batched transactions
+RESULT_WRITE_BEHIND = os.environ.get('RESULT_WRITE_BEHIND', '1') == '1'
+
+# Statements reused on every write; sqlite3 keeps them prepared per connection
+INSERT_SESSION_SQL = '''
+    INSERT INTO quiz_sessions
+    (id, user_name, subject, grade, total_questions, correct_answers, score_percentage, time_taken)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+INSERT_ATTEMPT_SQL = '''
+    INSERT INTO question_attempts
+    (session_id, question_id, user_answer, correct_answer, is_correct, time_spent)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger('quiz')
+metrics = Metrics(METRICS_ENABLED, METRICS_DIR)
 
 class QuizApp:
     def __init__(self):
-        self.questions = self.load_questions()
+        self.db = Database(DB_FILE)
         self.init_database()
+        self.result_writer = ResultWriter(self.db, self.write_results)
+        self.learners = LearnerHistory(self.db)
+        self.math_renderer = None
+        if PRERENDER_MATH and math_render.is_available():
+            self.math_renderer = math_render.MathRenderer(MATH_FRAGMENT_DIR)
+        self.search = QuestionSearch(SEARCH_DB_FILE)
+        self.snapshots = SnapshotRegistry(self.build_snapshot(), QUIZ_SESSION_TTL, self.rebuild_snapshot)
+        self.reloader = BankReloader(self.snapshots, self.build_snapshot, DATA_FILE, BANK_RELOAD_INTERVAL)
+    
+    # The current snapshot's bank and derived structures
+    questions = property(lambda self: self.snapshots.current.questions)
+    index = property(lambda self: self.snapshots.current.index)
+    payloads = property(lambda self: self.snapshots.current.payloads)
+    selector = property(lambda self: self.snapshots.current.selector)
+    ingestor = property(lambda self: self.snapshots.current.ingestor)
+    
+    def build_snapshot(self):
+        """Load the bank with analytics and ingested questions applied as a new BankSnapshot"""
+        stat = source_stat(DATA_FILE)
+        questions, index = self.load_questions()
+        base_version = bank_version(questions)
+        if isinstance(questions.base, CachedBank):
+            # Other workers rebuild this version from the archive for quizzes started on it
+            try:
+                archive_bank_cache(BANK_CACHE_FILE, base_version, QUIZ_SESSION_TTL)
+            except OSError as e:
+                logger.warning('could not archive question bank version=%s: %s', base_version, e)
+        ingestor = QuestionIngestor(questions, index, OVERLAY_FILE, INGEST_MANIFEST_FILE)
+        ingestor.sync()
+        snapshot = self.assemble_snapshot(base_version, questions, ingestor, stat)
+        ingestor.on_change = partial(self.questions_changed, ingestor)
+        self.search.sync(snapshot.index, snapshot.version)
+        return snapshot
+    
+    def rebuild_snapshot(self, version):
+        """Rebuild a snapshot version made by another worker, or None if its bank is gone"""
+        parsed = parse_snapshot_version(version)
+        if parsed is None:
+            return None
+        base_version, overlay_offset = parsed
+        current = self.snapshots.current
+        if base_version == current.base_version:
+            base = current.questions.base
+        else:
+            base = load_archived_bank(BANK_CACHE_FILE, base_version)
+        if base is None or getattr(base, 'header', None) is None:
+            return None
+        
+        questions = LiveBank(base)
+        ingestor = QuestionIngestor(questions, QuestionIndex(questions, base.header['index']),
+                                    OVERLAY_FILE, INGEST_MANIFEST_FILE)
+        ingestor.sync(until=overlay_offset)
+        if ingestor.overlay_offset != overlay_offset:
+            return None
+        return self.assemble_snapshot(base_version, questions, ingestor)
+    
+    def assemble_snapshot(self, base_version, questions, ingestor, stat=None):
+        """BankSnapshot of a bank and the index its ingestor has applied the overlay to"""
+        snapshot = BankSnapshot(snapshot_version(base_version, ingestor.overlay_offset), questions,
+                                ingestor.index, PayloadCache(self.question_payload), stat, base_version)
+        self.apply_difficulties(snapshot)
+        self.apply_duplicate_groups(snapshot)
+        snapshot.ingestor = ingestor
+        return snapshot
+    
+    def questions_changed(self, ingestor, question_ids):
+        """Swap in a new snapshot after questions were ingested into a copy of the current index"""
+        current = self.snapshots.current
+        if current.ingestor is not ingestor:
+            # A reload replaced the snapshot this ingestor belongs to
+            return
+        snapshot = current.fork(snapshot_version(current.base_version, ingestor.overlay_offset),
+                                ingestor.index, question_ids)
+        self.snapshots.swap(snapshot)
+        self.search.update(snapshot.index, question_ids)
     
     def load_questions(self):
-        """Load questions from JSON file"""
+        """Load questions and their index, preferring the preprocessed bank cache"""
         try:
-            with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                questions = json.load(f)
-                
-            # Process questions to format mathematical expressions
-            for question in questions:
-                question['question'] = self.format_math_expressions(question['question'])
-                for key, option in question.get('options', {}).items():
-                    question['options'][key] = self.format_math_expressions(option)
-                    
-            return questions
+            return load_question_bank(DATA_FILE, BANK_CACHE_FILE)
         except FileNotFoundError:
-            print(f"Error: {DATA_FILE} not found!")
-            return []
+            logger.error('question bank %s not found', DATA_FILE)
+            bank = LiveBank([])
+            return bank, QuestionIndex(bank)
+        except OSError as e:
+            # Cache could not be written (e.g. read-only data dir); pack in memory
+            logger.warning('question bank cache unavailable (%s), loading %s', e, DATA_FILE)
+            return load_packed_bank(DATA_FILE)
     
     def format_math_expressions(self, text):
         """Format mathematical expressions for MathJax rendering"""
-        if not text:
-            return text
-            
-        # Convert common LaTeX patterns to MathJax format
-        import re
-        
-        # Handle inline fractions: \frac{a}{b} -> $\frac{a}{b}$
-        text = re.sub(r'\\frac\{([^}]+)\}\{([^}]+)\}', r'$\\frac{\1}{\2}$', text)
-        
-        # Handle exponents: x^2 -> $x^2$
-        text = re.sub(r'(\w+)\^(\{[^}]+\}|\w+)', r'$\1^{\2}$', text)
-        
-        # Handle square roots: \sqrt{x} -> $\sqrt{x}$
-        text = re.sub(r'\\sqrt\{([^}]+)\}', r'$\\sqrt{\1}$', text)
-        
-        # Handle subscripts: x_1 -> $x_1$
-        text = re.sub(r'(\w+)_(\{[^}]+\}|\w+)', r'$\1_{\2}$', text)
-        
-        # Handle common mathematical symbols
-        replacements = {
-            '\\cdot': '$\\cdot$',
-            '\\times': '$\\times$',
-            '\\div': '$\\div$',
-            '\\pm': '$\\pm$',
-            '\\infty': '$\\infty$',
-            '\\pi': '$\\pi$',
-            '\\theta': '$\\theta$',
-            '\\alpha': '$\\alpha$',
-            '\\beta': '$\\beta$',
-            '\\gamma': '$\\gamma$',
-            '\\delta': '$\\delta$',
-        }
-        
-        for latex, mathjax in replacements.items():
-            text = text.replace(latex, mathjax)
-        
-        # Handle display math (equations on their own line)
-        text = re.sub(r'\\\[(.*?)\\\]', r'$$\1$$', text, flags=re.DOTALL)
-        text = re.sub(r'\\\((.*?)\\\)', r'$\1$', text, flags=re.DOTALL)
-        
-        return text
+        return format_math_expressions(text)
     
     def init_database(self):
         """Initialize SQLite database for storing results"""
-        conn = sqlite3.connect(DB_FILE)
+        with self.db.transaction() as conn:
+            self.create_tables(conn)
+    
+    def create_tables(self, conn):
+        """Create result tables if missing"""
         cursor = conn.cursor()
         
-        # Create tables
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS quiz_sessions (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -116,77 +238,114 @@ class QuizApp:
             )
         ''')
         
-        conn.commit()
-        conn.close()
-    
-    def get_filtered_questions(self, subject=None, grade=None, limit=10):
-        """Get filtered questions based on criteria"""
-        filtered = self.questions.copy()
-        
-        # Debug: Print available subjects and grades
-        if len(self.questions) > 0:
-            sample_question = self.questions[0]
-            print(f"Sample question keys: {sample_question.keys()}")
-            if 'subject' in sample_question:
-                print(f"Sample subject: '{sample_question['subject']}'")
-            if 'grade' in sample_question:
-                print(f"Sample grade: '{sample_question['grade']}'")
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_question_attempts_session ON question_attempts (session_id)')
+        # Date ranges of result exports
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_quiz_sessions_created ON quiz_sessions (created_at)')
         
-        available_subjects = set(q.get('subject', 'Unknown') for q in self.questions)
-        available_grades = set(q.get('grade', 'Unknown') for q in self.questions)
-        print(f"Available subjects: {sorted(list(available_subjects))}")
-        print(f"Available grades: {sorted(list(available_grades))}")
-        print(f"Filtering for: subject='{subject}', grade='{grade}'")
-        
-        if subject and subject != 'all':
-            # Try exact match first
-            filtered_exact = [q for q in filtered if q.get('subject', '').lower() == subject.lower()]
-            if filtered_exact:
-                filtered = filtered_exact
-            else:
-                # Try partial match
-                filtered = [q for q in filtered if subject.lower() in q.get('subject', '').lower()]
-        
-        if grade and grade != 'all':
-            # Try exact match first
-            filtered_exact = [q for q in filtered if q.get('grade', '').lower() == grade.lower()]
-            if filtered_exact:
-                filtered = filtered_exact
-            else:
-                # Try partial match
-                filtered = [q for q in filtered if grade.lower() in q.get('grade', '').lower()]
+        create_rollup_tables(conn)
+        # Learner history (adaptive quizzes, /api/history) and /api/leaderboard
+        create_history_tables(conn)
+    
+    def load_analytics(self):
+        """Empirical (difficulties, discriminations) from question analytics, or None"""
+        try:
+            from analytics import load_difficulties, load_discriminations
+        except ImportError:
+            # pandas/numpy not installed; keep the bank's difficulty labels
+            return None
+        conn = self.db.connection()
+        return load_difficulties(conn), load_discriminations(conn)
+    
+    def apply_difficulties(self, snapshot):
+        """Use empirical difficulties and discriminations in a snapshot not yet published"""
+        analytics = self.load_analytics()
+        if analytics is None:
+            return
+        difficulties, discriminations = analytics
+        snapshot.index.set_difficulties(difficulties)
+        snapshot.selector = AdaptiveSelector(snapshot.index, discriminations)
+    
+    def refresh_difficulties(self):
+        """Swap in a snapshot with fresh empirical difficulties applied to a copy of the current index"""
+        analytics = self.load_analytics()
+        if analytics is None:
+            return False
+        difficulties, discriminations = analytics
         
-        print(f"Questions after filtering: {len(filtered)}")
+        def rebuild(index):
+            index = index.copy()
+            index.set_difficulties(difficulties)
+            return index
         
-        # Shuffle and limit
-        random.shuffle(filtered)
-        return filtered[:limit]
+        while True:
+            current = self.snapshots.current
+            # Under the ingestor lock, so an ingest cannot copy the index in between
+            index = current.ingestor.replace_index(rebuild)
+            snapshot = current.fork(current.version, index, ())
+            snapshot.selector = AdaptiveSelector(index, discriminations)
+            if self.snapshots.replace(current, snapshot):
+                return True
+            # An ingest or reload published another snapshot meanwhile; refresh that one
+    
+    def apply_duplicate_groups(self, snapshot=None):
+        """Keep near-duplicate questions found by the batch job out of the same quiz"""
+        snapshot = snapshot or self.snapshots.current
+        try:
+            from duplicate_detection import load_duplicate_groups
+        except ImportError:
+            # numpy not installed, so the batch job cannot have run either
+            return
+        snapshot.index.set_duplicate_groups(load_duplicate_groups(DUPLICATE_GROUPS_FILE))
+    
+    def get_filtered_questions(self, subject=None, grade=None, limit=10, difficulty=None, snapshot=None):
+        """Get filtered questions based on criteria"""
+        index = (snapshot or self.snapshots.current).index
+        return index.sample(subject, grade, limit, difficulty)
+    
+    def get_adaptive_questions(self, user_name, subject=None, grade=None, limit=10, difficulty=None,
+                               snapshot=None):
+        """Pick questions matched to a learner's recent accuracy, skipping ones they saw recently"""
+        selector = (snapshot or self.snapshots.current).selector
+        learner = self.learners.snapshot(user_name)
+        if learner is None:
+            return selector.select(subject, grade, limit, difficulty=difficulty)
+        accuracy, seen = learner
+        return selector.select(subject, grade, limit, accuracy, seen, difficulty)
+    
+    def question_payload(self, question):
+        """Question as served to clients: no answer, plus pre-rendered math when enabled"""
+        payload = question.to_dict(include_answer=False)
+        if self.math_renderer is not None:
+            payload.update(self.math_renderer.render_question(question))
+        return payload
     
     def get_subjects(self):
         """Get unique subjects"""
-        subjects = set(q.get('subject', 'Unknown') for q in self.questions)
-        subjects_list = sorted(list(subjects))
-        print(f"Available subjects: {subjects_list}")
-        return subjects_list
+        return self.index.subjects
     
     def get_grades(self):
         """Get unique grades"""
-        grades = set(q.get('grade', 'Unknown') for q in self.questions)
-        grades_list = sorted(list(grades))
-        print(f"Available grades: {grades_list}")
-        return grades_list
+        return self.index.grades
     
-    def save_quiz_result(self, session_data, attempts):
+    def save_quiz_result(self, session_data, attempts, session_id=None):
         """Save quiz results to database"""
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
-        # Insert session
-        cursor.execute('''
-            INSERT INTO quiz_sessions 
-            (user_name, subject, grade, total_questions, correct_answers, score_percentage, time_taken)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
+        if session_id is None:
+            session_id = self.result_writer.ids.next_id()
+        with self.db.transaction() as conn:
+            self.write_results(conn, [(session_id, session_data, attempts)])
+        return session_id
+    
+    def record_quiz_result(self, session_data, attempts, session_id=None):
+        """Save quiz results, queued for the background writer when enabled"""
+        if RESULT_WRITE_BEHIND:
+            return self.result_writer.submit(session_data, attempts, session_id)
+        return self.save_quiz_result(session_data, attempts, session_id)
+    
+    def write_results(self, conn, results):
+        """Insert (session_id, session_data, attempts) results in the caller's transaction"""
+        started = time.perf_counter()
+        conn.executemany(INSERT_SESSION_SQL, [(
+            session_id,
             session_data['user_name'],
             session_data['subject'],
             session_data['grade'],
@@ -194,31 +353,239 @@ class QuizApp:
             session_data['correct_answers'],
             session_data['score_percentage'],
             session_data['time_taken']
-        ))
+        ) for session_id, session_data, _ in results])
         
-        session_id = cursor.lastrowid
+        conn.executemany(INSERT_ATTEMPT_SQL, [(
+            session_id,
+            attempt['question_id'],
+            attempt['user_answer'],
+            attempt['correct_answer'],
+            attempt['is_correct'],
+            attempt['time_spent']
+        ) for session_id, _, attempts in results for attempt in attempts])
         
-        # Insert attempts
-        for attempt in attempts:
-            cursor.execute('''
-                INSERT INTO question_attempts 
-                (session_id, question_id, user_answer, correct_answer, is_correct, time_spent)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                session_id,
-                attempt['question_id'],
-                attempt['user_answer'],
-                attempt['correct_answer'],
-                attempt['is_correct'],
-                attempt['time_spent']
-            ))
+        # Keep /api/stats rollups in step with the rows just written
+        update_rollups(conn, [
+            (session_data['subject'], session_data['grade'], session_data['score_percentage'])
+            for _, session_data, _ in results
+        ])
+        update_leaderboard(conn, [(session_id, session_data) for session_id, session_data, _ in results])
         
-        conn.commit()
-        conn.close()
-        return session_id
+        metrics.observe('quiz_db_write_duration_seconds', time.perf_counter() - started)
+        metrics.inc('quiz_db_rows_written_total', len(results), table='quiz_sessions')
+        metrics.inc('quiz_db_rows_written_total', sum(len(attempts) for _, _, attempts in results),
+                    table='question_attempts')
 
 # Initialize the quiz app
 quiz_app = QuizApp()
+quiz_store = create_session_store(QUIZ_SESSION_BACKEND, QUIZ_SESSION_TTL, SESSION_DB_FILE)
+
+class QuizConflict(Exception):
+    """Concurrent requests for one quiz kept overwriting each other's changes"""
+
+def get_active_quiz():
+    """Return the quiz cookie, its server-side state and the state's version, or (None, None, None)"""
+    quiz = session.get('quiz')
+    if not quiz:
+        return None, None, None
+    state, version = quiz_store.get_versioned(quiz['quiz_id'])
+    if state is None or 'finished' in state:
+        return None, None, None
+    return quiz, state, version
+
+def update_active_quiz(update):
+    """Apply update(quiz_data) to the active quiz; returns (quiz, quiz_data, result) or None
+    
+    update changes quiz_data and returns (result, state to store or None).
+    The state is stored with a compare-and-swap on the version read, so when
+    a concurrent request for the same quiz writes first the update is run
+    again on a fresh copy instead of overwriting that request's answers.
+    """
+    for _ in range(QUIZ_UPDATE_ATTEMPTS):
+        quiz, quiz_data, version = get_active_quiz()
+        if quiz_data is None:
+            return None
+        result, state = update(quiz_data)
+        if state is None or quiz_store.put(quiz['quiz_id'], state, version):
+            return quiz, quiz_data, result
+    raise QuizConflict()
+
+def get_finished_quiz():
+    """Results of a quiz the session already finished, for retried finish requests"""
+    quiz = session.get('quiz')
+    state = quiz_store.get(quiz['quiz_id']) if quiz else None
+    return state['finished'] if state and 'finished' in state else None
+
+def apply_answers(quiz_data, submissions):
+    """Grade and record submitted answers in one pass; the last answer to a question wins
+    
+    Each submission has a 1-based question_number, an answer, time_spent and
+    an optional idempotency key; submissions whose key was already applied
+    are only reported again. Returns (results, rejected).
+    """
+    snapshot = quiz_app.snapshots.get(quiz_data.get('bank_version'))
+    question_ids = quiz_data['question_ids']
+    answers = quiz_data['answers']
+    answer_slots = {answer['question_id']: slot for slot, answer in enumerate(answers)}
+    applied_keys = quiz_data.setdefault('answer_keys', [])
+    seen_keys = set(applied_keys)
+    results = []
+    rejected = []
+    
+    for item_num, submission in enumerate(submissions):
+        if not isinstance(submission, dict):
+            rejected.append({'index': item_num, 'error': 'Answer must be an object'})
+            continue
+        question_num = submission.get('question_number')
+        if not isinstance(question_num, int) or not 1 <= question_num <= len(question_ids):
+            rejected.append({'index': item_num, 'error': 'Invalid question number'})
+            continue
+        question = snapshot.index.get(question_ids[question_num - 1])
+        if question is None:
+            rejected.append({'index': item_num, 'error': 'Question no longer available'})
+            continue
+        
+        correct_answer = question.correct_answer.lower()
+        key = submission.get('key')
+        key = None if key is None else str(key)
+        duplicate = key is not None and key in seen_keys
+        if duplicate:
+            slot = answer_slots.get(question.id)
+            is_correct = slot is not None and answers[slot]['is_correct']
+        else:
+            user_answer = str(submission.get('answer') or '').lower()
+            is_correct = user_answer == correct_answer
+            answer = {
+                'question_id': question.id,
+                'user_answer': user_answer,
+                'correct_answer': correct_answer,
+                'is_correct': is_correct,
+                'time_spent': submission.get('time_spent', 0)
+            }
+            if question.id in answer_slots:
+                answers[answer_slots[question.id]] = answer
+            else:
+                answer_slots[question.id] = len(answers)
+                answers.append(answer)
+            if key is not None:
+                seen_keys.add(key)
+                applied_keys.append(key)
+        
+        results.append({
+            'question_number': question_num,
+            'correct': is_correct,
+            'correct_answer': correct_answer.upper(),
+            'explanation': f"The correct answer is {correct_answer.upper()}: {question.option_text(correct_answer.upper())}",
+            'duplicate': duplicate
+        })
+    
+    del applied_keys[:-MAX_ANSWER_KEYS]
+    return results, rejected
+
+def score_quiz(quiz_data):
+    """Score a quiz under a newly allocated session id; returns (session_data, response body)"""
+    answers = quiz_data['answers']
+    
+    # Calculate results
+    correct_count = sum(1 for answer in answers if answer['is_correct'])
+    total_questions = len(answers)
+    score_percentage = (correct_count / total_questions) * 100 if total_questions > 0 else 0
+    
+    # Calculate time taken
+    start_time = datetime.fromisoformat(quiz_data['start_time'])
+    end_time = datetime.now()
+    time_taken = int((end_time - start_time).total_seconds())
+    
+    # Prepare session data
+    session_data = {
+        'user_name': quiz_data['user_name'],
+        'subject': quiz_data['subject'],
+        'grade': quiz_data['grade'],
+        'total_questions': total_questions,
+        'correct_answers': correct_count,
+        'score_percentage': score_percentage,
+        'time_taken': time_taken
+    }
+    
+    # Allocated up front so the finished state can be stored before the
+    # results are queued; a retried update leaves an unused id behind
+    result = {
+        'session_id': quiz_app.result_writer.ids.next_id(),
+        'results': {
+            'correct': correct_count,
+            'total': total_questions,
+            'percentage': round(score_percentage, 1),
+            'time_taken': time_taken,
+            'grade': 'A' if score_percentage >= 90 else 'B' if score_percentage >= 80 else 'C' if score_percentage >= 70 else 'D' if score_percentage >= 60 else 'F'
+        },
+        'answers': answers
+    }
+    return session_data, result
+
+def finish_update(quiz_data):
+    """update_active_quiz step that scores the quiz and marks it finished"""
+    session_data, result = score_quiz(quiz_data)
+    # Keep the results until the quiz expires so a retried finish gets them
+    # instead of saving the quiz twice
+    return (session_data, result), {'finished': result}
+
+def end_quiz(quiz_data, session_data, session_id):
+    """Queue a quiz whose finished state was stored for the database and end it"""
+    quiz_app.record_quiz_result(session_data, quiz_data['answers'], session_id)
+    quiz_app.learners.record(quiz_data['user_name'], quiz_data['answers'])
+    quiz_app.snapshots.release(quiz_data.get('bank_version'))
+    session.pop('quiz', None)
+
+def admin_denied():
+    """Error response unless the request carries the admin token, else None"""
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Admin API is disabled; set QUIZ_ADMIN_TOKEN'}), 403
+    token = request.headers.get('X-Admin-Token', '')
+    if not hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+        return jsonify({'error': 'Invalid admin token'}), 403
+    return None
+
+def payload_response(body, etag, gzipped=None, private=False):
+    """JSON response with a weak ETag, 304 handling and optional gzip"""
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache' if private else 'public, max-age=3600'
+    response.vary.add('Accept-Encoding')
+    response.make_conditional(request)
+    
+    if response.status_code == 200 and accepts_gzip(request):
+        if gzipped is None and len(body) >= MIN_COMPRESS_BYTES:
+            gzipped = gzip.compress(body, 5)
+        if gzipped is not None:
+            response.set_data(gzipped)
+            response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+if METRICS_ENABLED:
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+    
+    @app.after_request
+    def record_request(response):
+        """Record the request's latency and status, then flush totals for other workers"""
+        endpoint = request.endpoint or 'unmatched'
+        metrics.observe('quiz_request_duration_seconds', time.perf_counter() - g.request_started,
+                        endpoint=endpoint)
+        metrics.inc('quiz_requests_total', endpoint=endpoint, status=response.status_code)
+        metrics.flush_if_due()
+        return response
+
+@app.errorhandler(QuizConflict)
+def quiz_conflict(error):
+    """Ask the client to retry a request that kept losing to concurrent ones"""
+    return jsonify({'error': 'The quiz is being updated by another request; retry'}), 409
+
+@app.before_request
+def sync_question_bank():
+    """Pick up questions other workers ingested and keep the bank watcher running"""
+    quiz_app.reloader.ensure_started()
+    quiz_app.ingestor.maybe_sync()
 
 # Routes
 @app.route('/')
@@ -231,166 +598,188 @@ def index():
 @app.route('/start_quiz', methods=['POST'])
 def start_quiz():
     """Start a new quiz session"""
-    print(f"=== START_QUIZ REQUEST ===")
-    print(f"Method: {request.method}")
-    print(f"Content-Type: {request.content_type}")
-    print(f"Raw data: {request.data}")
-    print(f"========================")
-    
     try:
         data = request.get_json()
-        print(f"Parsed JSON data: {data}")
         
         if not data:
-            print("ERROR: No JSON data received")
+            logger.info('start_quiz rejected: no JSON body content_type=%s', request.content_type)
             return jsonify({'error': 'No JSON data provided'}), 400
         user_name = data.get('user_name', 'Anonymous')
         subject = data.get('subject', 'all')
         grade = data.get('grade', 'all')
         num_questions = int(data.get('num_questions', 10))
+        difficulty = data.get('difficulty', 'all')
+        mode = data.get('mode', 'random')
         
-        print(f"Parameters: user={user_name}, subject={subject}, grade={grade}, num={num_questions}")
-        
-        # Get questions
-        questions = quiz_app.get_filtered_questions(subject, grade, num_questions)
-        print(f"Found {len(questions)} questions")
+        # Get questions; the quiz keeps using this bank snapshot until it finishes
+        snapshot = quiz_app.snapshots.current
+        started = time.perf_counter()
+        if mode == 'adaptive':
+            questions = quiz_app.get_adaptive_questions(user_name, subject, grade, num_questions, difficulty,
+                                                        snapshot)
+        else:
+            questions = quiz_app.get_filtered_questions(subject, grade, num_questions, difficulty, snapshot)
+        metrics.observe('quiz_selection_duration_seconds', time.perf_counter() - started, mode=mode)
+        logger.debug('start_quiz subject=%s grade=%s difficulty=%s mode=%s requested=%d picked=%d',
+                     subject, grade, difficulty, mode, num_questions, len(questions))
         
         if not questions:
-            print("ERROR: No questions found")
             return jsonify({'error': 'No questions found for selected criteria'}), 404
         
-        # Store in session
-        session['quiz_data'] = {
+        # Keep quiz state server-side; the cookie only carries the quiz and question ids
+        question_ids = [q.id for q in questions]
+        quiz_app.learners.mark_seen(user_name, question_ids)
+        quiz_id = quiz_store.new_id()
+        bank_version = quiz_app.snapshots.acquire(snapshot)
+        quiz_store.put(quiz_id, {
             'user_name': user_name,
             'subject': subject,
             'grade': grade,
-            'questions': questions,
+            'bank_version': bank_version,
+            'question_ids': question_ids,
             'current_question': 0,
             'answers': [],
             'start_time': datetime.now().isoformat()
-        }
+        })
+        session['quiz'] = {'quiz_id': quiz_id, 'bank_version': bank_version, 'question_ids': question_ids}
+        metrics.observe('quiz_session_questions', len(question_ids))
         
-        print(f"SUCCESS: Quiz started with {len(questions)} questions")
         return jsonify({
             'success': True,
             'total_questions': len(questions),
-            'first_question': questions[0] if questions else None
+            'first_question': quiz_app.question_payload(questions[0])
         })
         
     except Exception as e:
-        print(f"ERROR in start_quiz: {str(e)}")
-        print(f"Exception type: {type(e)}")
-        import traceback
-        print(f"Traceback: {traceback.format_exc()}")
+        logger.exception('start_quiz failed')
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 @app.route('/get_question/<int:question_num>')
 def get_question(question_num):
     """Get a specific question"""
-    if 'quiz_data' not in session:
+    quiz = session.get('quiz')
+    if not quiz:
         return jsonify({'error': 'No active quiz session'}), 404
     
-    quiz_data = session['quiz_data']
-    questions = quiz_data['questions']
+    question_ids = quiz['question_ids']
     
-    if question_num < 0 or question_num >= len(questions):
+    if question_num < 0 or question_num >= len(question_ids):
         return jsonify({'error': 'Invalid question number'}), 404
     
-    question = questions[question_num].copy()
-    # Remove correct answer from response
-    question.pop('correct_answer', None)
+    snapshot = quiz_app.snapshots.get(quiz.get('bank_version'))
+    question = snapshot.index.get(question_ids[question_num])
+    if question is None:
+        return jsonify({'error': 'Question no longer available'}), 404
     
-    return jsonify({
-        'question': question,
-        'question_number': question_num + 1,
-        'total_questions': len(questions)
-    })
+    # Pre-serialized payload (no correct answer), wrapped without re-encoding it
+    payload = snapshot.payloads.get(question)
+    body = b''.join([
+        b'{"question":', payload.body,
+        f',"question_number":{question_num + 1},"total_questions":{len(question_ids)}}}'.encode('ascii')
+    ])
+    return payload_response(body, payload.etag + f'-{question_num}-{len(question_ids)}', private=True)
+
+@app.route('/quiz_bootstrap')
+def quiz_bootstrap():
+    """All questions of the active quiz, without answers, in one response"""
+    quiz = session.get('quiz')
+    if not quiz:
+        return jsonify({'error': 'No active quiz session'}), 404
+    
+    snapshot = quiz_app.snapshots.get(quiz.get('bank_version'))
+    questions = [snapshot.index.get(question_id) for question_id in quiz['question_ids']]
+    if any(question is None for question in questions):
+        return jsonify({'error': 'Question no longer available'}), 404
+    
+    payloads = [snapshot.payloads.get(question) for question in questions]
+    body = join_payloads(payloads, len(payloads))
+    return payload_response(body, combined_etag(payloads), private=True)
+
+@app.route('/question_payload/<int:question_id>')
+def question_payload(question_id):
+    """A single question without its answer, cacheable by browsers and proxies"""
+    snapshot = quiz_app.snapshots.current
+    question = snapshot.index.get(question_id)
+    if question is None:
+        return jsonify({'error': 'Question not found'}), 404
+    
+    payload = snapshot.payloads.get(question)
+    return payload_response(payload.body, payload.etag, payload.gzipped)
 
 @app.route('/submit_answer', methods=['POST'])
 def submit_answer():
     """Submit an answer for current question"""
-    if 'quiz_data' not in session:
-        return jsonify({'error': 'No active quiz session'}), 404
-    
     data = request.get_json()
-    user_answer = data.get('answer', '').lower()
-    question_num = data.get('question_number', 0) - 1
-    time_spent = data.get('time_spent', 0)
     
-    quiz_data = session['quiz_data']
-    questions = quiz_data['questions']
+    def answer(quiz_data):
+        results, rejected = apply_answers(quiz_data, [data])
+        return (results, rejected), None if rejected else quiz_data
     
-    if question_num < 0 or question_num >= len(questions):
-        return jsonify({'error': 'Invalid question number'}), 404
+    updated = update_active_quiz(answer)
+    if updated is None:
+        return jsonify({'error': 'No active quiz session'}), 404
+    results, rejected = updated[2]
+    if rejected:
+        return jsonify({'error': rejected[0]['error']}), 404
     
-    question = questions[question_num]
-    correct_answer = question['correct_answer'].lower()
-    is_correct = user_answer == correct_answer
-    
-    # Store answer
-    quiz_data['answers'].append({
-        'question_id': question['id'],
-        'user_answer': user_answer,
-        'correct_answer': correct_answer,
-        'is_correct': is_correct,
-        'time_spent': time_spent
+    result = results[0]
+    return jsonify({
+        'correct': result['correct'],
+        'correct_answer': result['correct_answer'],
+        'explanation': result['explanation']
     })
+
+@app.route('/submit_answers', methods=['POST'])
+def submit_answers():
+    """Submit many answers at once (e.g. buffered offline), optionally finishing the quiz"""
+    data = request.get_json(silent=True) or {}
+    submissions = data.get('answers', [])
+    if not isinstance(submissions, list):
+        return jsonify({'error': 'answers must be a list'}), 400
+    if len(submissions) > MAX_BATCH_ANSWERS:
+        return jsonify({'error': f'At most {MAX_BATCH_ANSWERS} answers per request'}), 413
     
-    session['quiz_data'] = quiz_data
+    def answer(quiz_data):
+        results, rejected = apply_answers(quiz_data, submissions)
+        response = {
+            'results': results,
+            'rejected': rejected,
+            'answered': len(quiz_data['answers']),
+            'total_questions': len(quiz_data['question_ids'])
+        }
+        if not data.get('finish'):
+            return (response, None), quiz_data
+        (session_data, result), state = finish_update(quiz_data)
+        # The score goes under its own key; 'results' keeps the per-answer grading
+        response['score'] = result['results']
+        response['session_id'] = result['session_id']
+        return (response, session_data), state
     
-    return jsonify({
-        'correct': is_correct,
-        'correct_answer': correct_answer.upper(),
-        'explanation': f"The correct answer is {correct_answer.upper()}: {question['options'][correct_answer.upper()]}"
-    })
+    updated = update_active_quiz(answer)
+    if updated is None:
+        finished = get_finished_quiz()
+        if finished is not None:
+            return jsonify(finished)
+        return jsonify({'error': 'No active quiz session'}), 404
+    
+    _, quiz_data, (response, session_data) = updated
+    if session_data is not None:
+        end_quiz(quiz_data, session_data, response['session_id'])
+    return jsonify(response)
 
 @app.route('/finish_quiz', methods=['POST'])
 def finish_quiz():
     """Finish quiz and calculate results"""
-    if 'quiz_data' not in session:
+    updated = update_active_quiz(finish_update)
+    if updated is None:
+        finished = get_finished_quiz()
+        if finished is not None:
+            return jsonify(finished)
         return jsonify({'error': 'No active quiz session'}), 404
     
-    quiz_data = session['quiz_data']
-    answers = quiz_data['answers']
-    
-    # Calculate results
-    correct_count = sum(1 for answer in answers if answer['is_correct'])
-    total_questions = len(answers)
-    score_percentage = (correct_count / total_questions) * 100 if total_questions > 0 else 0
-    
-    # Calculate time taken
-    start_time = datetime.fromisoformat(quiz_data['start_time'])
-    end_time = datetime.now()
-    time_taken = int((end_time - start_time).total_seconds())
-    
-    # Prepare session data
-    session_data = {
-        'user_name': quiz_data['user_name'],
-        'subject': quiz_data['subject'],
-        'grade': quiz_data['grade'],
-        'total_questions': total_questions,
-        'correct_answers': correct_count,
-        'score_percentage': score_percentage,
-        'time_taken': time_taken
-    }
-    
-    # Save to database
-    session_id = quiz_app.save_quiz_result(session_data, answers)
-    
-    # Clear session
-    session.pop('quiz_data', None)
-    
-    return jsonify({
-        'session_id': session_id,
-        'results': {
-            'correct': correct_count,
-            'total': total_questions,
-            'percentage': round(score_percentage, 1),
-            'time_taken': time_taken,
-            'grade': 'A' if score_percentage >= 90 else 'B' if score_percentage >= 80 else 'C' if score_percentage >= 70 else 'D' if score_percentage >= 60 else 'F'
-        },
-        'answers': answers
-    })
+    _, quiz_data, (session_data, result) = updated
+    end_quiz(quiz_data, session_data, result['session_id'])
+    return jsonify(result)
 
 @app.route('/results/<int:session_id>')
 def view_results(session_id):
@@ -400,37 +789,246 @@ def view_results(session_id):
 @app.route('/api/stats')
 def get_stats():
     """Get overall statistics"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Get basic stats
-    cursor.execute('SELECT COUNT(*) FROM quiz_sessions')
-    total_sessions = cursor.fetchone()[0]
+    # Up to ten years back; larger values overflow the date arithmetic
+    days = max(1, min(request.args.get('days', 30, type=int), 3650))
+    stats = read_stats(quiz_app.db.connection(), days)
     
-    cursor.execute('SELECT AVG(score_percentage) FROM quiz_sessions')
-    avg_score = cursor.fetchone()[0] or 0
-    
-    cursor.execute('SELECT subject, AVG(score_percentage) FROM quiz_sessions GROUP BY subject')
-    subject_stats = cursor.fetchall()
-    
-    conn.close()
+    total_sessions, score_sum = stats['overall'].get('', (0, 0))
+    recent = list(stats['day'].values())
+    recent_sessions = sum(sessions for sessions, _ in recent)
     
     return jsonify({
         'total_sessions': total_sessions,
-        'average_score': round(avg_score, 1),
-        'subject_performance': {subject: round(score, 1) for subject, score in subject_stats},
-        'total_questions': len(quiz_app.questions)
+        'average_score': average(total_sessions, score_sum),
+        'subject_performance': {subject: average(*totals) for subject, totals in stats['subject'].items()},
+        'grade_performance': {grade: average(*totals) for grade, totals in stats['grade'].items()},
+        'recent': {
+            'days': days,
+            'sessions': recent_sessions,
+            'average_score': average(recent_sessions, sum(score_sum for _, score_sum in recent)),
+            'daily': {day: {'sessions': sessions, 'average_score': average(sessions, score_sum)}
+                      for day, (sessions, score_sum) in sorted(stats['day'].items())}
+        },
+        'total_questions': len(quiz_app.index)
     })
 
+@app.route('/api/history')
+def get_history():
+    """A user's finished quizzes, newest first, one cursor-addressed page at a time"""
+    user_name = request.args.get('user', '')
+    if not user_name:
+        return jsonify({'error': 'user is required'}), 400
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    try:
+        sessions, next_cursor = read_history(quiz_app.db.connection(), user_name, request.args.get('subject'),
+                                             limit, request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'user': user_name, 'sessions': sessions, 'next_cursor': next_cursor})
+
+@app.route('/api/leaderboard')
+def get_leaderboard():
+    """Best score per user for a subject and grade ('all' for either), one page at a time"""
+    subject = request.args.get('subject', 'all')
+    grade = request.args.get('grade', 'all')
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    try:
+        entries, next_cursor = read_leaderboard(quiz_app.db.connection(), subject, grade,
+                                                limit, request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'subject': subject, 'grade': grade, 'entries': entries, 'next_cursor': next_cursor})
+
+@app.route('/api/search')
+def search_questions():
+    """Ranked search over question and option text with subject and grade facets"""
+    if not quiz_app.search.available:
+        return jsonify({'error': 'Search is not available on this server'}), 503
+    
+    query = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    try:
+        matches, total, facets = quiz_app.search.search(query, request.args.get('subject'),
+                                                        request.args.get('grade'), limit, offset)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Answers stay hidden; results come from the current bank snapshot
+    index = quiz_app.index
+    results = []
+    for question_id, score in matches:
+        question = index.get(question_id)
+        if question is not None:
+            result = question.to_dict(include_answer=False)
+            result['score'] = round(-score, 3)
+            results.append(result)
+    
+    return jsonify({'query': query, 'total': total, 'results': results, 'facets': facets})
+
+@app.route('/api/analytics/questions')
+def get_question_analytics():
+    """Per-question accuracy, median time, discrimination and difficulty"""
+    from analytics import read_question_stats
+    
+    question_id = request.args.get('question_id', type=int)
+    order_by = request.args.get('order_by', 'discrimination')
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+    try:
+        rows = read_question_stats(quiz_app.db.connection(), question_id, order_by, limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'questions': rows})
+
+@app.route('/api/analytics/refresh', methods=['POST'])
+def refresh_question_analytics():
+    """Fold new answer attempts into question analytics and apply the difficulties"""
+    from analytics import refresh_question_stats
+    
+    denied = admin_denied()
+    if denied:
+        return denied
+    
+    quiz_app.result_writer.flush(timeout=10)
+    processed = refresh_question_stats(quiz_app.db.connection())
+    quiz_app.refresh_difficulties()
+    return jsonify({'processed_attempts': processed})
+
+@app.route('/api/admin/ingest', methods=['POST'])
+def ingest_questions():
+    """Ingest uploaded CSV/JSONL question files into the live bank"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    
+    uploads = request.files.getlist('file')
+    if not uploads:
+        return jsonify({'error': 'Upload one or more files as "file"'}), 400
+    
+    force = request.form.get('force') == '1'
+    reports = []
+    for upload in uploads:
+        try:
+            reports.append(quiz_app.ingestor.ingest_stream(os.path.basename(upload.filename), upload.stream,
+                                                           force=force))
+        except ValueError as e:
+            return jsonify({'error': str(e), 'reports': reports}), 400
+    return jsonify({'reports': reports, 'total_questions': len(quiz_app.index)})
+
+@app.route('/api/admin/grade', methods=['POST'])
+def grade_answer_sheets():
+    """Grade uploaded CSV/JSONL answer sheets and record one quiz session per student"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    from bulk_grade import grade_sheet, load_answer_keys, read_sheet, write_graded
+    
+    uploads = request.files.getlist('file')
+    if not uploads:
+        return jsonify({'error': 'Upload one or more answer sheets as "file"'}), 400
+    
+    answer_keys = None
+    keys_upload = request.files.get('answer_keys')
+    if keys_upload is not None:
+        try:
+            answer_keys = load_answer_keys(keys_upload.stream)
+        except (KeyError, ValueError) as e:
+            return jsonify({'error': f'Invalid answer keys: {e}'}), 400
+    
+    reports = []
+    for upload in uploads:
+        source_name = os.path.basename(upload.filename)
+        try:
+            columns = read_sheet(source_name, upload.stream, answer_keys)
+        except ValueError as e:
+            return jsonify({'error': str(e), 'reports': reports}), 400
+        report = write_graded(quiz_app, grade_sheet(quiz_app.index, columns),
+                              request.form.get('subject'), request.form.get('grade'))
+        reports.append(dict(report, sheet=source_name))
+    return jsonify({'reports': reports})
+
+@app.route('/api/admin/export')
+def export_results():
+    """Stream quiz sessions with their answers as CSV or Parquet"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    
+    export_format = request.args.get('format', 'csv')
+    try:
+        chunks = export_chunks(DB_FILE, export_format, request.args.get('from'), request.args.get('to'),
+                               request.args.get('subject'), request.args.get('grade'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Include quizzes still queued for the background writer
+    quiz_app.result_writer.flush(timeout=10)
+    response = Response(chunks, mimetype=EXPORT_FORMATS[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename=quiz_results.{export_format}'
+    return response
+
+@app.route('/api/admin/reload', methods=['POST'])
+def reload_question_bank():
+    """Rebuild the question bank in the background and swap it in"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    
+    if request.args.get('wait') == '1':
+        finished = quiz_app.reloader.request_reload(timeout=120)
+        return jsonify({'finished': finished, 'version': quiz_app.snapshots.current.version,
+                        'snapshots': quiz_app.snapshots.status()}), 200 if finished else 202
+    quiz_app.reloader.request_reload()
+    return jsonify({'version': quiz_app.snapshots.current.version}), 202
+
+@app.route('/api/admin/bank')
+def question_bank_status():
+    """Loaded question bank versions and the quizzes still using them"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    return jsonify({'snapshots': quiz_app.snapshots.status()})
+
+@app.route('/api/papers', methods=['POST'])
+def generate_exam_papers():
+    """Balanced exam paper variants with answer keys from the current bank"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    
+    data = request.get_json(silent=True) or {}
+    quotas = data.get('quotas')
+    try:
+        variants = int(data.get('variants', 1))
+        seed = int(data.get('seed', 0))
+        if not isinstance(quotas, list) or not all(isinstance(quota, dict) for quota in quotas):
+            raise PaperSpecError('quotas must be a list of {subject, grade, source_file, count}')
+        quotas = [dict(quota, count=int(quota.get('count', 0))) for quota in quotas]
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    if variants > MAX_PAPER_VARIANTS:
+        return jsonify({'error': f'At most {MAX_PAPER_VARIANTS} variants per request'}), 413
+    
+    # Render here rather than forking a pool out of a threaded server
+    snapshot = quiz_app.snapshots.current
+    try:
+        papers, overlap = generate_papers(snapshot.index, quotas, variants, seed, processes=1)
+    except PaperSpecError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'bank_version': snapshot.version, 'seed': seed, 'overlap': overlap, 'papers': papers})
+
+@app.route('/metrics')
+def metrics_text():
+    """Request latencies and counters of all workers for Prometheus"""
+    if not METRICS_ENABLED:
+        return jsonify({'error': 'Metrics are disabled; set QUIZ_METRICS=1'}), 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     # Ensure data directory exists
-    data_dir = os.path.join(BASE_DIR, 'data')
-    os.makedirs(data_dir, exist_ok=True)
-    
-    print("🚀 Starting BEnQA Quiz Application...")
-    print("📊 Questions loaded:", len(quiz_app.questions))
-    print("🎯 Subjects available:", len(quiz_app.get_subjects()))
-    print("🎓 Grades available:", len(quiz_app.get_grades()))
-    print("🌐 Server starting at: http://localhost:5002")
+    os.makedirs(DATA_DIR, exist_ok=True)
+    
+    logger.info('starting BEnQA Quiz Application at http://localhost:5002 questions=%d subjects=%d grades=%d',
+                len(quiz_app.index), len(quiz_app.get_subjects()), len(quiz_app.get_grades()))
     
     app.run(debug=True, host='0.0.0.0', port=5002)
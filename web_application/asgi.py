@@ -0,0 +1,175 @@
+# asgi.py - ASGI entry point: the Flask app behind an event loop and a bounded thread pool
+#
+# uvicorn asgi:application --workers 4
+# gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:application
+#
+# The event loop holds every open connection, so students sitting on a
+# question timer or a keep-alive connection cost no OS thread. A request
+# only takes one of QUIZ_ASGI_THREADS pool threads while its Flask view,
+# including its SQLite work, runs; when they are all busy, further requests
+# wait on the loop rather than starting more threads. Small responses go
+# back to the loop in one piece, and large ones (exports) are streamed in
+# chunks as the view produces them.
+
+import asyncio
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+# Every worker must see the same quizzes; worker-local memory state would not
+# be visible to the other --workers processes
+os.environ.setdefault('QUIZ_SESSION_BACKEND', 'sqlite')
+
+from app import app, quiz_app
+
+# Pool threads per worker process running Flask views
+ASGI_THREADS = int(os.environ.get('QUIZ_ASGI_THREADS', 16))
+
+# Response bytes buffered before they are streamed to the client
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def build_environ(scope, body):
+    """WSGI environ for an ASGI HTTP scope and its request body"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        # WSGI carries paths as latin-1 decoded bytes
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'REMOTE_ADDR': client[0],
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1')
+        value = value.decode('latin-1')
+        if name == 'content-length':
+            continue
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+            continue
+        key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+class WsgiAdapter:
+    """ASGI application running a WSGI app on a bounded, per-process thread pool"""
+
+    def __init__(self, wsgi_app, threads=ASGI_THREADS, on_shutdown=None):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self.on_shutdown = on_shutdown
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def executor(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix='quiz-asgi')
+                    self._pid = os.getpid()
+        return self._executor
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f"Unsupported ASGI scope type {scope['type']!r}")
+
+        body = await read_body(receive)
+        if body is None:
+            return
+        loop = asyncio.get_running_loop()
+
+        def send_now(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        start, rest = await loop.run_in_executor(self.executor(), self.run_wsgi,
+                                                 build_environ(scope, body), send_now)
+        if start is not None:
+            await send(start)
+        await send({'type': 'http.response.body', 'body': rest, 'more_body': False})
+
+    def run_wsgi(self, environ, send_now):
+        """Run the WSGI app in a pool thread
+
+        Returns the response start message (None once streaming has sent
+        it) and the body bytes not sent yet.
+        """
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['start'] = {
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+            }
+
+        result = self.wsgi_app(environ, start_response)
+        buffered = []
+        size = 0
+        start = None
+        try:
+            for chunk in result:
+                buffered.append(chunk)
+                size += len(chunk)
+                if size >= STREAM_CHUNK_BYTES:
+                    if 'start' in response:
+                        send_now(response.pop('start'))
+                    send_now({'type': 'http.response.body', 'body': b''.join(buffered), 'more_body': True})
+                    buffered = []
+                    size = 0
+            start = response.pop('start', None)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return start, b''.join(buffered)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.on_shutdown is not None:
+                    await asyncio.get_running_loop().run_in_executor(None, self.on_shutdown)
+                if self._executor is not None and self._pid == os.getpid():
+                    self._executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+# Queued quiz results are written before the worker exits
+application = WsgiAdapter(app, on_shutdown=quiz_app.result_writer.close)
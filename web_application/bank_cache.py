@@ -0,0 +1,305 @@
+# bank_cache.py - Preprocessed, memory-mapped cache of the question bank
+#
+# Layout of the cache file:
+#   MAGIC | header length (uint32) | JSON header | padding to 8 bytes
+#   | record offsets (count + 1 x native uint64) | records (compact JSON, one per question)
+#
+# The header carries the cache/formatter versions, the source file's size,
+# mtime and SHA-256 for invalidation, the categorical lookup tables and the
+# exported QuestionIndex state. Records are Question.to_record() lists.
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+import struct
+import sys
+import time
+from array import array
+from collections.abc import Sequence
+
+from math_format import FORMAT_VERSION
+from question_index import QuestionIndex
+from question_ingest import RowError, validate_record
+from question_model import Categories, Question
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'BQBANK\x00\x00'
+CACHE_VERSION = 4
+
+
+def cache_path_for(source_path):
+    """Cache file that sits next to the JSON source"""
+    return os.path.splitext(source_path)[0] + '.bank'
+
+
+def file_sha256(path):
+    """SHA-256 of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def validate_bank(raw_questions):
+    """Questions of the JSON bank that pass the ingest validator, formatted
+
+    Questions whose text or correct option is missing or a spreadsheet
+    error are left out and broken distractors are dropped, as for ingested
+    files; each is logged with its id.
+    """
+    questions = []
+    for raw in raw_questions:
+        try:
+            question, warnings = validate_record(raw, raw.get('source_file') or '', {})
+        except RowError as e:
+            logger.warning('question %s left out of the bank: %s', raw.get('id'), e)
+            continue
+        for warning in warnings:
+            logger.warning('question %s: %s', raw.get('id'), warning)
+        questions.append(question)
+    return questions
+
+
+def read_source(source_path):
+    """Load, validate, format and index the JSON bank; returns (questions, categories, index, source metadata)"""
+    stat = os.stat(source_path)
+    with open(source_path, 'r', encoding='utf-8') as f:
+        raw_questions = json.load(f)
+    categories = Categories()
+    questions = [Question.from_dict(q, categories) for q in validate_bank(raw_questions)]
+    source = {
+        'source_size': stat.st_size,
+        'source_mtime_ns': stat.st_mtime_ns,
+        'source_sha256': file_sha256(source_path),
+    }
+    return questions, categories, QuestionIndex(questions), source
+
+
+def pack_bank(questions, categories, index, source):
+    """Serialize formatted questions and their index into the cache layout"""
+    records = [json.dumps(q.to_record(), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+               for q in questions]
+    offsets = array('Q', [0])
+    for record in records:
+        offsets.append(offsets[-1] + len(record))
+
+    header = json.dumps(dict(source, **{
+        'version': CACHE_VERSION,
+        'format_version': FORMAT_VERSION,
+        'byteorder': sys.byteorder,
+        'count': len(questions),
+        'categories': categories.export_state(),
+        'index': index.export_state(),
+    }), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    padding = b'\x00' * (-(len(MAGIC) + 4 + len(header)) % 8)
+
+    return b''.join([MAGIC, struct.pack('<I', len(header)), header, padding,
+                     offsets.tobytes()] + records)
+
+
+def build_bank_cache(source_path, cache_path=None):
+    """Format and index the JSON bank and write it to the cache file"""
+    cache_path = cache_path or cache_path_for(source_path)
+    packed = pack_bank(*read_source(source_path))
+
+    # Write to a temp file and rename so concurrent workers never see a partial cache
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(packed)
+    os.replace(tmp_path, cache_path)
+    return cache_path
+
+
+def archive_path_for(cache_path, version):
+    """Copy of a cache file kept while quizzes may still run on its bank version"""
+    return f"{cache_path}.{version}"
+
+
+def archive_bank_cache(cache_path, version, keep_seconds):
+    """Keep the cache file of `version` after it is rebuilt and prune old archives
+
+    Workers that did not load a version themselves rebuild it from its
+    archive when they serve a quiz started on it. An archive is pruned
+    once the next newer one is `keep_seconds` old, as no quiz can still be
+    running on it.
+    """
+    path = archive_path_for(cache_path, version)
+    if not os.path.exists(path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.link(cache_path, tmp_path)
+        except OSError:
+            shutil.copyfile(cache_path, tmp_path)
+        # Another worker may have rebuilt the cache for a newer version meanwhile
+        if CachedBank(tmp_path).header['source_sha256'].startswith(version):
+            os.replace(tmp_path, path)
+        else:
+            os.remove(tmp_path)
+
+    prefix = os.path.basename(cache_path) + '.'
+    directory = os.path.dirname(cache_path) or '.'
+    archives = []
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and not name.endswith('.tmp'):
+            try:
+                archives.append((os.stat(os.path.join(directory, name)).st_mtime, name))
+            except OSError:
+                continue
+    archives.sort()
+    now = time.time()
+    for (_, name), (replaced_at, _) in zip(archives, archives[1:]):
+        if now - replaced_at > keep_seconds and os.path.join(directory, name) != path:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+def load_archived_bank(cache_path, version):
+    """PackedBank of an archived bank version, or None when it is missing or unreadable"""
+    try:
+        bank = CachedBank(archive_path_for(cache_path, version))
+    except (OSError, ValueError, KeyError, struct.error):
+        return None
+    if bank.header.get('version') != CACHE_VERSION or bank.header.get('byteorder') != sys.byteorder:
+        return None
+    return bank
+
+
+class PackedBank(Sequence):
+    """Read-only question sequence over a packed buffer
+
+    Questions stay serialized in one flat buffer and are decoded into
+    Question objects only when accessed. The buffer holds no Python objects per
+    question, so a bank loaded before fork stays shared between workers
+    instead of being copied page by page as reference counts change.
+    """
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        if buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError("buffer is not a packed question bank")
+
+        header_start = len(MAGIC) + 4
+        header_len = struct.unpack_from('<I', buffer, len(MAGIC))[0]
+        self.header = json.loads(buffer[header_start:header_start + header_len])
+
+        self.categories = Categories(self.header['categories'])
+        self._count = self.header['count']
+        offsets_start = header_start + header_len
+        offsets_start += -offsets_start % 8
+        self._records_start = offsets_start + (self._count + 1) * 8
+        self._offsets = memoryview(buffer)[offsets_start:self._records_start].cast('Q')
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(self._count))]
+        if position < 0:
+            position += self._count
+        if not 0 <= position < self._count:
+            raise IndexError('question position out of range')
+        start = self._records_start + self._offsets[position]
+        end = self._records_start + self._offsets[position + 1]
+        return Question.from_record(json.loads(self._buffer[start:end]), self.categories)
+
+    def is_fresh(self, source_path):
+        """Whether this cache still matches the source file and current code"""
+        header = self.header
+        if (header.get('version') != CACHE_VERSION
+                or header.get('format_version') != FORMAT_VERSION
+                or header.get('byteorder') != sys.byteorder):
+            return False
+        stat = os.stat(source_path)
+        if stat.st_size != header['source_size']:
+            return False
+        if stat.st_mtime_ns == header['source_mtime_ns']:
+            return True
+        # Touched but possibly unchanged, fall back to comparing content
+        return file_sha256(source_path) == header['source_sha256']
+
+
+class CachedBank(PackedBank):
+    """PackedBank over a read-only memory map of the cache file"""
+
+    def __init__(self, cache_path):
+        with open(cache_path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            super().__init__(buffer)
+        except ValueError:
+            raise ValueError(f"{cache_path} is not a question bank cache")
+
+
+class LiveBank(Sequence):
+    """A packed bank followed by questions added at runtime
+
+    Positions are only ever appended, so a position handed out once keeps
+    referring to the same question; an updated question gets a new position.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.categories = getattr(base, 'categories', None) or Categories()
+        self._base_count = len(base)
+        self._added = []
+
+    def __len__(self):
+        return self._base_count + len(self._added)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if position < self._base_count:
+            return self.base[position]
+        return self._added[position - self._base_count]
+
+    def append(self, question):
+        """Add a question and return its position"""
+        self._added.append(question)
+        return self._base_count + len(self._added) - 1
+
+
+def load_packed_bank(source_path):
+    """Build the packed bank in memory, for when the cache file cannot be written"""
+    bank = PackedBank(pack_bank(*read_source(source_path)))
+    live = LiveBank(bank)
+    return live, QuestionIndex(live, bank.header['index'])
+
+
+def load_question_bank(source_path, cache_path=None):
+    """Return (LiveBank, index), rebuilding the cache when it is missing or stale"""
+    cache_path = cache_path or cache_path_for(source_path)
+    bank = None
+    if os.path.exists(cache_path):
+        try:
+            bank = CachedBank(cache_path)
+            if not bank.is_fresh(source_path):
+                bank = None
+        except (ValueError, KeyError, struct.error):
+            bank = None
+
+    if bank is None:
+        build_bank_cache(source_path, cache_path)
+        bank = CachedBank(cache_path)
+
+    live = LiveBank(bank)
+    return live, QuestionIndex(live, bank.header['index'])
+
+
+if __name__ == '__main__':
+    # Build step: python bank_cache.py [questions.json]
+    from data_paths import data_path
+
+    default_source = data_path('questions.json')
+    source = sys.argv[1] if len(sys.argv) > 1 else default_source
+    print(f"Wrote {build_bank_cache(source)}")
@@ -0,0 +1,277 @@
+# bank_snapshot.py - Versioned question bank snapshots and background reloads
+#
+# A BankSnapshot bundles everything derived from one load of the question
+# bank: the LiveBank, its QuestionIndex, the adaptive selector, the payload
+# cache and the ingestor that applies the overlay log. Quizzes record the
+# version they started on and keep reading that snapshot until they finish,
+# while new quizzes get the current one. A reload builds a new snapshot in
+# a background thread and swaps it in with one reference assignment; old
+# snapshots are dropped once no running quiz uses them.
+#
+# A version names the bank's source file and how much of the overlay log
+# is applied, so ingesting questions makes a new snapshot (sharing the
+# append-only bank, with a copied index) rather than changing one in use.
+# Because a version fully describes its questions, a worker asked for a
+# version another worker made rebuilds it from the archived bank cache.
+
+import logging
+import os
+import threading
+import time
+
+from adaptive_selection import AdaptiveSelector
+
+logger = logging.getLogger(__name__)
+
+
+def source_stat(path):
+    """(size, mtime_ns) of the bank source, or None when it is missing"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def bank_version(bank):
+    """Version of a LiveBank: a prefix of its source file's SHA-256"""
+    header = getattr(bank.base, 'header', None)
+    return header['source_sha256'][:16] if header else 'empty'
+
+
+def snapshot_version(base_version, overlay_offset):
+    """Version of a snapshot: its bank version plus the overlay bytes applied"""
+    return f'{base_version}+{overlay_offset}' if overlay_offset else base_version
+
+
+def parse_snapshot_version(version):
+    """(bank version, overlay offset) of a snapshot version, or None if malformed"""
+    base_version, _, offset = version.partition('+')
+    if not base_version or (offset and not offset.isdigit()):
+        return None
+    return base_version, int(offset or 0)
+
+
+class BankSnapshot:
+    """One loaded version of the question bank and its derived structures"""
+
+    def __init__(self, version, questions, index, payloads, stat=None, base_version=None):
+        self.version = version
+        self.base_version = base_version or version
+        self.questions = questions
+        self.index = index
+        self.payloads = payloads
+        self.stat = stat
+        self.selector = AdaptiveSelector(index)
+        self.ingestor = None
+
+    def fork(self, version, index, question_ids):
+        """Snapshot of this bank with `index`, a copy of this one's with question_ids changed"""
+        snapshot = BankSnapshot(version, self.questions, index, self.payloads.copy(question_ids),
+                                self.stat, self.base_version)
+        snapshot.selector = AdaptiveSelector(index, self.selector.discriminations)
+        snapshot.ingestor = self.ingestor
+        return snapshot
+
+
+class SnapshotRegistry:
+    """The current snapshot plus older ones still used by running quizzes
+
+    Quizzes acquire the snapshot they start on and release it when they
+    finish. Quizzes that are abandoned never release, so a replaced snapshot
+    is also dropped `retire_after` seconds after it was replaced, which
+    should match the quiz session TTL. References are counted per process,
+    so versions started in other workers are rebuilt with `load_version`
+    and kept for `retire_after` seconds after their last use.
+    """
+
+    def __init__(self, snapshot, retire_after, load_version=None):
+        self.current = snapshot
+        self.retire_after = retire_after
+        self.load_version = load_version
+        self._snapshots = {snapshot.version: snapshot}
+        self._refs = {}
+        self._replaced_at = {}
+        self._borrowed = set()
+        self._unavailable = set()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def get(self, version):
+        """Snapshot a quiz started on, rebuilt if another worker made it, else the current one"""
+        snapshot = self._snapshots.get(version)
+        if snapshot is None and version is not None and self.load_version is not None:
+            snapshot = self._load(version)
+        if snapshot is None:
+            return self.current
+        if version in self._borrowed:
+            self._replaced_at[version] = time.monotonic()
+        return snapshot
+
+    def _load(self, version):
+        with self._load_lock:
+            snapshot = self._snapshots.get(version)
+            if snapshot is not None or version in self._unavailable:
+                return snapshot
+            try:
+                snapshot = self.load_version(version)
+            except Exception:
+                logger.exception('rebuilding question bank version=%s failed', version)
+                snapshot = None
+            if snapshot is None:
+                # Quizzes on it fall back to the current questions
+                logger.warning('question bank version=%s is not available, using version=%s',
+                               version, self.current.version)
+                self._unavailable.add(version)
+                return None
+            with self._lock:
+                self._snapshots[version] = snapshot
+                self._replaced_at[version] = time.monotonic()
+                self._borrowed.add(version)
+            logger.info('question bank version=%s rebuilt for running quizzes', version)
+            return snapshot
+
+    def acquire(self, snapshot):
+        """Record a quiz starting on a snapshot; returns its version"""
+        with self._lock:
+            if self._snapshots.get(snapshot.version) is snapshot:
+                self._refs[snapshot.version] = self._refs.get(snapshot.version, 0) + 1
+        return snapshot.version
+
+    def release(self, version):
+        """Record a quiz on `version` finishing"""
+        with self._lock:
+            if self._refs.get(version, 0) > 0:
+                self._refs[version] -= 1
+            self._retire()
+
+    def swap(self, snapshot):
+        """Make a snapshot current; returns False if it has the current version"""
+        with self._lock:
+            if snapshot.version == self.current.version:
+                return False
+            self._replaced_at[self.current.version] = time.monotonic()
+            self._replaced_at.pop(snapshot.version, None)
+            self._borrowed.discard(snapshot.version)
+            self._snapshots[snapshot.version] = snapshot
+            self.current = snapshot
+            self._retire()
+            return True
+
+    def replace(self, expected, snapshot):
+        """Replace the current snapshot with one of the same version; False if it is no longer `expected`"""
+        with self._lock:
+            if self.current is not expected:
+                return False
+            self._snapshots[snapshot.version] = snapshot
+            self.current = snapshot
+            return True
+
+    def retire_expired(self):
+        with self._lock:
+            self._retire()
+
+    def _retire(self):
+        now = time.monotonic()
+        for version in list(self._snapshots):
+            if version == self.current.version:
+                continue
+            unused = self._refs.get(version, 0) <= 0 and version not in self._borrowed
+            if unused or now - self._replaced_at[version] > self.retire_after:
+                del self._snapshots[version]
+                self._refs.pop(version, None)
+                self._replaced_at.pop(version, None)
+                self._borrowed.discard(version)
+
+    def status(self):
+        """Loaded versions with their question and running quiz counts"""
+        with self._lock:
+            return [{
+                'version': version,
+                'current': snapshot is self.current,
+                'questions': len(snapshot.index),
+                'active_quizzes': self._refs.get(version, 0),
+            } for version, snapshot in self._snapshots.items()]
+
+
+class BankReloader:
+    """Background thread that rebuilds the current snapshot
+
+    The thread polls the source file every `interval` seconds (0 disables
+    polling) and also reloads on request. Each worker starts its own on
+    first use and reloads independently.
+    """
+
+    def __init__(self, registry, build_snapshot, source_path, interval):
+        self.registry = registry
+        self.build_snapshot = build_snapshot
+        self.source_path = source_path
+        self.interval = interval
+        self._wake = threading.Event()
+        self._done = threading.Condition()
+        self._requested = 0
+        self._completed = 0
+        self._failed_stat = None
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._wake = threading.Event()
+                threading.Thread(target=self._run, name='bank-reloader', daemon=True).start()
+                self._pid = os.getpid()
+
+    def request_reload(self, timeout=None):
+        """Ask for a reload; with a timeout, wait for it and return whether it finished"""
+        self.ensure_started()
+        with self._done:
+            self._requested += 1
+            requested = self._requested
+        self._wake.set()
+        if timeout is None:
+            return False
+        with self._done:
+            return self._done.wait_for(lambda: self._completed >= requested, timeout)
+
+    def source_changed(self):
+        stat = source_stat(self.source_path)
+        return stat is not None and stat != self.registry.current.stat and stat != self._failed_stat
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval or None)
+            self._wake.clear()
+            with self._done:
+                requested = self._requested
+            if requested > self._completed or self.source_changed():
+                self.reload()
+            with self._done:
+                self._completed = max(self._completed, requested)
+                self._done.notify_all()
+            self.registry.retire_expired()
+
+    def reload(self):
+        """Build a snapshot from the source and swap it in; returns whether it changed"""
+        stat = source_stat(self.source_path)
+        try:
+            snapshot = self.build_snapshot()
+        except Exception:
+            self._failed_stat = stat
+            logger.exception('question bank reload failed, keeping version=%s', self.registry.current.version)
+            return False
+
+        current = self.registry.current
+        if len(current.index) and not len(snapshot.index):
+            self._failed_stat = stat
+            logger.error('reloaded question bank is empty, keeping version=%s', current.version)
+            return False
+        if not self.registry.swap(snapshot):
+            # Touched but unchanged; remember the new stat so it is not reloaded again
+            current.stat = snapshot.stat
+            return False
+        logger.info('question bank reloaded old_version=%s version=%s questions=%d',
+                    current.version, snapshot.version, len(snapshot.index))
+        return True
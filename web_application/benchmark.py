@@ -0,0 +1,264 @@
+# benchmark.py - Micro-benchmarks and an in-process load test for the quiz service
+#
+# Everything runs against a scratch data directory (QUIZ_DATA_DIR), so the
+# real results database is never touched. The bank there is the real one,
+# optionally grown with numbered variants of its questions (--scale) to see
+# how the service behaves at 100k+ questions.
+#
+# The load test drives start_quiz -> get_question -> submit_answer ->
+# finish_quiz through Flask's test client from --concurrency threads and
+# reports p50/p99 latency per endpoint and overall throughput. Save a run
+# with --output and compare later runs against it with --baseline; the
+# exit status is 1 when a p99 got slower than the tolerance allows.
+#
+# python benchmark.py [--scale 100000] [--concurrency 8] [--quizzes 200]
+#                     [--output bench.json] [--baseline bench.json]
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from data_paths import data_path
+
+SOURCE_FILE = data_path('questions.json')
+
+ENDPOINTS = ('start_quiz', 'get_question', 'submit_answer', 'finish_quiz')
+
+
+def scale_bank(source_path, target_path, size, seed):
+    """Write a bank of `size` questions: the real ones, then numbered variants of them"""
+    with open(source_path, 'r', encoding='utf-8') as f:
+        questions = json.load(f)
+    rng = random.Random(seed)
+    scaled = questions[:size] if size else questions
+    next_id = max(question['id'] for question in questions) + 1
+    while len(scaled) < size:
+        original = questions[rng.randrange(len(questions))]
+        scaled.append(dict(original, id=next_id, question=f"{original['question']} (variant {next_id})"))
+        next_id += 1
+    with open(target_path, 'w', encoding='utf-8') as f:
+        json.dump(scaled, f, ensure_ascii=False)
+    return len(scaled)
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def summarize(seconds):
+    values = sorted(seconds)
+    return {'n': len(values), 'p50_ms': percentile(values, 0.50) * 1000, 'p99_ms': percentile(values, 0.99) * 1000}
+
+
+def print_row(name, summary):
+    print(f"  {name:<44} n={summary['n']:<6} p50={summary['p50_ms']:9.3f} ms  p99={summary['p99_ms']:9.3f} ms")
+
+
+def timed_calls(function, repeat, batch=1):
+    """Seconds per call of `function`, timed over `repeat` batches of `batch` calls"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(batch):
+            function()
+        samples.append((time.perf_counter() - started) / batch)
+    return samples
+
+
+def micro_benchmarks(app_module, seed):
+    """Time bank loading, math formatting and question selection"""
+    from math_format import format_math_expressions
+
+    quiz_app = app_module.quiz_app
+    rng = random.Random(seed)
+    results = {}
+
+    def load_cold():
+        if os.path.exists(app_module.BANK_CACHE_FILE):
+            os.remove(app_module.BANK_CACHE_FILE)
+        quiz_app.load_questions()
+
+    results['load_questions (cold, builds cache)'] = summarize(timed_calls(load_cold, 2))
+    results['load_questions (warm cache)'] = summarize(timed_calls(quiz_app.load_questions, 10))
+
+    index = quiz_app.index
+    positions = rng.sample(sorted(index.positions_by_id.values()), min(1000, len(index)))
+    texts = [quiz_app.questions[position].text for position in positions]
+    # The app memoizes formatted text; time the formatting itself and a cache hit
+    format_uncached = format_math_expressions.__wrapped__
+    text_iter = iter(texts * 10)
+    results['format_math_expressions (uncached, per text)'] = summarize(
+        timed_calls(lambda: format_uncached(next(text_iter)), 100, batch=100))
+    for text in texts:
+        quiz_app.format_math_expressions(text)
+    text_iter = iter(texts * 10)
+    results['format_math_expressions (cached, per text)'] = summarize(
+        timed_calls(lambda: quiz_app.format_math_expressions(next(text_iter)), 100, batch=100))
+
+    sample_question = quiz_app.questions[positions[0]]
+    for label, args in (
+        ('all/all, 10', ('all', 'all', 10)),
+        ('all/all, 50', ('all', 'all', 50)),
+        (f'{sample_question.subject}/{sample_question.grade}, 10',
+         (sample_question.subject, sample_question.grade, 10)),
+    ):
+        results[f'get_filtered_questions ({label})'] = summarize(
+            timed_calls(lambda: quiz_app.get_filtered_questions(*args), 2000))
+    results['get_adaptive_questions (all/all, 10)'] = summarize(
+        timed_calls(lambda: quiz_app.get_adaptive_questions('benchmark-learner', 'all', 'all', 10), 2000))
+    return results
+
+
+def run_quiz(client, rng, num_questions, latencies):
+    """One full quiz through the HTTP routes, recording each request's latency"""
+    def call(endpoint, send):
+        started = time.perf_counter()
+        response = send()
+        latencies[endpoint].append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{endpoint} returned {response.status_code}")
+        return response
+
+    start = call('start_quiz', lambda: client.post('/start_quiz', json={
+        'user_name': f'learner-{rng.randrange(1000)}', 'subject': 'all', 'grade': 'all',
+        'num_questions': num_questions}))
+    for number in range(start.get_json()['total_questions']):
+        call('get_question', lambda: client.get(f'/get_question/{number}'))
+        call('submit_answer', lambda: client.post('/submit_answer', json={
+            'answer': rng.choice('abcd'), 'question_number': number + 1, 'time_spent': rng.randint(5, 60)}))
+    call('finish_quiz', lambda: client.post('/finish_quiz', json={}))
+
+
+def load_test(app_module, quizzes, concurrency, num_questions, seed):
+    """Run `quizzes` quizzes from `concurrency` threads; returns latency and throughput results"""
+    remaining = iter(range(quizzes))
+    remaining_lock = threading.Lock()
+    per_thread = []
+    errors = []
+
+    def worker(worker_num):
+        client = app_module.app.test_client()
+        rng = random.Random(seed * 1000 + worker_num)
+        latencies = {endpoint: [] for endpoint in ENDPOINTS}
+        per_thread.append(latencies)
+        while True:
+            with remaining_lock:
+                if next(remaining, None) is None:
+                    return
+            try:
+                run_quiz(client, rng, num_questions, latencies)
+            except Exception as e:
+                errors.append(str(e))
+
+    threads = [threading.Thread(target=worker, args=(worker_num,)) for worker_num in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    flush_started = time.perf_counter()
+    app_module.quiz_app.result_writer.flush()
+    flush_seconds = time.perf_counter() - flush_started
+
+    merged = {endpoint: [value for latencies in per_thread for value in latencies[endpoint]]
+              for endpoint in ENDPOINTS}
+    requests = sum(map(len, merged.values()))
+    results = {f'{endpoint} (load)': summarize(values) for endpoint, values in merged.items()}
+    results['all requests (load)'] = summarize([value for values in merged.values() for value in values])
+    throughput = {
+        'requests_per_second': requests / elapsed,
+        'quizzes_per_second': (quizzes - len(errors)) / elapsed,
+        'errors': len(errors),
+        'result_flush_seconds': flush_seconds,
+    }
+    if errors:
+        print(f"  {len(errors)} quizzes failed, first error: {errors[0]}")
+    return results, throughput
+
+
+def compare(results, baseline, tolerance):
+    """Names whose p99 is more than `tolerance` slower than in the baseline"""
+    regressions = []
+    for name, summary in results.items():
+        before = baseline.get('latency', {}).get(name)
+        if before and summary['p99_ms'] > before['p99_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {before['p99_ms']:.3f} -> {summary['p99_ms']:.3f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the quiz service on a scratch copy of its data')
+    parser.add_argument('--scale', type=int, default=0, help='bank size (default: the real bank)')
+    parser.add_argument('--concurrency', type=int, default=8, help='load test threads')
+    parser.add_argument('--quizzes', type=int, default=200, help='quizzes in the load test')
+    parser.add_argument('--questions', type=int, default=10, help='questions per quiz')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--data-dir', help='scratch data directory to reuse (default: a temporary one)')
+    parser.add_argument('--skip-micro', action='store_true')
+    parser.add_argument('--skip-load', action='store_true')
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p99 slowdown (default 0.25)')
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='quiz-benchmark-')
+    os.makedirs(data_dir, exist_ok=True)
+    random.seed(args.seed)
+    try:
+        bank_size = scale_bank(SOURCE_FILE, os.path.join(data_dir, 'questions.json'), args.scale, args.seed)
+        os.environ['QUIZ_DATA_DIR'] = data_dir
+        os.environ.setdefault('QUIZ_BANK_RELOAD_INTERVAL', '0')
+        os.environ.setdefault('QUIZ_LOG_LEVEL', 'WARNING')
+        started = time.perf_counter()
+        import app as app_module
+        print(f"Bank: {bank_size} questions, app started in {time.perf_counter() - started:.2f}s ({data_dir})")
+
+        results = {}
+        throughput = None
+        if not args.skip_micro:
+            print("Micro-benchmarks:")
+            micro = micro_benchmarks(app_module, args.seed)
+            for name, summary in micro.items():
+                print_row(name, summary)
+            results.update(micro)
+        if not args.skip_load:
+            print(f"Load test: {args.quizzes} quizzes of {args.questions} questions, "
+                  f"{args.concurrency} concurrent clients:")
+            load, throughput = load_test(app_module, args.quizzes, args.concurrency, args.questions, args.seed)
+            for name, summary in load.items():
+                print_row(name, summary)
+            print(f"  throughput: {throughput['requests_per_second']:.0f} requests/s, "
+                  f"{throughput['quizzes_per_second']:.1f} quizzes/s; "
+                  f"queued results written in {throughput['result_flush_seconds']:.3f}s")
+            results.update(load)
+        app_module.quiz_app.result_writer.close()
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {'bank_size': bank_size, 'settings': vars(args), 'latency': results, 'throughput': throughput}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,308 @@
+# bulk_grade.py - Grade offline answer sheets (e.g. scanned OMR output) in bulk
+#
+# A sheet lists students' answers in one of three shapes:
+#   long CSV/JSONL   student, question_id, answer[, time_spent]
+#   paper CSV/JSONL  student, paper, number, answer[, time_spent], graded
+#                    with the answer_keys.csv written by paper_generator.py
+#   wide CSV         student, then one column per question id
+#
+# Rows are parsed into flat columns and graded with NumPy: answers and
+# correct options are compared as arrays, a student's repeated answer to
+# a question keeps the last one, and per-student totals come from
+# bincount. Each student becomes one quiz session, written through the
+# app's write_results in batched transactions so /api/stats rollups stay
+# current.
+#
+# python bulk_grade.py SHEET.csv|SHEET.jsonl [--answer-keys papers/answer_keys.csv]
+#                      [--subject Math-II] [--grade 10th]
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from result_writer import SessionIdAllocator
+
+# Students written per transaction
+BATCH_STUDENTS = 500
+
+# Rejected rows listed in a report; the rest are only counted
+MAX_REJECTED_REPORTED = 100
+
+
+class AnswerColumns:
+    """Answer sheet rows as parallel lists, plus the rows that could not be read"""
+
+    def __init__(self):
+        self.students = []
+        self.question_ids = []
+        self.answers = []
+        self.time_spent = []
+        self.rows = []
+        self.rejected = []
+        self.rejected_count = 0
+
+    def __len__(self):
+        return len(self.students)
+
+    def add(self, row_num, student, question_id, answer, time_spent=None):
+        student = str(student or '').strip()
+        if not student:
+            return self.reject(row_num, 'missing student')
+        try:
+            question_id = int(question_id)
+            time_spent = int(float(time_spent)) if time_spent not in (None, '') else 0
+        except (TypeError, ValueError):
+            return self.reject(row_num, 'question id and time spent must be numbers')
+        self.students.append(student)
+        self.question_ids.append(question_id)
+        self.answers.append(str(answer or '').strip().lower())
+        self.time_spent.append(time_spent)
+        self.rows.append(row_num)
+
+    def reject(self, row_num, reason):
+        self.rejected_count += 1
+        if len(self.rejected) < MAX_REJECTED_REPORTED:
+            self.rejected.append({'row': row_num, 'reason': reason})
+
+
+def load_answer_keys(binary_stream):
+    """(paper, number) -> question id from a paper_generator.py answer_keys.csv stream"""
+    stream = io.TextIOWrapper(binary_stream, encoding='utf-8-sig', newline='')
+    try:
+        return {(int(row['paper']), int(row['number'])): int(row['question_id'])
+                for row in csv.DictReader(stream)}
+    finally:
+        stream.detach()
+
+
+def add_record(columns, row_num, record, answer_keys):
+    """Add one long-format row, resolving paper/number through the answer keys"""
+    question_id = record.get('question_id')
+    if question_id in (None, '') and record.get('paper') not in (None, ''):
+        try:
+            question_id = answer_keys[(int(record['paper']), int(record.get('number')))]
+        except (KeyError, TypeError, ValueError):
+            return columns.reject(row_num, 'paper and number not in the answer keys')
+    columns.add(row_num, record.get('student'), question_id, record.get('answer'), record.get('time_spent'))
+
+
+def read_sheet(source_name, binary_stream, answer_keys=None):
+    """AnswerColumns of a binary CSV or JSONL stream named source_name"""
+    extension = os.path.splitext(source_name)[1].lower()
+    if extension not in ('.csv', '.jsonl'):
+        raise ValueError(f"Unsupported sheet type {extension or source_name!r}; expected .csv or .jsonl")
+    answer_keys = answer_keys or {}
+    columns = AnswerColumns()
+    stream = io.TextIOWrapper(binary_stream, encoding='utf-8-sig', newline='')
+    try:
+        if extension == '.jsonl':
+            for row_num, line in enumerate(stream, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    columns.reject(row_num, 'invalid JSON')
+                    continue
+                if not isinstance(record, dict):
+                    columns.reject(row_num, 'expected an object')
+                    continue
+                add_record(columns, row_num, record, answer_keys)
+            return columns
+
+        reader = csv.reader(stream)
+        header = [name.strip().lower().replace(' ', '_') for name in next(reader, [])]
+        if 'student' not in header:
+            raise ValueError("Sheet needs a 'student' column")
+        student_col = header.index('student')
+        if 'answer' in header:
+            for row in reader:
+                if any(row):
+                    add_record(columns, reader.line_num, dict(zip(header, row)), answer_keys)
+            return columns
+
+        # Wide sheet: every other column is a question id
+        question_cols = [(col, name) for col, name in enumerate(header) if col != student_col]
+        if not all(name.isdigit() for _, name in question_cols):
+            raise ValueError("Sheet needs an 'answer' column or question ids as the other column names")
+        for row in reader:
+            if not any(row):
+                continue
+            row += [''] * (len(header) - len(row))
+            for col, question_id in question_cols:
+                columns.add(reader.line_num, row[student_col], question_id, row[col])
+        return columns
+    finally:
+        # Leave closing the binary stream to the caller
+        stream.detach()
+
+
+class GradedSheets:
+    """Graded answers ordered by student, with per-student totals"""
+
+    def __init__(self, students, student_idx, question_ids, answers, correct_answers, time_spent,
+                 is_correct, rejected, rejected_count):
+        self.students = students
+        self.student_idx = student_idx
+        self.question_ids = question_ids
+        self.answers = answers
+        self.correct_answers = correct_answers
+        self.time_spent = time_spent
+        self.is_correct = is_correct
+        self.rejected = rejected
+        self.rejected_count = rejected_count
+        self.totals = np.bincount(student_idx, minlength=len(students))
+        self.correct = np.bincount(student_idx, weights=is_correct, minlength=len(students)).astype(np.int64)
+        self.time_taken = np.bincount(student_idx, weights=time_spent, minlength=len(students)).astype(np.int64)
+        self.starts = np.concatenate(([0], np.cumsum(self.totals)))
+
+    def __len__(self):
+        return len(self.students)
+
+    @property
+    def score_percentages(self):
+        return self.correct / np.maximum(self.totals, 1) * 100
+
+
+def grade_sheet(index, columns):
+    """Grade AnswerColumns against the bank's correct options"""
+    rejected = list(columns.rejected)
+    rejected_count = columns.rejected_count
+    question_ids = np.array(columns.question_ids, dtype=np.int64)
+
+    # Answer key per distinct question; the rest of the grading is array work
+    unique_ids, question_idx = np.unique(question_ids, return_inverse=True)
+    keys = []
+    for question_id in unique_ids.tolist():
+        question = index.get(question_id)
+        keys.append(question.correct_answer.lower() if question is not None else '')
+    keys = np.array(keys, dtype=object)
+    known = keys[question_idx] != ''
+    for row in np.flatnonzero(~known).tolist():
+        rejected_count += 1
+        if len(rejected) < MAX_REJECTED_REPORTED:
+            rejected.append({'row': columns.rows[row], 'reason': f'unknown question {question_ids[row]}'})
+    rows = np.flatnonzero(known)
+
+    students, student_idx = np.unique(np.array(columns.students, dtype=object)[rows], return_inverse=True)
+    question_idx = question_idx[rows]
+
+    # The last answer a student gave to a question wins; keep sheet order per student
+    pairs = student_idx.astype(np.int64) * len(unique_ids) + question_idx
+    _, last = np.unique(pairs[::-1], return_index=True)
+    keep = np.sort(len(pairs) - 1 - last)
+    keep = keep[np.argsort(student_idx[keep], kind='stable')]
+    rows = rows[keep]
+    question_idx = question_idx[keep]
+
+    answers = np.array(columns.answers, dtype=object)[rows]
+    correct_answers = keys[question_idx]
+    return GradedSheets(
+        students=students,
+        student_idx=student_idx[keep],
+        question_ids=unique_ids[question_idx],
+        answers=answers,
+        correct_answers=correct_answers,
+        time_spent=np.array(columns.time_spent, dtype=np.int64)[rows],
+        is_correct=answers == correct_answers,
+        rejected=rejected,
+        rejected_count=rejected_count,
+    )
+
+
+def sheet_label(index, graded, field):
+    """The subject or grade all graded questions share, else 'all'"""
+    values = {getattr(index.get(question_id), field) for question_id in np.unique(graded.question_ids).tolist()}
+    return values.pop() if len(values) == 1 else 'all'
+
+
+def session_results(graded, subject, grade, first, last):
+    """(session_data, attempts) for students first..last-1"""
+    start, end = graded.starts[first], graded.starts[last]
+    question_ids = graded.question_ids[start:end].tolist()
+    answers = graded.answers[start:end].tolist()
+    correct_answers = graded.correct_answers[start:end].tolist()
+    is_correct = graded.is_correct[start:end].tolist()
+    time_spent = graded.time_spent[start:end].tolist()
+    scores = graded.score_percentages
+    for student in range(first, last):
+        attempts = [{
+            'question_id': question_ids[row],
+            'user_answer': answers[row],
+            'correct_answer': correct_answers[row],
+            'is_correct': is_correct[row],
+            'time_spent': time_spent[row],
+        } for row in range(graded.starts[student] - start, graded.starts[student + 1] - start)]
+        yield {
+            'user_name': graded.students[student],
+            'subject': subject,
+            'grade': grade,
+            'total_questions': int(graded.totals[student]),
+            'correct_answers': int(graded.correct[student]),
+            'score_percentage': float(scores[student]),
+            'time_taken': int(graded.time_taken[student]),
+        }, attempts
+
+
+def write_graded(quiz_app, graded, subject=None, grade=None, batch_students=BATCH_STUDENTS):
+    """Write one quiz session per student in batched transactions; returns the report"""
+    subject = subject or sheet_label(quiz_app.index, graded, 'subject')
+    grade = grade or sheet_label(quiz_app.index, graded, 'grade')
+    ids = SessionIdAllocator(quiz_app.db, block_size=max(1, min(batch_students, len(graded))))
+    sessions = []
+    for first in range(0, len(graded), batch_students):
+        results = [(ids.next_id(), session_data, attempts) for session_data, attempts
+                   in session_results(graded, subject, grade, first, min(first + batch_students, len(graded)))]
+        with quiz_app.db.transaction() as conn:
+            quiz_app.write_results(conn, results)
+        for session_id, session_data, attempts in results:
+            quiz_app.learners.record(session_data['user_name'], attempts)
+            sessions.append({'student': session_data['user_name'], 'session_id': session_id,
+                             'correct': session_data['correct_answers'], 'total': session_data['total_questions'],
+                             'percentage': round(session_data['score_percentage'], 1)})
+    return {
+        'subject': subject,
+        'grade': grade,
+        'students': len(graded),
+        'answers': int(graded.totals.sum()),
+        'mean_percentage': round(float(graded.score_percentages.mean()), 1) if len(graded) else 0.0,
+        'rejected_rows': graded.rejected_count,
+        'rejected': graded.rejected,
+        'sessions': sessions,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Grade CSV/JSONL answer sheets into the results database')
+    parser.add_argument('sheet')
+    parser.add_argument('--answer-keys', help='answer_keys.csv from paper_generator.py for paper/number sheets')
+    parser.add_argument('--subject', help='subject recorded for the sessions (default: from the questions)')
+    parser.add_argument('--grade', help='grade recorded for the sessions (default: from the questions)')
+    args = parser.parse_args()
+
+    os.environ.setdefault('QUIZ_BANK_RELOAD_INTERVAL', '0')
+    from app import quiz_app
+
+    started = time.perf_counter()
+    answer_keys = None
+    try:
+        if args.answer_keys:
+            with open(args.answer_keys, 'rb') as f:
+                answer_keys = load_answer_keys(f)
+        with open(args.sheet, 'rb') as f:
+            columns = read_sheet(os.path.basename(args.sheet), f, answer_keys)
+    except (KeyError, ValueError) as e:
+        sys.exit(f"Error: {e}")
+    graded = grade_sheet(quiz_app.index, columns)
+    report = write_graded(quiz_app, graded, args.subject, args.grade)
+    print(f"{args.sheet}: {report['students']} students, {report['answers']} answers graded "
+          f"({report['subject']}/{report['grade']}, mean {report['mean_percentage']}%), "
+          f"{report['rejected_rows']} rows rejected in {time.perf_counter() - started:.2f}s")
+    for rejected in report['rejected']:
+        print(f"  row {rejected['row']}: {rejected['reason']}")
@@ -0,0 +1,17 @@
+# data_paths.py - Location of the question bank, databases and caches
+#
+# Shared by the app and the command-line tools so both read and write the
+# same files. QUIZ_DATA_DIR is read on each call, so tools that point it at
+# a scratch copy (benchmark.py) can set it after this module is imported.
+
+import os
+
+
+def data_dir():
+    """Data directory: QUIZ_DATA_DIR, else data/ next to the code"""
+    return os.environ.get('QUIZ_DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+
+
+def data_path(*names):
+    """Path of a file in the data directory"""
+    return os.path.join(data_dir(), *names)
@@ -0,0 +1,62 @@
+# database.py - Shared SQLite connection management
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class Database:
+    """Per-thread SQLite connections tuned for concurrent readers and writers
+
+    Each thread (and each forked worker) gets one long-lived connection in
+    WAL mode, so readers never block the writer and commits skip the
+    rollback-journal fsync dance. The sqlite3 statement cache keeps the
+    prepared form of every SQL string the app reuses.
+    """
+
+    def __init__(self, db_file, busy_timeout_ms=5000, cached_statements=128):
+        self.db_file = db_file
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+
+    def connection(self):
+        """This thread's connection, opened on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file,
+                               timeout=self.busy_timeout_ms / 1000,
+                               cached_statements=self.cached_statements)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # NORMAL is durable across application crashes in WAL mode; only an
+        # OS crash or power loss can drop the last few commits
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout_ms)}')
+        return conn
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """Run statements in one transaction, committed on success
+
+        With immediate=True the write lock is taken up front, so reads made
+        inside the transaction cannot go stale before its writes.
+        """
+        conn = self.connection()
+        with conn:
+            if immediate:
+                conn.execute('BEGIN IMMEDIATE')
+            yield conn
+
+    def close(self):
+        """Close this thread's connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local.conn = None
@@ -0,0 +1,169 @@
+# duplicate_detection.py - Near-duplicate question groups via MinHash/LSH
+#
+# Each question becomes a set of shingles: word bigrams of its normalized
+# text (LaTeX and symbols spelled as words, see question_search) plus its
+# option words. NUM_HASHES MinHash values per question are computed with
+# vectorized universal hashing, and the signatures are split into BANDS
+# bands; only questions sharing a whole band are compared, so the work
+# grows with the bank rather than with the number of pairs. Candidates
+# whose signatures agree on at least `threshold` of the hashes (an estimate
+# of their Jaccard similarity) are joined into groups.
+#
+# Batch job: python duplicate_detection.py [--threshold 0.8]
+# writes data/duplicate_groups.json, which the app loads with the bank so
+# that one quiz never contains two questions of the same group.
+
+import json
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+from question_search import BENGALI_MARKS, normalize_search_text
+
+NUM_HASHES = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_HASHES // BANDS
+DEFAULT_THRESHOLD = 0.8
+
+SEED = 20240101
+
+TOKEN_RE = re.compile(rf'[\w{BENGALI_MARKS}]+')
+
+
+def shingles(question):
+    """Shingle set of a question: text word bigrams plus option words"""
+    text, _, options = normalize_search_text(
+        question.text + '\0' + '\n'.join(question.option_texts)).casefold().partition('\0')
+    words = TOKEN_RE.findall(text)
+    result = {f"{first} {second}" for first, second in zip(words, words[1:])} or set(words)
+    result.update('o:' + word for word in TOKEN_RE.findall(options))
+    return result
+
+
+def minhash_signatures(shingle_sets):
+    """(questions x NUM_HASHES) MinHash signatures of shingle sets"""
+    vocabulary = {}
+    ids = []
+    lengths = []
+    for number, shingle_set in enumerate(shingle_sets):
+        # Empty questions get a shingle of their own so they match nothing
+        # Sorted so shingle ids, and so the groups, do not vary between runs
+        shingle_set = sorted(shingle_set) or [f"empty:{number}"]
+        ids.extend(vocabulary.setdefault(shingle, len(vocabulary)) for shingle in shingle_set)
+        lengths.append(len(shingle_set))
+
+    shingle_ids = np.array(ids, dtype=np.uint64)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64)
+    # Multiply-shift hashing: the high 32 bits of (a * x + b) mod 2**64
+    # with random odd a, which needs no division
+    rng = np.random.default_rng(SEED)
+    a = rng.integers(0, 1 << 63, NUM_HASHES, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.integers(0, 1 << 63, NUM_HASHES, dtype=np.uint64)
+
+    signatures = np.empty((len(lengths), NUM_HASHES), dtype=np.uint32)
+    hashed = np.empty_like(shingle_ids)
+    for k in range(NUM_HASHES):
+        np.multiply(shingle_ids, a[k], out=hashed)
+        hashed += b[k]
+        hashed >>= np.uint64(32)
+        signatures[:, k] = np.minimum.reduceat(hashed, starts)
+    return signatures
+
+
+def candidate_pairs(signatures):
+    """Unique (i, j) row pairs sharing at least one LSH band"""
+    count = len(signatures)
+    pairs = []
+    # Odd multipliers mixing a band's rows into one 64-bit bucket key;
+    # colliding keys only add candidates, which are verified afterwards
+    mixers = np.random.default_rng(SEED + 1).integers(0, 1 << 63, ROWS_PER_BAND, dtype=np.uint64)
+    mixers = mixers * np.uint64(2) + np.uint64(1)
+    for band in range(BANDS):
+        rows = signatures[:, band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].astype(np.uint64)
+        _, buckets, counts = np.unique((rows * mixers).sum(axis=1, dtype=np.uint64),
+                                       return_inverse=True, return_counts=True)
+        members = np.nonzero(counts[buckets] > 1)[0]
+        if not len(members):
+            continue
+        members = members[np.argsort(buckets[members], kind='stable')]
+        member_buckets = buckets[members]
+        # Pair every bucket member with the bucket's first member rather
+        # than with each other; grouping joins them transitively
+        first = np.concatenate(([True], member_buckets[1:] != member_buckets[:-1]))
+        pivots = members[first][np.cumsum(first) - 1]
+        pairs.append(pivots[~first].astype(np.int64) * count + members[~first])
+    if not pairs:
+        return np.empty((0, 2), dtype=np.int64)
+    pairs = np.unique(np.concatenate(pairs))
+    return np.stack([pairs // count, pairs % count], axis=1)
+
+
+def group_rows(count, pairs):
+    """Connected components of rows joined by pairs, as lists of row numbers"""
+    # Every row points at the lowest row it is known to be joined with;
+    # spread the minimum along the pairs and jump pointers until stable
+    labels = np.arange(count)
+    while len(pairs):
+        lowest = np.minimum(labels[pairs[:, 0]], labels[pairs[:, 1]])
+        updated = labels.copy()
+        np.minimum.at(updated, pairs[:, 0], lowest)
+        np.minimum.at(updated, pairs[:, 1], lowest)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            break
+        labels = updated
+
+    order = np.argsort(labels, kind='stable')
+    _, starts, counts = np.unique(labels[order], return_index=True, return_counts=True)
+    return [order[start:start + size].tolist() for start, size in zip(starts, counts) if size > 1]
+
+
+def find_duplicate_groups(questions, threshold=DEFAULT_THRESHOLD):
+    """Groups of near-duplicate question ids, largest first"""
+    questions = list(questions)
+    signatures = minhash_signatures([shingles(question) for question in questions])
+    pairs = candidate_pairs(signatures)
+    if len(pairs):
+        similarity = (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1)
+        pairs = pairs[similarity >= threshold]
+    groups = [sorted(questions[row].id for row in rows) for rows in group_rows(len(questions), pairs)]
+    return sorted(groups, key=lambda group: (-len(group), group[0]))
+
+
+def write_duplicate_groups(path, groups, threshold):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'threshold': threshold, 'num_hashes': NUM_HASHES, 'groups': groups}, f)
+    os.replace(tmp_path, path)
+
+
+def load_duplicate_groups(path):
+    """Duplicate groups written by this job, or [] when it has not run"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)['groups']
+    except FileNotFoundError:
+        return []
+
+
+if __name__ == '__main__':
+    from bank_cache import load_question_bank
+    from data_paths import data_path
+
+    threshold = DEFAULT_THRESHOLD
+    if '--threshold' in sys.argv:
+        threshold = float(sys.argv[sys.argv.index('--threshold') + 1])
+    bank, index = load_question_bank(data_path('questions.json'))
+
+    started = time.perf_counter()
+    questions = [bank[position] for position in index.positions_by_id.values()]
+    groups = find_duplicate_groups(questions, threshold)
+    write_duplicate_groups(data_path('duplicate_groups.json'), groups, threshold)
+
+    print(f"{len(groups)} duplicate groups covering {sum(map(len, groups))} of {len(questions)} questions "
+          f"in {time.perf_counter() - started:.1f}s")
+    for group in groups[:5]:
+        print(f"  {group[:8]}{' ...' if len(group) > 8 else ''}: {index.get(group[0]).text[:60]!r}")
@@ -0,0 +1,31 @@
+# gunicorn.conf.py - Production worker settings for the BEnQA Quiz Platform
+#
+# Run with: gunicorn -c gunicorn.conf.py app:app
+# or, with async workers (see asgi.py):
+#   gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:application
+
+import gc
+import os
+
+bind = os.environ.get('QUIZ_BIND', '0.0.0.0:5002')
+workers = int(os.environ.get('QUIZ_WORKERS', (os.cpu_count() or 1) * 2 + 1))
+
+# Import app.py (and load the question bank) once in the master so every
+# worker shares the memory-mapped bank and index pages copy-on-write
+preload_app = True
+
+# Worker-local quiz state would be invisible to the other workers
+os.environ.setdefault('QUIZ_SESSION_BACKEND', 'sqlite')
+
+
+def when_ready(server):
+    """Freeze objects created while preloading before workers are forked"""
+    # Keeps the cyclic GC in each worker from writing to (and so copying)
+    # the pages holding the preloaded bank, index and module objects
+    gc.freeze()
+
+
+def worker_exit(server, worker):
+    """Write out quiz results still queued in the exiting worker"""
+    from app import quiz_app
+    quiz_app.result_writer.close()
@@ -0,0 +1,61 @@
+# math_format.py - LaTeX to MathJax formatting for question text
+
+import re
+from functools import lru_cache
+
+# Patterns are compiled once and applied in the same order as the original
+# per-call implementation, since later passes see the output of earlier ones
+FRAC_RE = re.compile(r'\\frac\{([^}]+)\}\{([^}]+)\}')
+EXPONENT_RE = re.compile(r'(\w+)\^(\{[^}]+\}|\w+)')
+SQRT_RE = re.compile(r'\\sqrt\{([^}]+)\}')
+SUBSCRIPT_RE = re.compile(r'(\w+)_(\{[^}]+\}|\w+)')
+DISPLAY_MATH_RE = re.compile(r'\\\[(.*?)\\\]', re.DOTALL)
+INLINE_MATH_RE = re.compile(r'\\\((.*?)\\\)', re.DOTALL)
+
+# Common mathematical symbols, replaced in a single combined pass
+SYMBOLS = ('cdot', 'times', 'div', 'pm', 'infty', 'pi', 'theta', 'alpha', 'beta', 'gamma', 'delta')
+SYMBOL_RE = re.compile('|'.join(re.escape('\\' + name) for name in SYMBOLS))
+
+# Characters at least one pass needs; text without any of them is returned as is
+TRIGGER_CHARS = ('\\', '^', '_')
+
+# Bump when the output of format_math_expressions changes
+FORMAT_VERSION = 1
+
+
+@lru_cache(maxsize=65536)
+def format_math_expressions(text):
+    """Format mathematical expressions for MathJax rendering"""
+    if not text or not any(char in text for char in TRIGGER_CHARS):
+        return text
+
+    # Handle inline fractions: \frac{a}{b} -> $\frac{a}{b}$
+    text = FRAC_RE.sub(r'$\\frac{\1}{\2}$', text)
+
+    # Handle exponents: x^2 -> $x^2$
+    text = EXPONENT_RE.sub(r'$\1^{\2}$', text)
+
+    # Handle square roots: \sqrt{x} -> $\sqrt{x}$
+    text = SQRT_RE.sub(r'$\\sqrt{\1}$', text)
+
+    # Handle subscripts: x_1 -> $x_1$
+    text = SUBSCRIPT_RE.sub(r'$\1_{\2}$', text)
+
+    # Handle common mathematical symbols
+    text = SYMBOL_RE.sub(lambda match: '$' + match.group(0) + '$', text)
+
+    # Handle display math (equations on their own line)
+    text = DISPLAY_MATH_RE.sub(r'$$\1$$', text)
+    text = INLINE_MATH_RE.sub(r'$\1$', text)
+
+    return text
+
+
+def format_question_bank(questions):
+    """Format every question and option in the bank in place"""
+    for question in questions:
+        question['question'] = format_math_expressions(question['question'])
+        options = question.get('options', {})
+        for key, option in options.items():
+            options[key] = format_math_expressions(option)
+    return questions
@@ -0,0 +1,144 @@
+# math_render.py - Server-side pre-rendering of MathJax-delimited math to SVG
+#
+# Formatted question text marks math with $...$ / $$...$$ (see math_format).
+# Each expression is rendered once with matplotlib's mathtext and stored in a
+# content-addressed fragment cache, so clients can show the markup directly
+# instead of running a MathJax typeset for every question they display.
+# Expressions mathtext cannot parse stay as $...$ and the text is reported as
+# not fully rendered, leaving the client to typeset it as before.
+
+import hashlib
+import io
+import os
+import re
+import sys
+import threading
+from functools import lru_cache
+
+try:
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.mathtext import math_to_image
+    # Stable glyph ids so identical expressions render to identical markup
+    matplotlib.rcParams['svg.hashsalt'] = 'benqa-math'
+except ImportError:
+    math_to_image = None
+
+# Bump when the rendered markup changes, to bypass old cache entries
+RENDER_VERSION = 1
+
+MATH_SEGMENT_RE = re.compile(r'\$\$(.+?)\$\$|\$(.+?)\$', re.DOTALL)
+SVG_PROLOGUE_RE = re.compile(r'^.*?(?=<svg)|<metadata>.*?</metadata>\s*', re.DOTALL)
+
+# mathtext uses global matplotlib state and is not thread-safe
+_render_lock = threading.Lock()
+
+
+def is_available():
+    """Whether matplotlib is installed so math can be pre-rendered"""
+    return math_to_image is not None
+
+
+class FragmentCache:
+    """Content-addressed store of rendered fragments on disk"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def key(tex, display):
+        source = f"{RENDER_VERSION}:{int(display)}:{tex}"
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.svg')
+
+    def get(self, key):
+        try:
+            with open(self.path(key), 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, markup):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(markup)
+        os.replace(tmp_path, path)
+
+
+class MathRenderer:
+    """Renders math segments of formatted text, backed by a FragmentCache"""
+
+    # Marker stored for expressions mathtext cannot render
+    FAILED = ''
+
+    def __init__(self, cache_dir):
+        self.fragments = FragmentCache(cache_dir)
+        self.render_expression = lru_cache(maxsize=8192)(self._render_expression)
+
+    def _render_expression(self, tex, display):
+        """SVG markup for one expression, or FAILED"""
+        key = self.fragments.key(tex, display)
+        markup = self.fragments.get(key)
+        if markup is not None:
+            return markup
+
+        buffer = io.BytesIO()
+        try:
+            with _render_lock:
+                math_to_image(f"${tex}$", buffer, format='svg')
+        except Exception:
+            markup = self.FAILED
+        else:
+            svg = SVG_PROLOGUE_RE.sub('', buffer.getvalue().decode('utf-8'))
+            css_class = 'math-svg math-display' if display else 'math-svg'
+            markup = svg.replace('<svg ', f'<svg class="{css_class}" ', 1)
+        self.fragments.put(key, markup)
+        return markup
+
+    def render_text(self, text):
+        """Return (markup, fully_rendered) for formatted text"""
+        if not text or '$' not in text:
+            return text, True
+
+        fully_rendered = True
+        parts = []
+        last = 0
+        for match in MATH_SEGMENT_RE.finditer(text):
+            parts.append(text[last:match.start()])
+            display = match.group(1) is not None
+            markup = self.render_expression(match.group(1) if display else match.group(2), display)
+            if markup == self.FAILED:
+                fully_rendered = False
+                parts.append(match.group(0))
+            else:
+                parts.append(markup)
+            last = match.end()
+        parts.append(text[last:])
+        return ''.join(parts), fully_rendered
+
+    def render_question(self, question):
+        """Pre-rendered question/option markup and whether no math is left to typeset"""
+        question_html, rendered = self.render_text(question.text)
+        options_html = {}
+        for key, option in question.options.items():
+            options_html[key], option_rendered = self.render_text(option)
+            rendered = rendered and option_rendered
+        return {'question_html': question_html, 'options_html': options_html, 'rendered': rendered}
+
+
+if __name__ == '__main__':
+    # Build-time pre-render of the whole bank: python math_render.py
+    from bank_cache import load_question_bank
+    from data_paths import data_path
+
+    source = sys.argv[1] if len(sys.argv) > 1 else data_path('questions.json')
+    if not is_available():
+        sys.exit("matplotlib is required to pre-render math")
+    renderer = MathRenderer(os.path.join(os.path.dirname(source), 'math_fragments'))
+    questions, _ = load_question_bank(source)
+    rendered = sum(renderer.render_question(question)['rendered'] for question in questions)
+    print(f"Pre-rendered {rendered} of {len(questions)} questions completely")
@@ -0,0 +1,175 @@
+# metrics.py - Request latency histograms and counters in Prometheus text format
+#
+# Counters and histograms live in memory per process; recording one takes a
+# lock and a few list updates. Under gunicorn every worker writes its
+# totals to <state_dir>/<pid>.json at most once per flush interval, and
+# /metrics adds up the files of live workers, so a scrape that lands on any
+# worker sees the whole server. When metrics are disabled the app registers
+# no hooks and every record call returns at its first line.
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# Seconds; request, selection and database write latencies
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Questions per started quiz
+SIZE_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 200)
+
+HISTOGRAMS = {
+    'quiz_request_duration_seconds': ('Request latency by endpoint', LATENCY_BUCKETS),
+    'quiz_selection_duration_seconds': ('Time to pick the questions of a new quiz', LATENCY_BUCKETS),
+    'quiz_session_questions': ('Questions per started quiz', SIZE_BUCKETS),
+    'quiz_db_write_duration_seconds': ('Time to insert a batch of finished quizzes', LATENCY_BUCKETS),
+}
+
+COUNTERS = {
+    'quiz_requests_total': 'Requests by endpoint and status code',
+    'quiz_db_rows_written_total': 'Rows inserted for finished quizzes by table',
+}
+
+
+def label_text(labels):
+    """Prometheus label set from (name, value) pairs"""
+    parts = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Metrics:
+    """Per-process counters and histograms, merged across workers on scrape"""
+
+    def __init__(self, enabled=False, state_dir=None, flush_interval=1.0):
+        self.enabled = enabled
+        self.state_dir = state_dir
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._reset()
+        if enabled:
+            if state_dir:
+                os.makedirs(state_dir, exist_ok=True)
+            # Totals recorded before a fork belong to the parent only
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._counters = {}
+        self._histograms = {}
+        self._flushed_at = time.monotonic()
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        buckets = HISTOGRAMS[name][1]
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(buckets) + 1), 0.0]
+            histogram[0][bisect_left(buckets, value)] += 1
+            histogram[1] += value
+
+    def export(self):
+        """JSON-serializable totals of this process"""
+        with self._lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, labels, list(counts), total]
+                               for (name, labels), (counts, total) in self._histograms.items()],
+            }
+
+    def flush_if_due(self):
+        """Write this process's totals for other workers' scrapes, at most once per interval"""
+        if not self.enabled or not self.state_dir:
+            return
+        now = time.monotonic()
+        if now - self._flushed_at < self.flush_interval:
+            return
+        self._flushed_at = now
+        self.flush()
+
+    def flush(self):
+        if not self.enabled or not self.state_dir:
+            return
+        path = os.path.join(self.state_dir, f'{os.getpid()}.json')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.export(), f)
+        os.replace(tmp_path, path)
+
+    def _worker_exports(self):
+        """Totals of this process plus those flushed by other live workers"""
+        exports = [self.export()]
+        if not self.state_dir:
+            return exports
+        for file_name in os.listdir(self.state_dir):
+            pid_text, extension = os.path.splitext(file_name)
+            if extension != '.json' or not pid_text.isdigit() or int(pid_text) == os.getpid():
+                continue
+            path = os.path.join(self.state_dir, file_name)
+            if not process_alive(int(pid_text)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    exports.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return exports
+
+    def render(self):
+        """All workers' metrics in the Prometheus text exposition format"""
+        counters = {}
+        histograms = {}
+        for export in self._worker_exports():
+            for name, labels, value in export['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, counts, total in export['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                merged = histograms.setdefault(key, [[0] * len(counts), 0.0])
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+
+        lines = []
+        for name, help_text in COUNTERS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            for (counter_name, labels), value in sorted(counters.items()):
+                if counter_name == name:
+                    lines.append(f'{name}{label_text(labels)} {value}')
+        for name, (help_text, buckets) in HISTOGRAMS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+            for (histogram_name, labels), (counts, total) in sorted(histograms.items()):
+                if histogram_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{label_text(labels + (("le", bound),))} {cumulative}')
+                lines.append(f'{name}_sum{label_text(labels)} {total}')
+                lines.append(f'{name}_count{label_text(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
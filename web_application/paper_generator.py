@@ -0,0 +1,216 @@
+# paper_generator.py - Balanced exam paper variants with answer keys
+#
+# A paper spec is a list of quotas ("count questions from this subject,
+# grade and optionally source file"). Every quota gets a pool of matching
+# questions; pools are made disjoint (a question belongs to the first
+# quota it matches) and hold one question per near-duplicate group, so no
+# paper repeats a question or contains two near-duplicates.
+#
+# Each pool is dealt to the K papers from a deck that is reshuffled every
+# time it runs out, so when a pool is large enough the papers share no
+# questions, and otherwise every question is used as evenly as possible.
+# All shuffles come from one seed, so the same seed and bank version give
+# the same papers. Rendering is spread over a process pool for large K.
+#
+# python paper_generator.py --variants 200 --quota Math-II/10th=10 \
+#     --quota Physics-I/12th/12th-Physics-I.csv=5 --seed 7 --output papers/
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+
+from question_index import normalize_key
+
+# Papers from which generate_papers() renders in a process pool by default
+PARALLEL_MIN_PAPERS = 50
+
+# Questions the pool workers render from, inherited over fork()
+_worker_questions = None
+
+
+class PaperSpecError(ValueError):
+    """A paper spec that cannot be met by the question bank"""
+
+
+def parse_quota(text):
+    """Quota dict from 'subject/grade[/source_file]=count' ('all' matches everything)"""
+    filters, _, count = text.rpartition('=')
+    parts = filters.split('/') if filters else []
+    if not count.isdigit() or not 1 <= len(parts) <= 3:
+        raise PaperSpecError(f"Quota {text!r} is not subject/grade[/source_file]=count")
+    parts += ['all'] * (3 - len(parts))
+    return {'subject': parts[0], 'grade': parts[1], 'source_file': parts[2], 'count': int(count)}
+
+
+def quota_pools(index, quotas):
+    """Disjoint, duplicate-free lists of question positions for each quota"""
+    questions = index.questions
+    # Groups by position, so only source file quotas have to decode questions
+    group_at = {index.positions_by_id[question_id]: group
+                for question_id, group in index.duplicate_groups.items()
+                if question_id in index.positions_by_id}
+    claimed = set()
+    groups_used = set()
+    pools = []
+    for quota in quotas:
+        subject_key, grade_key, _ = index.filter_keys(quota.get('subject'), quota.get('grade'))
+        source_file = quota.get('source_file')
+        source_key = normalize_key(source_file) if source_file and source_file != 'all' else None
+        positions = sorted(position for pair in index.matching_pairs(subject_key, grade_key)
+                           for position in index.buckets[pair])
+
+        pool = []
+        for position in positions:
+            if position in claimed:
+                continue
+            if source_key is not None and normalize_key(questions[position].source_file) != source_key:
+                continue
+            group = group_at.get(position)
+            if group is not None:
+                if group in groups_used:
+                    continue
+                groups_used.add(group)
+            pool.append(position)
+        claimed.update(pool)
+
+        if len(pool) < quota['count']:
+            raise PaperSpecError(f"Quota {describe_quota(quota)} needs {quota['count']} questions, "
+                                 f"only {len(pool)} available")
+        pools.append(pool)
+    return pools
+
+
+def describe_quota(quota):
+    return '/'.join(str(quota.get(name) or 'all') for name in ('subject', 'grade', 'source_file'))
+
+
+def deal(pool, per_paper, papers, rng):
+    """`per_paper` distinct positions from `pool` for each paper, spreading use evenly"""
+    dealt = []
+    deck = []
+    for _ in range(papers):
+        if len(deck) < per_paper:
+            # Leftovers go first and again after the fresh shuffle, so no
+            # paper gets one twice and every position is used once per deck
+            fresh = pool[:]
+            rng.shuffle(fresh)
+            leftover = set(deck)
+            deck = deck + [position for position in fresh if position not in leftover] + deck
+        dealt.append(deck[:per_paper])
+        deck = deck[per_paper:]
+    return dealt
+
+
+def plan_papers(index, quotas, variants, seed):
+    """Question positions of each paper variant, in paper order"""
+    if variants < 1:
+        raise PaperSpecError("At least one paper variant is needed")
+    if not quotas or any(quota.get('count', 0) < 1 for quota in quotas):
+        raise PaperSpecError("Every quota needs a count of at least 1")
+    rng = random.Random(seed)
+    papers = [[] for _ in range(variants)]
+    for quota, pool in zip(quotas, quota_pools(index, quotas)):
+        for paper, positions in zip(papers, deal(pool, quota['count'], variants, rng)):
+            paper.extend(positions)
+    for paper in papers:
+        rng.shuffle(paper)
+    return papers
+
+
+def render_paper(paper_num, positions, questions=None, output_dir=None):
+    """Paper questions (no answers) and answer key; written to output_dir when given"""
+    questions = questions if questions is not None else _worker_questions
+    paper = {'paper': paper_num, 'questions': [], 'answer_key': []}
+    for number, position in enumerate(positions, 1):
+        question = questions[position]
+        paper['questions'].append(dict(question.to_dict(include_answer=False), number=number))
+        paper['answer_key'].append({'number': number, 'question_id': question.id,
+                                    'answer': question.correct_answer.upper()})
+    if output_dir is None:
+        return paper
+    with open(os.path.join(output_dir, f'paper-{paper_num:03d}.json'), 'w', encoding='utf-8') as f:
+        json.dump(paper, f, ensure_ascii=False, indent=1)
+    return {'paper': paper_num, 'answer_key': paper['answer_key']}
+
+
+def overlap_stats(papers):
+    """Most and average questions shared by two papers, and most uses of one question"""
+    sets = [set(paper) for paper in papers]
+    shared = [len(first & second) for first, second in combinations(sets, 2)]
+    uses = {}
+    for paper in papers:
+        for position in paper:
+            uses[position] = uses.get(position, 0) + 1
+    return {
+        'max_shared': max(shared, default=0),
+        'mean_shared': round(sum(shared) / len(shared), 3) if shared else 0.0,
+        'max_uses': max(uses.values(), default=0),
+    }
+
+
+def generate_papers(index, quotas, variants, seed, processes=None, output_dir=None):
+    """Plan and render `variants` papers; returns (rendered papers, overlap stats)
+
+    processes=None renders in a process pool when there are at least
+    PARALLEL_MIN_PAPERS papers; 1 renders in this process.
+    """
+    global _worker_questions
+    papers = plan_papers(index, quotas, variants, seed)
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    if processes is None:
+        processes = os.cpu_count() or 1 if variants >= PARALLEL_MIN_PAPERS else 1
+    processes = min(processes, variants)
+
+    if processes > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        # Workers inherit the bank through fork() instead of loading it again
+        _worker_questions = index.questions
+        try:
+            with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('fork')) as pool:
+                rendered = list(pool.map(render_paper, range(1, variants + 1), papers,
+                                         [None] * variants, [output_dir] * variants,
+                                         chunksize=max(1, variants // (processes * 4))))
+        finally:
+            _worker_questions = None
+    else:
+        rendered = [render_paper(paper_num, positions, index.questions, output_dir)
+                    for paper_num, positions in enumerate(papers, 1)]
+    return rendered, overlap_stats(papers)
+
+
+if __name__ == '__main__':
+    from bank_cache import load_question_bank
+    from data_paths import data_path
+    from duplicate_detection import load_duplicate_groups
+
+    parser = argparse.ArgumentParser(description='Generate balanced exam paper variants with answer keys')
+    parser.add_argument('--variants', type=int, required=True, help='number of papers')
+    parser.add_argument('--quota', action='append', required=True, type=parse_quota,
+                        help='subject/grade[/source_file]=count, repeatable')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--processes', type=int, help='render processes (default: all cores for large runs)')
+    parser.add_argument('--output', default='papers', help='directory for paper-NNN.json and answer_keys.csv')
+    args = parser.parse_args()
+
+    bank, index = load_question_bank(data_path('questions.json'))
+    index.set_duplicate_groups(load_duplicate_groups(data_path('duplicate_groups.json')))
+
+    started = time.perf_counter()
+    try:
+        rendered, stats = generate_papers(index, args.quota, args.variants, args.seed, args.processes, args.output)
+    except PaperSpecError as e:
+        sys.exit(f"Error: {e}")
+    with open(os.path.join(args.output, 'answer_keys.csv'), 'w', encoding='utf-8') as f:
+        f.write('paper,number,question_id,answer\n')
+        for paper in rendered:
+            for entry in paper['answer_key']:
+                f.write(f"{paper['paper']},{entry['number']},{entry['question_id']},{entry['answer']}\n")
+    print(f"Wrote {len(rendered)} papers to {args.output} in {time.perf_counter() - started:.2f}s; "
+          f"most questions shared by two papers: {stats['max_shared']} (mean {stats['mean_shared']}), "
+          f"most uses of one question: {stats['max_uses']}")
@@ -0,0 +1,86 @@
+# payload_cache.py - Pre-serialized, content-hashed question payloads
+
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+# Responses smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 1024
+
+
+class SerializedPayload:
+    """JSON bytes for one question with their ETag and gzip form"""
+
+    __slots__ = ('body', 'etag', 'gzipped')
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.gzipped = gzip.compress(body, 6) if len(body) >= MIN_COMPRESS_BYTES else None
+
+
+class PayloadCache:
+    """LRU of serialized question payloads keyed by question id"""
+
+    def __init__(self, build_payload, max_entries=20000):
+        self.build_payload = build_payload
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, question):
+        with self._lock:
+            payload = self._entries.get(question.id)
+            if payload is not None:
+                self._entries.move_to_end(question.id)
+                return payload
+
+        body = json.dumps(self.build_payload(question), ensure_ascii=False,
+                          separators=(',', ':')).encode('utf-8')
+        payload = SerializedPayload(body)
+        with self._lock:
+            self._entries[question.id] = payload
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return payload
+
+    def discard(self, question_ids):
+        """Drop payloads of questions that changed"""
+        with self._lock:
+            for question_id in question_ids:
+                self._entries.pop(question_id, None)
+
+    def copy(self, discard=()):
+        """New cache with this one's payloads, less those of questions in `discard`"""
+        cache = PayloadCache(self.build_payload, self.max_entries)
+        discard = set(discard)
+        with self._lock:
+            cache._entries.update((question_id, payload) for question_id, payload in self._entries.items()
+                                  if question_id not in discard)
+        return cache
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def join_payloads(payloads, total_questions):
+    """Bootstrap body assembled from already-serialized question payloads"""
+    return b''.join([
+        b'{"questions":[', b','.join(payload.body for payload in payloads),
+        b'],"total_questions":', str(total_questions).encode('ascii'), b'}'
+    ])
+
+
+def combined_etag(payloads):
+    """ETag for a response made of several payloads"""
+    digest = hashlib.sha256()
+    for payload in payloads:
+        digest.update(payload.etag.encode('ascii'))
+    return digest.hexdigest()[:32]
+
+
+def accepts_gzip(request):
+    return 'gzip' in request.headers.get('Accept-Encoding', '')
@@ -0,0 +1,326 @@
+# question_index.py - Precomputed subject/grade index for the question bank
+
+import copy
+import random
+from array import array
+from bisect import bisect_right
+
+
+def normalize_key(value):
+    """Normalize a subject or grade value for lookups"""
+    return (value or '').lower()
+
+
+def random_slots(total, first):
+    """Distinct random slots below `total`: a sample of `first`, then the rest shuffled"""
+    drawn = random.sample(range(total), first)
+    yield from drawn
+    if first < total:
+        drawn = set(drawn)
+        rest = [slot for slot in range(total) if slot not in drawn]
+        random.shuffle(rest)
+        yield from rest
+
+
+class QuestionIndex:
+    """Subject/grade buckets of question positions, built once per bank
+
+    Each question also carries a difficulty: the bank's own value unless an
+    empirical one has been applied with set_difficulties. Near-duplicate
+    groups applied with set_duplicate_groups keep sample() from picking two
+    questions of one group.
+    """
+
+    # Upper bound on memoized (subject, grade, difficulty) filter resolutions
+    MAX_RESOLVED = 1024
+
+    def __init__(self, questions, state=None):
+        self.questions = questions
+        if state is None:
+            self._build(questions)
+        else:
+            self._restore(state)
+        self.difficulty_overrides = {}
+        self.duplicate_groups = {}
+        self._build_difficulty_buckets()
+        self._prime_resolved()
+
+    def _prime_resolved(self):
+        """Group grades by subject and resolve every known filter up front"""
+        # Grades present for each subject key, used to resolve grade filters
+        grades_by_subject = {}
+        for subject_key, grade_key in self.buckets:
+            grades_by_subject.setdefault(subject_key, []).append(grade_key)
+        self.grades_by_subject = grades_by_subject
+
+        # Filter resolutions keyed by normalized (subject, grade); the exact
+        # and partial-match fallbacks for every known key are resolved up front
+        resolved = {}
+        for subject_key, grade_keys in grades_by_subject.items():
+            self._resolve(subject_key, None, memo=resolved)
+            for grade_key in grade_keys:
+                self._resolve(subject_key, grade_key, memo=resolved)
+                self._resolve(None, grade_key, memo=resolved)
+        self._resolve(None, None, memo=resolved)
+        self._resolved = resolved
+
+    def _build(self, questions):
+        """Bucket every question by normalized subject and grade"""
+        self.buckets = {}
+        self.positions_by_id = {}
+        self.difficulty_names = []
+        self.difficulty_codes = array('B')
+        difficulty_lookup = {}
+        subjects = set()
+        grades = set()
+
+        for position, question in enumerate(questions):
+            key = (normalize_key(question.subject), normalize_key(question.grade))
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = array('I')
+            bucket.append(position)
+            self.positions_by_id[question.id] = position
+            difficulty = normalize_key(question.difficulty)
+            if difficulty not in difficulty_lookup:
+                difficulty_lookup[difficulty] = len(self.difficulty_names)
+                self.difficulty_names.append(difficulty)
+            self.difficulty_codes.append(difficulty_lookup[difficulty])
+            subjects.add(question.subject)
+            grades.add(question.grade)
+
+        self.subjects = sorted(subjects)
+        self.grades = sorted(grades)
+
+    def _restore(self, state):
+        """Load buckets saved by export_state without touching the questions"""
+        self.buckets = {(subject_key, grade_key): array('I', positions)
+                        for subject_key, grade_key, positions in state['buckets']}
+        self.positions_by_id = {question_id: position
+                                for position, question_id in enumerate(state['ids'])}
+        self.difficulty_names = state['difficulty_names']
+        self.difficulty_codes = array('B', state['difficulty_codes'])
+        self.subjects = state['subjects']
+        self.grades = state['grades']
+
+    def export_state(self):
+        """JSON-serializable form of the index for the bank cache"""
+        ids = [None] * len(self.questions)
+        for question_id, position in self.positions_by_id.items():
+            ids[position] = question_id
+        return {
+            'buckets': [[subject_key, grade_key, bucket.tolist()]
+                        for (subject_key, grade_key), bucket in self.buckets.items()],
+            'ids': ids,
+            'difficulty_names': self.difficulty_names,
+            'difficulty_codes': self.difficulty_codes.tolist(),
+            'subjects': self.subjects,
+            'grades': self.grades,
+        }
+
+    def set_difficulties(self, overrides):
+        """Apply empirical difficulties, a {question_id: difficulty} mapping"""
+        self.difficulty_overrides = {question_id: normalize_key(difficulty)
+                                     for question_id, difficulty in overrides.items()
+                                     if question_id in self.positions_by_id}
+        self._build_difficulty_buckets()
+        self._resolved = {key: value for key, value in self._resolved.items() if key[2] is None}
+
+    def set_duplicate_groups(self, groups):
+        """Apply near-duplicate groups, lists of question ids"""
+        duplicate_groups = {}
+        for group in groups:
+            group = tuple(group)
+            for question_id in group:
+                duplicate_groups[question_id] = group
+        self.duplicate_groups = duplicate_groups
+
+    def difficulty_of(self, question_id):
+        """Effective difficulty of a question"""
+        if question_id in self.difficulty_overrides:
+            return self.difficulty_overrides[question_id]
+        position = self.positions_by_id.get(question_id)
+        return None if position is None else self.difficulty_names[self.difficulty_codes[position]]
+
+    def _build_difficulty_buckets(self):
+        """Split each subject/grade bucket by effective difficulty"""
+        overrides = {self.positions_by_id[question_id]: difficulty
+                     for question_id, difficulty in self.difficulty_overrides.items()}
+        self.difficulty_buckets = {}
+        for (subject_key, grade_key), bucket in self.buckets.items():
+            for position in bucket:
+                difficulty = overrides.get(position)
+                if difficulty is None:
+                    difficulty = self.difficulty_names[self.difficulty_codes[position]]
+                key = (subject_key, grade_key, difficulty)
+                split = self.difficulty_buckets.get(key)
+                if split is None:
+                    split = self.difficulty_buckets[key] = array('I')
+                split.append(position)
+
+    def _match_subjects(self, subject_key):
+        """Subject keys matching a filter, exact match first then partial"""
+        if subject_key is None:
+            return list(self.grades_by_subject)
+        if subject_key in self.grades_by_subject:
+            return [subject_key]
+        return [key for key in self.grades_by_subject if subject_key in key]
+
+    def matching_pairs(self, subject_key, grade_key):
+        """(subject, grade) bucket keys matching normalized filter keys"""
+        pairs = [(subject, grade)
+                 for subject in self._match_subjects(subject_key)
+                 for grade in self.grades_by_subject[subject]]
+        if grade_key is not None:
+            exact = [pair for pair in pairs if pair[1] == grade_key]
+            pairs = exact or [pair for pair in pairs if grade_key in pair[1]]
+        return pairs
+
+    def _resolve(self, subject_key, grade_key, difficulty_key=None, memo=None):
+        """Resolve a filter into its buckets and their cumulative sizes"""
+        if memo is None:
+            memo = self._resolved
+        resolved = memo.get((subject_key, grade_key, difficulty_key))
+        if resolved is not None:
+            return resolved
+
+        pairs = self.matching_pairs(subject_key, grade_key)
+        if difficulty_key is None:
+            buckets = [self.buckets[pair] for pair in pairs]
+        else:
+            buckets = [self.difficulty_buckets[pair + (difficulty_key,)] for pair in pairs
+                       if pair + (difficulty_key,) in self.difficulty_buckets]
+        offsets = []
+        total = 0
+        for bucket in buckets:
+            total += len(bucket)
+            offsets.append(total)
+
+        resolved = (buckets, offsets)
+        if len(memo) < self.MAX_RESOLVED:
+            memo[(subject_key, grade_key, difficulty_key)] = resolved
+        return resolved
+
+    def copy(self):
+        """Copy to update() while readers keep using this index
+
+        Buckets are shared; update() replaces the ones it touches.
+        """
+        index = copy.copy(self)
+        index.positions_by_id = dict(self.positions_by_id)
+        index.difficulty_overrides = dict(self.difficulty_overrides)
+        index.difficulty_names = list(self.difficulty_names)
+        index.difficulty_codes = array('B', self.difficulty_codes)
+        index._resolved = dict(self._resolved)
+        return index
+
+    def update(self, added=(), removed_ids=()):
+        """Index questions appended to the bank and drop removed ones
+
+        `added` holds (position, question) pairs in position order; an added
+        question replaces any indexed question with the same id. Touched
+        buckets are copied rather than modified, so lookups running
+        concurrently keep a consistent view.
+        """
+        # Only the last version of a question added more than once counts
+        latest = {question.id: position for position, question in added}
+        added = [(position, question) for position, question in added if latest[question.id] == position]
+        buckets = dict(self.buckets)
+        difficulty_buckets = dict(self.difficulty_buckets)
+
+        # Positions leaving each bucket: removed questions and replaced versions
+        leaving = {}
+        replaced = [question.id for _, question in added if question.id in self.positions_by_id]
+        for question_id in list(removed_ids) + replaced:
+            position = self.positions_by_id.get(question_id)
+            if position is None:
+                continue
+            old = self.questions[position]
+            key = (normalize_key(old.subject), normalize_key(old.grade))
+            leaving.setdefault(key, set()).add(position)
+            leaving.setdefault(key + (self.difficulty_of(question_id),), set()).add(position)
+        for key, positions in leaving.items():
+            table = buckets if len(key) == 2 else difficulty_buckets
+            table[key] = array('I', [position for position in table[key] if position not in positions])
+
+        for question_id in removed_ids:
+            self.positions_by_id.pop(question_id, None)
+            self.difficulty_overrides.pop(question_id, None)
+
+        copied = set(leaving)
+        difficulty_lookup = {name: code for code, name in enumerate(self.difficulty_names)}
+        for position, question in added:
+            key = (normalize_key(question.subject), normalize_key(question.grade))
+            difficulty = normalize_key(question.difficulty)
+            if difficulty not in difficulty_lookup:
+                difficulty_lookup[difficulty] = len(self.difficulty_names)
+                self.difficulty_names.append(difficulty)
+            # Codes are indexed by position; superseded positions are padded
+            while len(self.difficulty_codes) < position:
+                self.difficulty_codes.append(0)
+            self.difficulty_codes.append(difficulty_lookup[difficulty])
+
+            # Changed content invalidates any empirical difficulty
+            self.difficulty_overrides.pop(question.id, None)
+            for table, table_key in ((buckets, key), (difficulty_buckets, key + (difficulty,))):
+                if table_key not in copied:
+                    table[table_key] = array('I', table.get(table_key, ()))
+                    copied.add(table_key)
+                table[table_key].append(position)
+            self.positions_by_id[question.id] = position
+
+        self.buckets = {key: bucket for key, bucket in buckets.items() if bucket}
+        self.difficulty_buckets = {key: bucket for key, bucket in difficulty_buckets.items() if bucket}
+
+        subject_keys = {subject_key for subject_key, _ in self.buckets}
+        grade_keys = {grade_key for _, grade_key in self.buckets}
+        subjects = set(self.subjects).union(question.subject for _, question in added)
+        grades = set(self.grades).union(question.grade for _, question in added)
+        self.subjects = sorted(subject for subject in subjects if normalize_key(subject) in subject_keys)
+        self.grades = sorted(grade for grade in grades if normalize_key(grade) in grade_keys)
+        self._prime_resolved()
+
+    def __len__(self):
+        return len(self.positions_by_id)
+
+    def count(self, subject=None, grade=None, difficulty=None):
+        """Number of questions matching a filter"""
+        _, offsets = self._resolve(*self.filter_keys(subject, grade, difficulty))
+        return offsets[-1] if offsets else 0
+
+    def sample(self, subject=None, grade=None, limit=10, difficulty=None):
+        """Pick up to `limit` random questions matching a filter"""
+        buckets, offsets = self._resolve(*self.filter_keys(subject, grade, difficulty))
+        total = offsets[-1] if offsets else 0
+        limit = max(0, min(limit, total))
+        if not limit:
+            return []
+        duplicate_groups = self.duplicate_groups
+        # Spare draws replace questions skipped as duplicates of earlier picks
+        slots = random_slots(total, min(total, limit * 2) if duplicate_groups else limit)
+        picked = []
+        blocked = set()
+        for slot in slots:
+            bucket_num = bisect_right(offsets, slot)
+            start = offsets[bucket_num - 1] if bucket_num else 0
+            question = self.questions[buckets[bucket_num][slot - start]]
+            if question.id in blocked:
+                continue
+            blocked.update(duplicate_groups.get(question.id, ()))
+            picked.append(question)
+            if len(picked) == limit:
+                break
+        return picked
+
+    def get(self, question_id):
+        """Look up a question by its id"""
+        position = self.positions_by_id.get(question_id)
+        return None if position is None else self.questions[position]
+
+    @staticmethod
+    def filter_keys(subject, grade, difficulty=None):
+        """Normalized filter keys, None where the filter is 'all' or empty"""
+        subject_key = normalize_key(subject) if subject and subject != 'all' else None
+        grade_key = normalize_key(grade) if grade and grade != 'all' else None
+        difficulty_key = normalize_key(difficulty) if difficulty and difficulty != 'all' else None
+        return subject_key, grade_key, difficulty_key
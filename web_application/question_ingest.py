@@ -0,0 +1,488 @@
+# question_ingest.py - Streaming, incremental ingestion of CSV/JSONL question banks
+#
+# Source files are read and validated row by row, formatted like the main
+# bank and deduplicated by a hash of their content. Accepted changes are
+# appended to an overlay log next to the bank, appended to the live
+# LiveBank and applied to a copy of the QuestionIndex, so ingesting a file
+# costs time proportional to that file and quizzes reading the old index
+# are unaffected. Other workers and later restarts replay the overlay log
+# rather than rebuilding questions.json.
+#
+# A manifest records each source file's size, mtime, SHA-256 and the ids of
+# the questions it produced: unchanged files are skipped, and rows deleted
+# from a file are removed from the bank when the file is ingested again.
+
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; ingestion is then only serialized within a process
+    fcntl = None
+
+from math_format import format_question_bank
+from question_model import Question
+
+# Values spreadsheets export in place of a cell they failed to compute
+SPREADSHEET_ERRORS = frozenset(['#ERROR!', '#REF!', '#VALUE!', '#N/A', '#NAME?', '#DIV/0!', '#NUM!', '#NULL!'])
+
+OPTION_KEYS = 'ABCDEF'
+
+# Accepted CSV headers, compared lower-cased with spaces turned into underscores
+QUESTION_COLUMNS = ('question', 'question_text', 'text')
+ANSWER_COLUMNS = ('correct_answer', 'answer', 'correct')
+OPTION_COLUMNS = ('{key}', 'option_{key}', 'opt_{key}')
+
+# Grade and subject from file names such as 10th-Math-II.csv
+SOURCE_NAME_RE = re.compile(r'^(\d+(?:st|nd|rd|th))-(.+)$', re.IGNORECASE)
+
+# Seconds between checks of the overlay log for changes made by other workers
+SYNC_INTERVAL = 1.0
+
+
+class RowError(ValueError):
+    """A source row that cannot become a question"""
+
+
+def source_defaults(source_name):
+    """Grade and subject implied by a source file name"""
+    match = SOURCE_NAME_RE.match(os.path.splitext(source_name)[0])
+    if match is None:
+        return {}
+    return {'grade': match.group(1), 'subject': match.group(2)}
+
+
+def read_csv_rows(stream):
+    """Yield (line number, record) for each CSV row"""
+    reader = csv.DictReader(stream)
+    if reader.fieldnames:
+        reader.fieldnames = [name.strip().lower().replace(' ', '_') for name in reader.fieldnames]
+    for row in reader:
+        yield reader.line_num, row
+
+
+def csv_record(row):
+    """Bank-shaped dict from a CSV row"""
+    def first(columns):
+        for column in columns:
+            value = row.get(column)
+            if value is not None and value.strip():
+                return value.strip()
+        return None
+
+    options = {}
+    for key in OPTION_KEYS:
+        value = first([column.format(key=key.lower()) for column in OPTION_COLUMNS])
+        if value is not None:
+            options[key] = value
+    return {
+        'id': first(['id']),
+        'question': first(QUESTION_COLUMNS),
+        'options': options,
+        'correct_answer': first(ANSWER_COLUMNS),
+        'subject': first(['subject']),
+        'grade': first(['grade']),
+        'difficulty': first(['difficulty']),
+    }
+
+
+def read_jsonl_rows(stream):
+    """Yield (line number, line) for each non-blank JSONL line"""
+    for line_number, line in enumerate(stream, 1):
+        if line.strip():
+            yield line_number, line
+
+
+def jsonl_record(line):
+    """Bank-shaped dict from a JSONL line"""
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        raise RowError(f"invalid JSON: {e}")
+    if not isinstance(record, dict) or not isinstance(record.get('options', {}), dict):
+        raise RowError("expected an object with an options object")
+    return record
+
+
+READERS = {
+    '.csv': (read_csv_rows, csv_record),
+    '.jsonl': (read_jsonl_rows, jsonl_record),
+}
+
+
+def validate_record(record, source_name, defaults):
+    """Return (question dict, warnings) for a record, or raise RowError"""
+    warnings = []
+    text = str(record.get('question') or '').strip()
+    if not text:
+        raise RowError("missing question text")
+    if text in SPREADSHEET_ERRORS:
+        raise RowError(f"question text is a spreadsheet error ({text})")
+
+    options = {str(key).strip().upper(): str(value).strip()
+               for key, value in (record.get('options') or {}).items() if value is not None}
+    answer = _answer_key(record.get('correct_answer'), options)
+    if options[answer] in SPREADSHEET_ERRORS or not options[answer]:
+        raise RowError(f"correct option {answer} is empty or a spreadsheet error")
+
+    # Broken distractors are dropped rather than shown as answer choices
+    for key in list(options):
+        if options[key] in SPREADSHEET_ERRORS:
+            warnings.append(f"dropped option {key} ({options[key]})")
+            del options[key]
+        elif not options[key]:
+            del options[key]
+    if len(options) < 2:
+        raise RowError("fewer than two usable options")
+
+    subject = record.get('subject') or defaults.get('subject')
+    grade = record.get('grade') or defaults.get('grade')
+    if not subject or not grade:
+        raise RowError("missing subject or grade")
+
+    question_id = record.get('id')
+    if question_id not in (None, ''):
+        try:
+            question_id = int(question_id)
+        except (TypeError, ValueError):
+            raise RowError(f"invalid id {question_id!r}")
+    else:
+        question_id = None
+
+    question = {
+        'id': question_id,
+        'question': text,
+        'options': options,
+        'correct_answer': answer.lower(),
+        'subject': str(subject).strip(),
+        'grade': str(grade).strip(),
+        'difficulty': str(record.get('difficulty') or 'medium').strip().lower(),
+        'source_file': source_name,
+    }
+    format_question_bank([question])
+    return question, warnings
+
+
+def _answer_key(answer, options):
+    """Option key named by an answer given as a key, a 1-based number or the option text"""
+    answer = str(answer or '').strip()
+    if not answer:
+        raise RowError("missing correct answer")
+    if answer.upper() in options:
+        return answer.upper()
+    if answer.isdigit() and 1 <= int(answer) <= len(options):
+        return list(options)[int(answer) - 1]
+    for key, text in options.items():
+        if text == answer:
+            return key
+    raise RowError(f"correct answer {answer!r} is not one of the options")
+
+
+def content_hash(text, options, correct_answer):
+    """Hash of a question's normalized text, options and answer"""
+    def normalize(value):
+        return ' '.join(str(value).split()).casefold()
+
+    content = [normalize(text), [[key, normalize(value)] for key, value in sorted(options.items())],
+               normalize(correct_answer)]
+    return hashlib.sha256(json.dumps(content, ensure_ascii=False).encode('utf-8')).hexdigest()[:32]
+
+
+def question_hash(question):
+    return content_hash(question.text, question.options, question.correct_answer)
+
+
+class QuestionIngestor:
+    """Applies source files and the shared overlay log to a live bank and index"""
+
+    def __init__(self, bank, index, overlay_path, manifest_path, on_change=None):
+        self.bank = bank
+        self.index = index
+        self.overlay_path = overlay_path
+        self.manifest_path = manifest_path
+        self.on_change = on_change
+        self._lock = threading.Lock()
+        self._overlay_offset = 0
+        self._last_sync = 0.0
+        self._hashes = None
+        self._max_id = max(index.positions_by_id, default=0)
+
+    @contextmanager
+    def _locked(self):
+        """Serialize ingestion across threads and, where supported, processes"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(os.path.dirname(self.overlay_path) or '.', exist_ok=True)
+            with open(self.overlay_path + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _content_hashes(self):
+        """Content hash -> question id, built on first use"""
+        if self._hashes is None:
+            questions = self.bank
+            self._hashes = {question_hash(questions[position]): question_id
+                            for question_id, position in self.index.positions_by_id.items()}
+        return self._hashes
+
+    @property
+    def overlay_offset(self):
+        """Bytes of the overlay log applied so far"""
+        return self._overlay_offset
+
+    def sync(self, until=None):
+        """Apply overlay records appended since the last sync, up to byte `until`; returns the records applied"""
+        with self._lock:
+            return self._sync(until)
+
+    def maybe_sync(self):
+        """Sync at most every SYNC_INTERVAL seconds, never waiting on a running ingest"""
+        now = time.monotonic()
+        if now - self._last_sync < SYNC_INTERVAL or not self._lock.acquire(blocking=False):
+            return 0
+        try:
+            self._last_sync = now
+            return self._sync()
+        finally:
+            self._lock.release()
+
+    def replace_index(self, rebuild):
+        """Replace the index with rebuild(index), a changed copy, between ingests; returns it"""
+        with self._lock:
+            self.index = rebuild(self.index)
+            return self.index
+
+    def _sync(self, until=None):
+        try:
+            size = os.path.getsize(self.overlay_path)
+        except OSError:
+            return 0
+        if size == self._overlay_offset:
+            return 0
+        if size < self._overlay_offset:
+            # Log was replaced; replaying it again is safe as records are upserts
+            self._overlay_offset = 0
+        if until is not None:
+            size = min(size, until)
+            if size <= self._overlay_offset:
+                return 0
+
+        with open(self.overlay_path, 'rb') as f:
+            f.seek(self._overlay_offset)
+            data = f.read(size - self._overlay_offset)
+        # A writer may be mid-append; leave the partial last line for later
+        data = data[:data.rfind(b'\n') + 1]
+        self._overlay_offset += len(data)
+
+        changes = {}
+        for line in data.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record['op'] == 'upsert':
+                changes[record['question']['id']] = record['question']
+            else:
+                changes[record['id']] = None
+        self._apply(changes)
+        return len(changes)
+
+    def _apply(self, changes):
+        """Apply {question_id: question dict or None for removal} to the bank and a new index"""
+        if not changes:
+            return
+        hashes = self._hashes
+        added = []
+        removed = []
+        for question_id, data in changes.items():
+            old = self.index.get(question_id)
+            if hashes is not None and old is not None:
+                old_hash = question_hash(old)
+                if hashes.get(old_hash) == question_id:
+                    del hashes[old_hash]
+            if data is None:
+                removed.append(question_id)
+                continue
+            question = Question.from_dict(data, self.bank.categories)
+            added.append((self.bank.append(question), question))
+            if hashes is not None:
+                hashes[question_hash(question)] = question_id
+            self._max_id = max(self._max_id, question_id)
+
+        index = self.index.copy()
+        index.update(added, removed)
+        self.index = index
+        if self.on_change is not None:
+            self.on_change(list(changes))
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write_manifest(self, manifest):
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    def ingest_file(self, path, force=False):
+        """Ingest a CSV or JSONL file unless the manifest shows it unchanged"""
+        source_name = os.path.basename(path)
+        stat = os.stat(path)
+        entry = self._read_manifest().get(source_name)
+        if (not force and entry and entry['size'] == stat.st_size
+                and entry['mtime_ns'] == stat.st_mtime_ns):
+            return {'source_file': source_name, 'status': 'unchanged'}
+
+        with open(path, 'rb') as f:
+            return self.ingest_stream(source_name, f, stat.st_mtime_ns, force)
+
+    def ingest_stream(self, source_name, binary_stream, mtime_ns=None, force=False):
+        """Ingest a seekable binary stream of a CSV or JSONL bank named source_name"""
+        extension = os.path.splitext(source_name)[1].lower()
+        if extension not in READERS:
+            raise ValueError(f"Unsupported source type {extension or source_name!r}; expected .csv or .jsonl")
+        read_rows, to_record = READERS[extension]
+
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in iter(lambda: binary_stream.read(1 << 20), b''):
+            digest.update(chunk)
+            size += len(chunk)
+        binary_stream.seek(0)
+        sha256 = digest.hexdigest()
+
+        with self._locked():
+            # Pick up what other workers ingested before allocating ids
+            self._sync()
+            manifest = self._read_manifest()
+            entry = manifest.get(source_name)
+            if not force and entry and entry['sha256'] == sha256:
+                entry.update(size=size, mtime_ns=mtime_ns)
+                self._write_manifest(manifest)
+                return {'source_file': source_name, 'status': 'unchanged'}
+
+            stream = io.TextIOWrapper(binary_stream, encoding='utf-8-sig', newline='')
+            try:
+                report, changes, ids = self._diff_rows(source_name, read_rows(stream), to_record,
+                                                       set(entry['ids']) if entry else set())
+            finally:
+                # Leave closing the binary stream to the caller
+                stream.detach()
+
+            records = [{'op': 'upsert', 'question': data} if data is not None else {'op': 'delete', 'id': question_id}
+                       for question_id, data in changes.items()]
+            if records:
+                with open(self.overlay_path, 'ab') as f:
+                    f.write(b''.join(json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+                                     + b'\n' for record in records))
+                self._overlay_offset = os.path.getsize(self.overlay_path)
+            self._apply(changes)
+
+            manifest[source_name] = {'size': size, 'mtime_ns': mtime_ns, 'sha256': sha256, 'ids': ids}
+            self._write_manifest(manifest)
+        return report
+
+    def _diff_rows(self, source_name, rows, to_record, previous_ids):
+        """Compare source rows with the bank; returns (report, changes, ids from this source)"""
+        defaults = source_defaults(source_name)
+        hashes = self._content_hashes()
+        report = {'source_file': source_name, 'status': 'ingested', 'rows': 0, 'inserted': 0,
+                  'updated': 0, 'unchanged': 0, 'duplicates': 0, 'removed': 0,
+                  'rejected': [], 'warnings': []}
+        changes = {}
+        seen = set()
+        pending = {}
+
+        for row_number, row in rows:
+            report['rows'] += 1
+            try:
+                question, warnings = validate_record(to_record(row), source_name, defaults)
+            except RowError as e:
+                report['rejected'].append({'row': row_number, 'reason': str(e)})
+                continue
+            report['warnings'].extend({'row': row_number, 'message': message} for message in warnings)
+
+            digest = content_hash(question['question'], question['options'], question['correct_answer'])
+            existing = pending.get(digest, hashes.get(digest))
+            question_id = question['id']
+            if existing is not None:
+                if question_id is not None:
+                    same_question = existing == question_id
+                else:
+                    same_question = self._belongs(existing, source_name, previous_ids)
+                if existing in seen or not same_question:
+                    report['duplicates'] += 1
+                    report['warnings'].append({'row': row_number, 'message': f"duplicate of question {existing}"})
+                else:
+                    report['unchanged'] += 1
+                    seen.add(existing)
+                continue
+
+            if question_id is None:
+                self._max_id += 1
+                question_id = question['id'] = self._max_id
+            elif question_id in seen:
+                report['duplicates'] += 1
+                report['warnings'].append({'row': row_number, 'message': f"id {question_id} repeated"})
+                continue
+            report['updated' if self.index.get(question_id) is not None else 'inserted'] += 1
+            changes[question_id] = question
+            pending[digest] = question_id
+            seen.add(question_id)
+
+        for question_id in previous_ids - seen:
+            if self.index.get(question_id) is not None:
+                changes[question_id] = None
+                report['removed'] += 1
+        return report, changes, sorted(seen)
+
+    def _belongs(self, question_id, source_name, previous_ids):
+        """Whether an existing question came from this source"""
+        if question_id in previous_ids:
+            return True
+        question = self.index.get(question_id)
+        return question is not None and question.source_file == source_name
+
+
+if __name__ == '__main__':
+    # Ingest source files into the overlay log: python question_ingest.py [--force] FILE...
+    from bank_cache import load_question_bank
+    from data_paths import data_path
+
+    args = sys.argv[1:]
+    force = '--force' in args
+    paths = [arg for arg in args if arg != '--force']
+    if not paths:
+        sys.exit("usage: python question_ingest.py [--force] FILE.csv|FILE.jsonl ...")
+
+    bank, index = load_question_bank(data_path('questions.json'))
+    ingestor = QuestionIngestor(bank, index, data_path('questions_overlay.jsonl'), data_path('ingest_manifest.json'))
+    ingestor.sync()
+    for path in paths:
+        report = ingestor.ingest_file(path, force)
+        if report['status'] == 'unchanged':
+            print(f"{report['source_file']}: unchanged")
+            continue
+        print(f"{report['source_file']}: {report['rows']} rows, {report['inserted']} inserted, "
+              f"{report['updated']} updated, {report['unchanged']} unchanged, "
+              f"{report['duplicates']} duplicates, {report['removed']} removed, "
+              f"{len(report['rejected'])} rejected")
+        for rejected in report['rejected']:
+            print(f"  row {rejected['row']}: {rejected['reason']}")
@@ -0,0 +1,135 @@
+# question_model.py - Compact in-memory representation of bank questions
+
+# Fields stored as small-integer codes into per-bank lookup tables
+CATEGORY_FIELDS = ('subject', 'grade', 'difficulty', 'source_file', 'option_keys')
+
+
+class Categories:
+    """Lookup tables interning repeated categorical values as small integers"""
+
+    def __init__(self, tables=None):
+        tables = tables or {}
+        self.values = {field: [self._restore(field, value) for value in tables.get(field, [])]
+                       for field in CATEGORY_FIELDS}
+        self.codes = {field: {value: code for code, value in enumerate(values)}
+                      for field, values in self.values.items()}
+
+    @staticmethod
+    def _restore(field, value):
+        # JSON round-trips the option key tuples as lists
+        return tuple(value) if field == 'option_keys' else value
+
+    def code(self, field, value):
+        """Code for a value, adding it to the table on first use"""
+        codes = self.codes[field]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self.values[field])
+            self.values[field].append(value)
+        return code
+
+    def value(self, field, code):
+        return self.values[field][code]
+
+    def export_state(self):
+        """JSON-serializable lookup tables"""
+        return {field: list(values) for field, values in self.values.items()}
+
+
+class Question:
+    """A bank question with categorical fields stored as codes
+
+    Serialization to the JSON shape served to clients happens only when
+    to_dict is called.
+    """
+
+    __slots__ = ('id', 'text', 'option_texts', 'correct_answer', 'categories',
+                 'subject_code', 'grade_code', 'difficulty_code', 'source_code', 'option_keys_code')
+
+    def __init__(self, id, text, option_texts, correct_answer, categories,
+                 subject_code, grade_code, difficulty_code, source_code, option_keys_code):
+        self.id = id
+        self.text = text
+        self.option_texts = option_texts
+        self.correct_answer = correct_answer
+        self.categories = categories
+        self.subject_code = subject_code
+        self.grade_code = grade_code
+        self.difficulty_code = difficulty_code
+        self.source_code = source_code
+        self.option_keys_code = option_keys_code
+
+    @classmethod
+    def from_dict(cls, data, categories):
+        """Build a Question from the bank's JSON shape"""
+        options = data.get('options', {})
+        return cls(
+            data.get('id'),
+            data.get('question', ''),
+            tuple(options.values()),
+            data.get('correct_answer', ''),
+            categories,
+            categories.code('subject', data.get('subject', 'Unknown')),
+            categories.code('grade', data.get('grade', 'Unknown')),
+            categories.code('difficulty', data.get('difficulty', 'medium')),
+            categories.code('source_file', data.get('source_file', '')),
+            categories.code('option_keys', tuple(options)),
+        )
+
+    @classmethod
+    def from_record(cls, record, categories):
+        """Build a Question from a packed record produced by to_record"""
+        return cls(record[0], record[1], tuple(record[2]), record[3], categories, *record[4:])
+
+    def to_record(self):
+        """Compact list form used by the packed bank"""
+        return [self.id, self.text, list(self.option_texts), self.correct_answer,
+                self.subject_code, self.grade_code, self.difficulty_code,
+                self.source_code, self.option_keys_code]
+
+    @property
+    def subject(self):
+        return self.categories.value('subject', self.subject_code)
+
+    @property
+    def grade(self):
+        return self.categories.value('grade', self.grade_code)
+
+    @property
+    def difficulty(self):
+        return self.categories.value('difficulty', self.difficulty_code)
+
+    @property
+    def source_file(self):
+        return self.categories.value('source_file', self.source_code)
+
+    @property
+    def option_keys(self):
+        return self.categories.value('option_keys', self.option_keys_code)
+
+    @property
+    def options(self):
+        return dict(zip(self.option_keys, self.option_texts))
+
+    def option_text(self, key):
+        """Text of the option with the given key (e.g. 'A'), or None"""
+        try:
+            return self.option_texts[self.option_keys.index(key)]
+        except ValueError:
+            return None
+
+    def to_dict(self, include_answer=True):
+        """The question in the bank's JSON shape"""
+        data = {
+            'id': self.id,
+            'question': self.text,
+            'options': self.options,
+            'correct_answer': self.correct_answer,
+            'subject': self.subject,
+            'grade': self.grade,
+            'difficulty': self.difficulty,
+            'source_file': self.source_file,
+        }
+        if not include_answer:
+            del data['correct_answer']
+        return data
@@ -0,0 +1,198 @@
+# question_search.py - Ranked full-text search over the question bank (SQLite FTS5)
+#
+# Question and option text are normalized before indexing and querying:
+# LaTeX commands become words (\frac -> frac, \sqrt -> sqrt), common math
+# symbols and Bengali digits are spelled the same way as their ASCII forms,
+# and text is NFC-normalized. FTS5's unicode61 tokenizer treats Bengali
+# vowel signs and the virama as separators, which would split every word
+# into fragments, so those marks are declared token characters.
+#
+# The index lives in its own database next to quiz_results.db. Each row
+# carries a content hash, so syncing with a new bank version only rewrites
+# questions that changed.
+
+import logging
+import re
+import sqlite3
+import sys
+import unicodedata
+
+from database import Database
+from question_ingest import question_hash
+
+logger = logging.getLogger(__name__)
+
+# Bengali combining marks plus ZWNJ/ZWJ, kept inside tokens
+BENGALI_MARKS = ''.join(chr(code) for code in range(0x0980, 0x0A00)
+                        if unicodedata.category(chr(code)) in ('Mn', 'Mc')) + '\u200c\u200d'
+
+CREATE_FTS_SQL = f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS question_fts USING fts5(
+        question, options,
+        tokenize="unicode61 remove_diacritics 2 tokenchars '{BENGALI_MARKS}'"
+    )
+'''
+
+# Very common English words, dropped from queries that have other terms
+STOPWORDS = frozenset('a an and are as at be by for from in is it of on or the this to was what which with'.split())
+
+# Relative bm25 weight of the question and option columns
+QUESTION_WEIGHT = 2.0
+OPTION_WEIGHT = 1.0
+
+LATEX_COMMAND_RE = re.compile(r'\\([A-Za-z]+)')
+SYMBOLS = str.maketrans({
+    '^': ' pow ', '_': ' ', '$': ' ', '{': ' ', '}': ' ', '\\': ' ',
+    '√': ' sqrt ', '×': ' times ', '÷': ' div ', 'π': ' pi ', '≤': ' leq ', '≥': ' geq ',
+    '≠': ' neq ', '∞': ' infty ', '°': ' degree ', '±': ' pm ',
+    '০': '0', '১': '1', '২': '2', '৩': '3', '৪': '4', '৫': '5', '৬': '6', '৭': '7', '৮': '8', '৯': '9',
+})
+
+
+def normalize_search_text(text):
+    """Text with LaTeX and math symbols spelled as plain words"""
+    text = unicodedata.normalize('NFC', text or '')
+    text = LATEX_COMMAND_RE.sub(r' \1 ', text)
+    return text.translate(SYMBOLS)
+
+
+def match_expression(query):
+    """FTS5 MATCH expression requiring every query term, the last one as a prefix"""
+    terms = [term.replace('"', ' ').strip() for term in normalize_search_text(query).split()]
+    terms = [term for term in terms if term]
+    # Matching nearly every question, these only slow ranking down
+    terms = [term for term in terms if term.lower() not in STOPWORDS] or terms
+    if not terms:
+        return None
+    terms = [f'"{term}"' for term in terms]
+    terms[-1] += '*'
+    return ' AND '.join(terms)
+
+
+class QuestionSearch:
+    """FTS5 search index kept in step with the loaded question bank"""
+
+    def __init__(self, db_file):
+        self.db = Database(db_file)
+        self.available = True
+        try:
+            with self.db.transaction() as conn:
+                conn.execute(CREATE_FTS_SQL)
+                # Content hashes for syncing, and the subject/grade facets
+                # (kept out of the FTS table so counting them stays cheap)
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS question_search_state (
+                        question_id INTEGER PRIMARY KEY,
+                        content_hash TEXT NOT NULL,
+                        subject TEXT,
+                        grade TEXT
+                    )
+                ''')
+                conn.execute('CREATE TABLE IF NOT EXISTS search_meta (name TEXT PRIMARY KEY, value TEXT)')
+        except sqlite3.OperationalError as e:
+            # SQLite built without FTS5
+            logger.warning('question search unavailable: %s', e)
+            self.available = False
+
+    def sync(self, index, version):
+        """Bring the index in line with a QuestionIndex unless `version` is already indexed
+
+        Returns the number of rows written. Questions ingested later are
+        added with update().
+        """
+        if not self.available:
+            return 0
+        with self.db.transaction(immediate=True) as conn:
+            row = conn.execute("SELECT value FROM search_meta WHERE name = 'version'").fetchone()
+            if row and row[0] == version:
+                return 0
+            hashes = dict(conn.execute('SELECT question_id, content_hash FROM question_search_state'))
+            changed = []
+            for question_id, position in index.positions_by_id.items():
+                question = index.questions[position]
+                digest = question_hash(question)
+                if hashes.pop(question_id, None) != digest:
+                    changed.append((question, digest))
+            self._write(conn, changed, list(hashes))
+            conn.execute("INSERT OR REPLACE INTO search_meta (name, value) VALUES ('version', ?)", (version,))
+        return len(changed) + len(hashes)
+
+    def update(self, index, question_ids):
+        """Re-index questions that were ingested, updated or removed"""
+        if not self.available or not question_ids:
+            return
+        with self.db.transaction(immediate=True) as conn:
+            placeholders = ','.join('?' * len(question_ids))
+            hashes = dict(conn.execute(f'SELECT question_id, content_hash FROM question_search_state '
+                                       f'WHERE question_id IN ({placeholders})', list(question_ids)))
+            changed, removed = [], []
+            for question_id in question_ids:
+                question = index.get(question_id)
+                if question is None:
+                    if question_id in hashes:
+                        removed.append(question_id)
+                    continue
+                digest = question_hash(question)
+                if hashes.get(question_id) != digest:
+                    changed.append((question, digest))
+            self._write(conn, changed, removed)
+
+    @staticmethod
+    def _write(conn, changed, removed_ids):
+        stale = [(question.id,) for question, _ in changed] + [(question_id,) for question_id in removed_ids]
+        conn.executemany('DELETE FROM question_fts WHERE rowid = ?', stale)
+        conn.executemany('DELETE FROM question_search_state WHERE question_id = ?', stale)
+        conn.executemany('INSERT INTO question_fts (rowid, question, options) VALUES (?, ?, ?)', [
+            (question.id, normalize_search_text(question.text), normalize_search_text(' '.join(question.option_texts)))
+            for question, _ in changed
+        ])
+        conn.executemany('INSERT INTO question_search_state (question_id, content_hash, subject, grade) '
+                         'VALUES (?, ?, ?, ?)',
+                         [(question.id, digest, question.subject, question.grade) for question, digest in changed])
+
+    def search(self, query, subject=None, grade=None, limit=20, offset=0):
+        """Ranked (question_id, score) matches, total matching the filters and subject/grade facets"""
+        expression = match_expression(query)
+        if expression is None:
+            raise ValueError("Search query has no searchable terms")
+        subject = subject.lower() if subject and subject != 'all' else None
+        grade = grade.lower() if grade and grade != 'all' else None
+
+        conn = self.db.connection()
+        facets = {'subject': {}, 'grade': {}}
+        total = 0
+        for row_subject, row_grade, count in conn.execute('''
+                SELECT s.subject, s.grade, COUNT(*)
+                FROM question_fts JOIN question_search_state s ON s.question_id = question_fts.rowid
+                WHERE question_fts MATCH ?
+                GROUP BY s.subject, s.grade
+            ''', (expression,)):
+            facets['subject'][row_subject] = facets['subject'].get(row_subject, 0) + count
+            facets['grade'][row_grade] = facets['grade'].get(row_grade, 0) + count
+            if (subject is None or row_subject.lower() == subject) and (grade is None or row_grade.lower() == grade):
+                total += count
+
+        matches = conn.execute(f'''
+            SELECT question_fts.rowid, bm25(question_fts, {QUESTION_WEIGHT}, {OPTION_WEIGHT}) AS score
+            FROM question_fts JOIN question_search_state s ON s.question_id = question_fts.rowid
+            WHERE question_fts MATCH ?
+              AND (? IS NULL OR lower(s.subject) = ?) AND (? IS NULL OR lower(s.grade) = ?)
+            ORDER BY score LIMIT ? OFFSET ?
+        ''', (expression, subject, subject, grade, grade, limit, offset)).fetchall()
+        return matches, total, facets
+
+
+if __name__ == '__main__':
+    # Build or refresh the search index: python question_search.py [query]
+    from bank_cache import load_question_bank
+    from bank_snapshot import bank_version
+    from data_paths import data_path
+
+    questions, index = load_question_bank(data_path('questions.json'))
+    search = QuestionSearch(data_path('question_search.db'))
+    print(f"Indexed {search.sync(index, bank_version(questions))} changed questions")
+    if len(sys.argv) > 1:
+        matches, total, _ = search.search(' '.join(sys.argv[1:]))
+        print(f"{total} matches")
+        for question_id, score in matches:
+            print(f"  {question_id} ({score:.2f}): {index.get(question_id).text[:80]}")
@@ -0,0 +1,207 @@
+# result_export.py - Streaming CSV/Parquet export of quiz sessions and their answers
+#
+# One row per answered question, with its session's columns alongside, for
+# sessions created in a date range and optionally one subject and grade.
+# Rows come from a single SELECT on a connection of the export's own,
+# fetched EXPORT_BATCH_ROWS at a time and turned into CSV text or one
+# Parquet row group per batch as the consumer asks for them, so memory
+# stays flat however many rows match. In WAL mode the SELECT reads one
+# consistent snapshot and never blocks finish_quiz's writes; the WAL file
+# only grows until the export finishes and it can be checkpointed.
+#
+# python result_export.py --format parquet --from 2025-01-01 --to 2025-01-31 \
+#     [--subject Math-II] [--grade 10th] --output results.parquet
+
+import argparse
+import csv
+import io
+import sqlite3
+import sys
+from datetime import date, timedelta
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Rows fetched per batch: one CSV chunk or Parquet row group
+EXPORT_BATCH_ROWS = 5000
+
+EXPORT_COLUMNS = (
+    'session_id', 'user_name', 'subject', 'grade', 'total_questions', 'correct_answers',
+    'score_percentage', 'time_taken', 'created_at',
+    'question_id', 'user_answer', 'correct_answer', 'is_correct', 'time_spent',
+)
+
+# Numbers are cast in SQL so values clients sent as text export as numbers
+EXPORT_SQL = '''
+    SELECT s.id, s.user_name, s.subject, s.grade,
+           CAST(s.total_questions AS INTEGER), CAST(s.correct_answers AS INTEGER),
+           CAST(s.score_percentage AS REAL), CAST(s.time_taken AS INTEGER), s.created_at,
+           CAST(a.question_id AS INTEGER), a.user_answer, a.correct_answer,
+           CAST(a.is_correct AS INTEGER), CAST(a.time_spent AS INTEGER)
+    FROM quiz_sessions s JOIN question_attempts a ON a.session_id = s.id
+    WHERE {where}
+    ORDER BY s.created_at, s.id, a.id
+'''
+
+FORMATS = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def parquet_available():
+    """Whether pyarrow is installed so results can be exported as Parquet"""
+    return pq is not None
+
+
+def export_filters(since=None, until=None, subject=None, grade=None):
+    """SQL condition and parameters for an inclusive YYYY-MM-DD date range, subject and grade"""
+    conditions = []
+    params = []
+    try:
+        if since:
+            conditions.append('s.created_at >= ?')
+            params.append(date.fromisoformat(since).isoformat())
+        if until:
+            # created_at holds 'YYYY-MM-DD HH:MM:SS', so compare against the next day
+            conditions.append('s.created_at < ?')
+            params.append((date.fromisoformat(until) + timedelta(days=1)).isoformat())
+    except ValueError:
+        raise ValueError("Dates must be YYYY-MM-DD")
+    if subject and subject != 'all':
+        conditions.append('s.subject = ?')
+        params.append(subject)
+    if grade and grade != 'all':
+        conditions.append('s.grade = ?')
+        params.append(grade)
+    return ' AND '.join(conditions) or '1', params
+
+
+def iter_batches(db_file, where, params, batch_rows=EXPORT_BATCH_ROWS):
+    """Lists of up to batch_rows export rows, read through one cursor"""
+    # A connection of its own: the generator may outlive the request thread's
+    # transactions, and closing it when the consumer stops ends the read
+    conn = sqlite3.connect(db_file, check_same_thread=False)
+    try:
+        conn.execute('PRAGMA query_only=ON')
+        conn.execute('PRAGMA busy_timeout=5000')
+        cursor = conn.execute(EXPORT_SQL.format(where=where), params)
+        while True:
+            rows = cursor.fetchmany(batch_rows)
+            if not rows:
+                return
+            yield rows
+    finally:
+        conn.close()
+
+
+def csv_chunks(batches):
+    """UTF-8 CSV bytes: the header, then one chunk per batch"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue().encode('utf-8')
+    for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue().encode('utf-8')
+
+
+class ChunkSink:
+    """Write-only file that hands out what was written since the last take()"""
+
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def parquet_schema():
+    return pa.schema([
+        ('session_id', pa.int64()), ('user_name', pa.string()), ('subject', pa.string()),
+        ('grade', pa.string()), ('total_questions', pa.int64()), ('correct_answers', pa.int64()),
+        ('score_percentage', pa.float64()), ('time_taken', pa.int64()), ('created_at', pa.string()),
+        ('question_id', pa.int64()), ('user_answer', pa.string()), ('correct_answer', pa.string()),
+        ('is_correct', pa.bool_()), ('time_spent', pa.int64()),
+    ])
+
+
+def parquet_chunks(batches):
+    """Parquet file bytes, one row group per batch, then the footer"""
+    schema = parquet_schema()
+    is_correct = schema.get_field_index('is_correct')
+    sink = ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    try:
+        for rows in batches:
+            columns = [list(column) for column in zip(*rows)]
+            columns[is_correct] = [None if value is None else bool(value) for value in columns[is_correct]]
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema))
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def export_chunks(db_file, export_format='csv', since=None, until=None, subject=None, grade=None):
+    """Byte chunks of an export; bad filters or formats raise before anything is read"""
+    if export_format not in FORMATS:
+        raise ValueError(f"Unknown export format {export_format!r}; expected csv or parquet")
+    if export_format == 'parquet' and not parquet_available():
+        raise ValueError("Parquet export needs pyarrow; install it or use format=csv")
+    where, params = export_filters(since, until, subject, grade)
+    batches = iter_batches(db_file, where, params)
+    return csv_chunks(batches) if export_format == 'csv' else parquet_chunks(batches)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export quiz sessions and answers as CSV or Parquet')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+    parser.add_argument('--from', dest='since', help='first day, YYYY-MM-DD')
+    parser.add_argument('--to', dest='until', help='last day, YYYY-MM-DD')
+    parser.add_argument('--subject')
+    parser.add_argument('--grade')
+    parser.add_argument('--output', help='file to write (default: CSV to stdout)')
+    args = parser.parse_args()
+
+    from data_paths import data_path
+
+    db_file = data_path('quiz_results.db')
+    try:
+        chunks = export_chunks(db_file, args.format, args.since, args.until, args.subject, args.grade)
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
+    if args.output is None and args.format != 'csv':
+        sys.exit("Error: --output is required for Parquet")
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
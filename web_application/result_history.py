@@ -0,0 +1,229 @@
+# result_history.py - Keyset-paginated quiz history and incrementally maintained leaderboards
+#
+# Pages are addressed by an opaque cursor holding the sort key of the last
+# row served, so every page is one index range scan of `limit` rows no
+# matter how deep it is or how large quiz_sessions grows. A user's history
+# is read from a covering index on (user_name, created_at, id, ...), newest
+# first. Session ids alone do not give that order: each worker allocates
+# ids from its own reserved block, so id only breaks created_at ties.
+#
+# The leaderboard table keeps each user's best session (highest score,
+# then fastest, then earliest) in four scopes per session: its subject and
+# grade, the subject across grades, the grade across subjects and overall,
+# with '' standing for "all". Rows are upserted in the transaction that
+# writes the sessions and each touched scope is trimmed back to
+# LEADERBOARD_SIZE users. Sessions are never deleted, so a scope's cutoff
+# only rises and trimmed users can never be owed a place again.
+
+import base64
+import json
+
+from adaptive_selection import ANONYMOUS_NAMES
+
+# Users kept per leaderboard scope
+LEADERBOARD_SIZE = 100
+
+# Quizzes shorter than this do not count for the leaderboard
+LEADERBOARD_MIN_QUESTIONS = 5
+
+# Later than any (created_at, id) sort key; the cursor of a first history page
+FIRST_PAGE_KEY = ['9999-12-31 23:59:59', (1 << 63) - 1]
+
+HISTORY_SQL = '''
+    SELECT id, subject, grade, total_questions, correct_answers, score_percentage, time_taken, created_at
+    FROM quiz_sessions
+    WHERE user_name = ? AND (created_at, id) < (?, ?)
+    ORDER BY created_at DESC, id DESC
+    LIMIT ?
+'''
+
+HISTORY_SUBJECT_SQL = '''
+    SELECT id, subject, grade, total_questions, correct_answers, score_percentage, time_taken, created_at
+    FROM quiz_sessions
+    WHERE user_name = ? AND (created_at, id) < (?, ?) AND subject = ?
+    ORDER BY created_at DESC, id DESC
+    LIMIT ?
+'''
+
+RANKED_SESSIONS_SQL = '''
+    SELECT id, user_name, subject, grade, score_percentage, COALESCE(time_taken, 0)
+    FROM quiz_sessions
+    WHERE total_questions >= ? AND score_percentage IS NOT NULL
+    ORDER BY score_percentage DESC, COALESCE(time_taken, 0), id
+'''
+
+INSERT_LEADER_SQL = '''
+    INSERT INTO leaderboard (subject, grade, user_name, score_percentage, time_taken, session_id)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+UPSERT_LEADER_SQL = INSERT_LEADER_SQL + '''
+    ON CONFLICT (subject, grade, user_name) DO UPDATE SET
+        score_percentage = excluded.score_percentage,
+        time_taken = excluded.time_taken,
+        session_id = excluded.session_id
+    WHERE excluded.score_percentage > score_percentage
+       OR (excluded.score_percentage = score_percentage AND excluded.time_taken < time_taken)
+'''
+
+TRIM_LEADERBOARD_SQL = '''
+    DELETE FROM leaderboard
+    WHERE subject = ?1 AND grade = ?2 AND user_name NOT IN (
+        SELECT user_name FROM leaderboard
+        WHERE subject = ?1 AND grade = ?2
+        ORDER BY score_percentage DESC, time_taken, session_id
+        LIMIT ?3
+    )
+'''
+
+LEADERBOARD_PAGE_SQL = '''
+    SELECT user_name, score_percentage, time_taken, session_id
+    FROM leaderboard
+    WHERE subject = ?1 AND grade = ?2
+      AND (score_percentage < ?3
+           OR (score_percentage = ?3 AND (time_taken > ?4 OR (time_taken = ?4 AND session_id > ?5))))
+    ORDER BY score_percentage DESC, time_taken, session_id
+    LIMIT ?6
+'''
+
+
+def scope_key(value):
+    """Leaderboard key of a subject or grade; '' for all"""
+    return '' if not value or value == 'all' else value
+
+
+def session_scopes(subject, grade):
+    """The (subject, grade) leaderboard scopes a session counts in"""
+    subject, grade = scope_key(subject), scope_key(grade)
+    return {(subject, grade), (subject, ''), ('', grade), ('', '')}
+
+
+def encode_cursor(values):
+    text = json.dumps(values, separators=(',', ':'))
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, kinds):
+    """Sort key values, of the given types, from a cursor made by encode_cursor"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        values = None
+    if (not isinstance(values, list) or len(values) != len(kinds)
+            or not all(isinstance(value, kind) and not isinstance(value, bool)
+                       for value, kind in zip(values, kinds))):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def create_history_tables(conn):
+    """Create the history index and the leaderboard, backfilling it from existing sessions"""
+    # Covers history pages and adaptive learner lookups; replaces the
+    # (user_name, id) indexes, which do not follow created_at across workers
+    conn.execute('DROP INDEX IF EXISTS idx_quiz_sessions_user')
+    conn.execute('DROP INDEX IF EXISTS idx_quiz_sessions_user_history')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_quiz_sessions_user_recent ON quiz_sessions
+        (user_name, created_at, id, subject, grade, total_questions, correct_answers, score_percentage, time_taken)
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS leaderboard (
+            subject TEXT NOT NULL,
+            grade TEXT NOT NULL,
+            user_name TEXT NOT NULL,
+            score_percentage REAL NOT NULL,
+            time_taken INTEGER NOT NULL,
+            session_id INTEGER NOT NULL,
+            PRIMARY KEY (subject, grade, user_name)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_leaderboard_rank ON leaderboard
+        (subject, grade, score_percentage DESC, time_taken, session_id)
+    ''')
+    has_leaders = conn.execute('SELECT 1 FROM leaderboard LIMIT 1').fetchone()
+    has_sessions = conn.execute('SELECT 1 FROM quiz_sessions LIMIT 1').fetchone()
+    if has_sessions and not has_leaders:
+        rebuild_leaderboard(conn)
+
+
+def rebuild_leaderboard(conn):
+    """Recompute every leaderboard scope from quiz_sessions"""
+    # One pass over the sessions in rank order: the first session of a user
+    # seen in a scope is their best there, until the scope is full
+    leaders = {}
+    placed = set()
+    for session_id, user_name, subject, grade, score, time_taken in conn.execute(RANKED_SESSIONS_SQL,
+                                                                                 (LEADERBOARD_MIN_QUESTIONS,)):
+        if user_name is None or user_name.strip().lower() in ANONYMOUS_NAMES:
+            continue
+        for scope in session_scopes(subject, grade):
+            entries = leaders.setdefault(scope, [])
+            if len(entries) < LEADERBOARD_SIZE and (scope, user_name) not in placed:
+                placed.add((scope, user_name))
+                entries.append((*scope, user_name, score, time_taken, session_id))
+    conn.execute('DELETE FROM leaderboard')
+    conn.executemany(INSERT_LEADER_SQL, [entry for entries in leaders.values() for entry in entries])
+
+
+def update_leaderboard(conn, sessions):
+    """Add (session_id, session_data) sessions written in the caller's transaction"""
+    rows = []
+    scopes = set()
+    for session_id, session_data in sessions:
+        user_name = session_data['user_name'] or ''
+        if (session_data['total_questions'] < LEADERBOARD_MIN_QUESTIONS
+                or user_name.strip().lower() in ANONYMOUS_NAMES):
+            continue
+        for subject, grade in session_scopes(session_data['subject'], session_data['grade']):
+            rows.append((subject, grade, user_name, session_data['score_percentage'],
+                         session_data['time_taken'] or 0, session_id))
+            scopes.add((subject, grade))
+    if not rows:
+        return
+    conn.executemany(UPSERT_LEADER_SQL, rows)
+    conn.executemany(TRIM_LEADERBOARD_SQL, [(subject, grade, LEADERBOARD_SIZE) for subject, grade in scopes])
+
+
+def read_history(conn, user_name, subject=None, limit=20, cursor=None):
+    """A page of a user's sessions, newest first, and the cursor of the next page"""
+    before_at, before_id = decode_cursor(cursor, (str, int)) if cursor else FIRST_PAGE_KEY
+    if subject and subject != 'all':
+        rows = conn.execute(HISTORY_SUBJECT_SQL, (user_name, before_at, before_id, subject, limit + 1)).fetchall()
+    else:
+        rows = conn.execute(HISTORY_SQL, (user_name, before_at, before_id, limit + 1)).fetchall()
+    sessions = [{
+        'session_id': session_id,
+        'subject': session_subject,
+        'grade': grade,
+        'total_questions': total_questions,
+        'correct_answers': correct_answers,
+        'score_percentage': round(score_percentage, 1),
+        'time_taken': time_taken,
+        'created_at': created_at,
+    } for (session_id, session_subject, grade, total_questions, correct_answers,
+           score_percentage, time_taken, created_at) in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor([sessions[-1]['created_at'], sessions[-1]['session_id']])
+    return sessions, next_cursor
+
+
+def read_leaderboard(conn, subject=None, grade=None, limit=20, cursor=None):
+    """A page of a scope's best users, highest score first, and the cursor of the next page"""
+    if cursor:
+        score, time_taken, session_id, rank = decode_cursor(cursor, ((int, float), (int, float), int, int))
+    else:
+        score, time_taken, session_id, rank = float('inf'), 0, 0, 0
+    rows = conn.execute(LEADERBOARD_PAGE_SQL, (scope_key(subject), scope_key(grade), score, time_taken,
+                                               session_id, limit + 1)).fetchall()
+    entries = []
+    for user_name, score, time_taken, session_id in rows[:limit]:
+        rank += 1
+        entries.append({'rank': rank, 'user_name': user_name, 'score_percentage': round(score, 1),
+                        'time_taken': time_taken, 'session_id': session_id})
+    next_cursor = None
+    if len(rows) > limit:
+        _, score, time_taken, session_id = rows[limit - 1]
+        next_cursor = encode_cursor([score, time_taken, session_id, rank])
+    return entries, next_cursor
@@ -0,0 +1,188 @@
+# result_writer.py - Write-behind queue for finished quiz results
+
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SessionIdAllocator:
+    """Hands out quiz_sessions ids from blocks reserved in sqlite_sequence
+
+    Reserving ids up front lets finish_quiz return the session id before the
+    row is written. AUTOINCREMENT never reuses or hands out ids at or below
+    the stored sequence, so blocks never collide across workers; ids left
+    unused when a worker exits only leave gaps.
+    """
+
+    def __init__(self, db, table='quiz_sessions', block_size=100):
+        self.db = db
+        self.table = table
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+        self._pid = None
+
+    def next_id(self):
+        with self._lock:
+            if self._pid != os.getpid() or self._next >= self._end:
+                self._next, self._end = self._reserve()
+                self._pid = os.getpid()
+            session_id = self._next
+            self._next += 1
+            return session_id
+
+    def _reserve(self):
+        with self.db.transaction(immediate=True) as conn:
+            row = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (self.table,)).fetchone()
+            max_id = conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {self.table}').fetchone()[0]
+            start = max(row[0] if row else 0, max_id) + 1
+            end = start + self.block_size
+            if row:
+                conn.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ?', (end - 1, self.table))
+            else:
+                conn.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (self.table, end - 1))
+        return start, end
+
+
+class ResultWriter:
+    """Background thread that writes finished quizzes in batched transactions
+
+    submit() queues a result and returns its session id immediately. The
+    writer thread collects results for up to `flush_interval` seconds (or
+    `max_batch` results) and hands them to `write_batch(conn, results)`
+    inside one transaction. The queue is bounded: when it is full, submit()
+    waits up to `submit_timeout` seconds and then writes synchronously.
+
+    A batch whose transaction fails is retried `batch_retries` times and then
+    written one result at a time; results that still fail are kept and
+    retried every `retry_interval` seconds, never dropped, since their
+    clients already hold the session ids. Queued results are flushed on
+    close(), which runs at interpreter exit.
+
+    Threads and SQLite connections do not survive fork(), so per-process
+    helpers (this writer, Database connections, the bank reloader and the
+    ASGI thread pool) are created lazily in each worker, keyed on its pid.
+    """
+
+    def __init__(self, db, write_batch, flush_interval=0.2, max_batch=500,
+                 max_queue=5000, submit_timeout=2.0, batch_retries=2, retry_interval=1.0):
+        self.db = db
+        self.write_batch = write_batch
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self.submit_timeout = submit_timeout
+        self.batch_retries = batch_retries
+        self.retry_interval = retry_interval
+        self.ids = SessionIdAllocator(db)
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        # Results that failed on their own, and flush() markers waiting on them
+        self._failed = []
+        self._markers = []
+        atexit.register(self.close)
+
+    def submit(self, session_data, attempts, session_id=None):
+        """Queue a finished quiz and return its session id, allocated unless given"""
+        result = (self.ids.next_id() if session_id is None else session_id, session_data, attempts)
+        if not self._closed:
+            self._ensure_started()
+            try:
+                self._queue.put(result, timeout=self.submit_timeout)
+                return result[0]
+            except queue.Full:
+                pass
+        # Writer closed or saturated: fall back to writing in the request
+        with self.db.transaction() as conn:
+            self.write_batch(conn, [result])
+        return result[0]
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.max_queue)
+                self._thread = threading.Thread(target=self._run, name='result-writer', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        pending = self._queue
+        while True:
+            try:
+                # Wake up to retry failed results even when nothing new arrives
+                batch = [pending.get(timeout=self.retry_interval if self._failed else None)]
+            except queue.Empty:
+                batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while batch and batch[-1] is not None and len(batch) < self.max_batch:
+                try:
+                    batch.append(pending.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            stop = bool(batch) and batch[-1] is None
+            # flush() markers are released once everything queued before them is written
+            self._markers.extend(item for item in batch if isinstance(item, threading.Event))
+            results = self._failed + [item for item in batch if isinstance(item, tuple)]
+            self._failed = self._flush(results) if results else []
+            if not self._failed:
+                for marker in self._markers:
+                    marker.set()
+                self._markers = []
+            for _ in batch:
+                pending.task_done()
+            if stop:
+                if self._failed:
+                    logger.error('could not write %d quiz results before exit: %r',
+                                 len(self._failed), self._failed)
+                return
+
+    def _flush(self, results):
+        """Write results, returning the ones that could not be written"""
+        for attempt in range(self.batch_retries + 1):
+            try:
+                with self.db.transaction() as conn:
+                    self.write_batch(conn, results)
+                return []
+            except Exception:
+                logger.warning('writing %d quiz results failed (attempt %d)',
+                               len(results), attempt + 1, exc_info=True)
+        # Keep one bad result from holding back the rest of the batch
+        failed = []
+        for result in results:
+            try:
+                with self.db.transaction() as conn:
+                    self.write_batch(conn, [result])
+            except Exception:
+                logger.exception('writing quiz result %d failed, will retry', result[0])
+                failed.append(result)
+        return failed
+
+    def flush(self, timeout=None):
+        """Block until the results queued before this call have been written
+
+        Returns False if `timeout` seconds pass first.
+        """
+        if self._pid != os.getpid() or self._closed:
+            return True
+        marker = threading.Event()
+        self._queue.put(marker)
+        return marker.wait(timeout)
+
+    def close(self):
+        """Write out queued results and stop the writer thread"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
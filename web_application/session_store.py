@@ -0,0 +1,166 @@
+# session_store.py - Server-side storage for in-progress quiz state
+
+import copy
+import json
+import secrets
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from database import Database
+
+
+class QuizSessionStore(ABC):
+    """Base class for quiz state keyed by an opaque quiz id, expiring after `ttl` seconds idle
+
+    Every write bumps a per-quiz version. Read-modify-write callers pass the
+    version they read to put(), which then only writes if nobody else has
+    written the quiz since (compare-and-swap), so concurrent requests for one
+    quiz cannot overwrite each other's answers.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    def new_id(self):
+        """Generate an opaque quiz id for the session cookie"""
+        return secrets.token_urlsafe(16)
+
+    def get(self, quiz_id):
+        """Return the stored state, or None if missing or expired"""
+        return self.get_versioned(quiz_id)[0]
+
+    @abstractmethod
+    def get_versioned(self, quiz_id):
+        """Return (state, version), or (None, None) if missing or expired"""
+
+    @abstractmethod
+    def put(self, quiz_id, state, version=None):
+        """Store state and refresh its expiry; with a version, only if it is still current
+
+        Returns False when `version` is given and the quiz was written since.
+        """
+
+    @abstractmethod
+    def delete(self, quiz_id):
+        """Drop state for a finished quiz"""
+
+
+class MemorySessionStore(QuizSessionStore):
+    """In-process LRU store; only suitable when a single process serves quizzes"""
+
+    def __init__(self, ttl, max_entries=10000):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_versioned(self, quiz_id):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(quiz_id)
+            if entry is None:
+                return None, None
+            expires_at, state, version = entry
+            if expires_at <= now:
+                del self._entries[quiz_id]
+                return None, None
+            # Sliding expiry keeps the dict ordered by expiry time
+            self._entries[quiz_id] = (now + self.ttl, state, version)
+            self._entries.move_to_end(quiz_id)
+        # Callers modify what they read; keep the stored state untouched until put()
+        return copy.deepcopy(state), version
+
+    def put(self, quiz_id, state, version=None):
+        now = time.time()
+        state = copy.deepcopy(state)
+        with self._lock:
+            entry = self._entries.get(quiz_id)
+            current = entry[2] if entry is not None and entry[0] > now else None
+            if version is not None and version != current:
+                return False
+            self._entries[quiz_id] = (now + self.ttl, state, (current or 0) + 1)
+            self._entries.move_to_end(quiz_id)
+            self._evict(now)
+        return True
+
+    def delete(self, quiz_id):
+        with self._lock:
+            self._entries.pop(quiz_id, None)
+
+    def _evict(self, now):
+        """Drop expired entries and the least recently used beyond max_entries"""
+        while self._entries:
+            quiz_id, (expires_at, _, _) = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[quiz_id]
+
+
+class SQLiteSessionStore(QuizSessionStore):
+    """SQLite-backed store shared by every worker process on the host"""
+
+    # Purge expired rows once every this many writes
+    PURGE_EVERY = 200
+
+    def __init__(self, ttl, db_file):
+        super().__init__(ttl)
+        self.db = Database(db_file)
+        self._writes = 0
+
+        with self.db.transaction() as conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS quiz_state (
+                    quiz_id TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    version INTEGER NOT NULL DEFAULT 1
+                )
+            ''')
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(quiz_state)')}
+            if 'version' not in columns:
+                conn.execute('ALTER TABLE quiz_state ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_quiz_state_expires ON quiz_state (expires_at)')
+
+    def get_versioned(self, quiz_id):
+        row = self.db.connection().execute(
+            'SELECT state, version FROM quiz_state WHERE quiz_id = ? AND expires_at > ?',
+            (quiz_id, time.time())
+        ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else (None, None)
+
+    def put(self, quiz_id, state, version=None):
+        now = time.time()
+        state = json.dumps(state, separators=(',', ':'))
+        with self.db.transaction() as conn:
+            if version is None:
+                conn.execute('''
+                    INSERT INTO quiz_state (quiz_id, state, expires_at) VALUES (?, ?, ?)
+                    ON CONFLICT (quiz_id) DO UPDATE SET
+                        state = excluded.state, expires_at = excluded.expires_at, version = version + 1
+                ''', (quiz_id, state, now + self.ttl))
+            else:
+                updated = conn.execute('''
+                    UPDATE quiz_state SET state = ?, expires_at = ?, version = version + 1
+                    WHERE quiz_id = ? AND version = ? AND expires_at > ?
+                ''', (state, now + self.ttl, quiz_id, version, now)).rowcount
+                if not updated:
+                    return False
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                conn.execute('DELETE FROM quiz_state WHERE expires_at <= ?', (now,))
+        return True
+
+    def delete(self, quiz_id):
+        with self.db.transaction() as conn:
+            conn.execute('DELETE FROM quiz_state WHERE quiz_id = ?', (quiz_id,))
+
+
+def create_session_store(backend, ttl, db_file):
+    """Create the configured quiz session store ('memory' or 'sqlite')"""
+    if backend == 'memory':
+        return MemorySessionStore(ttl)
+    if backend == 'sqlite':
+        return SQLiteSessionStore(ttl, db_file)
+    raise ValueError(f"Unknown quiz session backend: {backend}")
@@ -226,6 +226,10 @@ class QuizApp {
         this.timer = null;
         this.elapsedTime = 0;
         
+        // Answers that could not be sent yet; flushed through /submit_answers
+        this.pendingAnswers = [];
+        window.addEventListener('online', () => this.flushPendingAnswers().catch(() => {}));
+        
         // Initialize professional alert system
         this.alertSystem = new AlertSystem();
         
@@ -337,7 +341,8 @@ class QuizApp {
             user_name: document.getElementById('user_name').value,
             subject: document.getElementById('subject').value,
             grade: document.getElementById('grade').value,
-            num_questions: document.getElementById('num_questions').value
+            num_questions: document.getElementById('num_questions').value,
+            mode: document.getElementById('mode') ? document.getElementById('mode').value : 'random'
         };
         
         if (!formData.user_name.trim()) {
@@ -403,7 +408,9 @@ class QuizApp {
                 this.totalQuestions = data.total_questions;
                 this.currentQuestion = 0;
                 this.answers = [];
+                this.pendingAnswers = [];
                 this.startTime = new Date();
+                await this.loadQuizBootstrap();
                 
                 // Show success notification
                 this.alertSystem.success(`Quiz started! You have ${data.total_questions} questions to answer.`, 'Quiz Started');
@@ -432,7 +439,27 @@ class QuizApp {
         }
     }
     
+    async loadQuizBootstrap() {
+        // Fetch every question of the quiz in one request; per-question requests are the fallback
+        this.questions = null;
+        try {
+            const response = await fetch('/quiz_bootstrap');
+            if (response.ok) {
+                const data = await response.json();
+                this.questions = data.questions;
+            }
+        } catch (error) {
+            console.error('Error loading quiz questions:', error);
+        }
+    }
+    
     async loadQuestion(questionNum) {
+        if (this.questions && this.questions[questionNum]) {
+            this.displayQuestion(this.questions[questionNum], questionNum + 1, this.totalQuestions);
+            this.questionStartTime = new Date();
+            return;
+        }
+        
         try {
             const response = await fetch(`/get_question/${questionNum}`);
             const data = await response.json();
@@ -471,13 +498,14 @@ class QuizApp {
         // Display question info
         document.getElementById('question-subject').textContent = question.subject;
         document.getElementById('question-grade').textContent = question.grade;
-        document.getElementById('question-text').innerHTML = question.question; // Changed to innerHTML for math rendering
+        // Server pre-rendered math (question_html/options_html) is shown as is
+        document.getElementById('question-text').innerHTML = question.question_html || question.question; // Changed to innerHTML for math rendering
         
         // Display options
         const optionsContainer = document.getElementById('options-container');
         optionsContainer.innerHTML = '';
         
-        Object.entries(question.options).forEach(([key, value]) => {
+        Object.entries(question.options_html || question.options).forEach(([key, value]) => {
             const optionDiv = document.createElement('div');
             optionDiv.className = 'option-card';
             optionDiv.dataset.option = key.toLowerCase();
@@ -500,8 +528,8 @@ class QuizApp {
         document.getElementById('submit-answer').disabled = true;
         document.getElementById('answer-feedback').style.display = 'none';
         
-        // Render MathJax for mathematical expressions
-        if (window.MathJax && window.MathJax.typesetPromise) {
+        // Render MathJax for mathematical expressions, unless the server already did
+        if (!question.rendered && window.MathJax && window.MathJax.typesetPromise) {
             window.MathJax.typesetPromise([document.getElementById('question-text'), optionsContainer])
                 .catch((err) => console.log('MathJax typeset failed: ' + err.message));
         }
@@ -523,6 +551,13 @@ class QuizApp {
         if (!this.selectedAnswer) return;
         
         const timeSpent = Math.floor((new Date() - this.questionStartTime) / 1000);
+        // The key lets the server ignore this answer if it is sent again
+        const answer = {
+            key: `${Date.now()}-${this.currentQuestion + 1}-${Math.random().toString(36).slice(2)}`,
+            answer: this.selectedAnswer,
+            question_number: this.currentQuestion + 1,
+            time_spent: timeSpent
+        };
         
         try {
             const response = await fetch('/submit_answer', {
@@ -530,24 +565,57 @@ class QuizApp {
                 headers: {
                     'Content-Type': 'application/json',
                 },
-                body: JSON.stringify({
-                    answer: this.selectedAnswer,
-                    question_number: this.currentQuestion + 1,
-                    time_spent: timeSpent
-                })
+                body: JSON.stringify(answer)
             });
             
             const data = await response.json();
             this.showAnswerFeedback(data);
             
         } catch (error) {
+            // Offline: keep the answer and send it with the next flush
             console.error('Error submitting answer:', error);
-            this.alertSystem.showAlert({
-                type: 'error',
-                title: 'Submit Failed',
-                message: 'Failed to submit answer due to network issues. Please try again.',
-                buttons: [{ text: 'OK', primary: true }]
-            });
+            this.pendingAnswers.push(answer);
+            this.showOfflineFeedback();
+        }
+    }
+    
+    async flushPendingAnswers(finish = false) {
+        // Send buffered answers in one request; finishing also ends the quiz
+        if (!this.pendingAnswers.length && !finish) return null;
+        const sending = this.pendingAnswers.slice();
+        const response = await fetch('/submit_answers', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ answers: sending, finish: finish })
+        });
+        const data = await response.json();
+        if (response.ok) {
+            this.pendingAnswers = this.pendingAnswers.filter(answer => !sending.includes(answer));
+        }
+        return data;
+    }
+    
+    showOfflineFeedback() {
+        document.getElementById('feedback-content').innerHTML = `
+            <div class="feedback-incorrect">
+                <i class="fas fa-wifi fa-3x mb-3"></i>
+                <h4>Answer saved</h4>
+                <p>You seem to be offline. Your answer will be sent when the connection is back.</p>
+            </div>
+        `;
+        document.getElementById('answer-feedback').style.display = 'block';
+        document.getElementById('submit-answer').style.display = 'none';
+        this.updateNextButton();
+    }
+    
+    updateNextButton() {
+        const nextButton = document.getElementById('next-question');
+        if (this.currentQuestion + 1 >= this.totalQuestions) {
+            nextButton.innerHTML = '<i class="fas fa-flag-checkered me-2"></i>Finish Quiz';
+        } else {
+            nextButton.innerHTML = '<i class="fas fa-arrow-right me-2"></i>Next Question';
         }
     }
     
@@ -586,12 +654,7 @@ class QuizApp {
         }
         
         // Update next button text
-        const nextButton = document.getElementById('next-question');
-        if (this.currentQuestion + 1 >= this.totalQuestions) {
-            nextButton.innerHTML = '<i class="fas fa-flag-checkered me-2"></i>Finish Quiz';
-        } else {
-            nextButton.innerHTML = '<i class="fas fa-arrow-right me-2"></i>Next Question';
-        }
+        this.updateNextButton();
     }
     
     async nextQuestion() {
@@ -607,15 +670,22 @@ class QuizApp {
     
     async finishQuiz() {
         try {
-            const response = await fetch('/finish_quiz', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                }
-            });
-            
-            const data = await response.json();
-            this.showResults(data.results);
+            let data;
+            if (this.pendingAnswers.length) {
+                // Send answers buffered offline and finish in the same request
+                data = await this.flushPendingAnswers(true);
+            } else {
+                const response = await fetch('/finish_quiz', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                    }
+                });
+                data = await response.json();
+            }
+            // /submit_answers reports the score under `score`; /finish_quiz and
+            // retried finishes return the stored result with it under `results`
+            this.showResults(data.score || data.results);
             
             // Show completion notification
             this.alertSystem.success('Congratulations! You have completed the quiz.', 'Quiz Completed');
@@ -625,8 +695,8 @@ class QuizApp {
             this.alertSystem.showAlert({
                 type: 'error',
                 title: 'Finish Failed',
-                message: 'Failed to finish quiz due to network issues. Please try again.',
-                buttons: [{ text: 'OK', primary: true }]
+                message: 'Failed to finish quiz due to network issues. Your answers are kept; please try again.',
+                buttons: [{ text: 'Retry', action: () => this.finishQuiz(), primary: true }]
             });
         }
     }
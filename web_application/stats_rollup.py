@@ -0,0 +1,83 @@
+# stats_rollup.py - Incrementally maintained aggregates for /api/stats
+
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+# Aggregated dimensions; 'overall' uses a single '' key and 'day' is a UTC date
+DIMENSIONS = ('overall', 'subject', 'grade', 'day')
+
+UPSERT_ROLLUP_SQL = '''
+    INSERT INTO stats_rollup (dimension, key, sessions, score_sum)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (dimension, key) DO UPDATE SET
+        sessions = sessions + excluded.sessions,
+        score_sum = score_sum + excluded.score_sum
+'''
+
+
+def create_rollup_tables(conn):
+    """Create the rollup table and backfill it from existing sessions"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stats_rollup (
+            dimension TEXT NOT NULL,
+            key TEXT NOT NULL,
+            sessions INTEGER NOT NULL,
+            score_sum REAL NOT NULL,
+            PRIMARY KEY (dimension, key)
+        ) WITHOUT ROWID
+    ''')
+    has_rollups = conn.execute('SELECT 1 FROM stats_rollup LIMIT 1').fetchone()
+    has_sessions = conn.execute('SELECT 1 FROM quiz_sessions LIMIT 1').fetchone()
+    if has_sessions and not has_rollups:
+        rebuild_rollups(conn)
+
+
+def rebuild_rollups(conn):
+    """Recompute every rollup from quiz_sessions"""
+    conn.execute('DELETE FROM stats_rollup')
+    conn.execute('''
+        INSERT INTO stats_rollup (dimension, key, sessions, score_sum)
+        SELECT 'overall', '', COUNT(*), COALESCE(SUM(score_percentage), 0) FROM quiz_sessions
+        UNION ALL
+        SELECT 'subject', COALESCE(subject, ''), COUNT(*), COALESCE(SUM(score_percentage), 0)
+        FROM quiz_sessions GROUP BY COALESCE(subject, '')
+        UNION ALL
+        SELECT 'grade', COALESCE(grade, ''), COUNT(*), COALESCE(SUM(score_percentage), 0)
+        FROM quiz_sessions GROUP BY COALESCE(grade, '')
+        UNION ALL
+        SELECT 'day', date(created_at), COUNT(*), COALESCE(SUM(score_percentage), 0)
+        FROM quiz_sessions GROUP BY date(created_at)
+    ''')
+
+
+def update_rollups(conn, sessions):
+    """Add (subject, grade, score_percentage) sessions written in the caller's transaction"""
+    today = datetime.now(timezone.utc).date().isoformat()
+    totals = defaultdict(lambda: [0, 0.0])
+    for subject, grade, score in sessions:
+        for key in (('overall', ''), ('subject', subject or ''), ('grade', grade or ''), ('day', today)):
+            totals[key][0] += 1
+            totals[key][1] += score
+    conn.executemany(UPSERT_ROLLUP_SQL, [
+        (dimension, key, count, score_sum) for (dimension, key), (count, score_sum) in totals.items()
+    ])
+
+
+def read_stats(conn, days=30):
+    """Overall, per-subject, per-grade and last-`days` aggregates from the rollups"""
+    since = (datetime.now(timezone.utc).date() - timedelta(days=max(days, 1) - 1)).isoformat()
+    rows = conn.execute('''
+        SELECT dimension, key, sessions, score_sum FROM stats_rollup
+        WHERE dimension IN ('overall', 'subject', 'grade')
+           OR (dimension = 'day' AND key >= ?)
+    ''', (since,)).fetchall()
+
+    stats = {dimension: {} for dimension in DIMENSIONS}
+    for dimension, key, sessions, score_sum in rows:
+        stats[dimension][key] = (sessions, score_sum)
+    return stats
+
+
+def average(sessions, score_sum):
+    """Rounded average score, 0 when there are no sessions"""
+    return round(score_sum / sessions, 1) if sessions else 0